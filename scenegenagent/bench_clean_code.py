@@ -0,0 +1,138 @@
+import re
+import json
+import time
+import random
+from argparse import ArgumentParser
+from cleaning import clean_code, replay_clean_history
+from emitter import emit_code
+from catalog import guidance_index
+
+# the steps of clean_code before the rewrite, kept as the reference
+def get_code_from_response(code):
+    head = '```csharp\n'
+    tail = '```'
+    pos_head = code.find(head)
+    if pos_head != -1:
+        code = code[pos_head + len(head):]
+        pos_tail = code.find(tail)
+        if pos_tail != -1:
+            code = code[:pos_tail]
+    marker_start = 'string rootDir = TxApplication.SystemRootDirectory;'
+    if code.find(marker_start) == -1:
+        return ""
+    pos_indents = -1
+    lines = code.split('\n')
+    lines_new = []
+    for l in lines:
+        if pos_indents == -1 and marker_start in l:
+            pos_indents = l.find(marker_start)
+        if pos_indents >= 0:
+            if l.strip() == '' or l.startswith(' ' * pos_indents):
+                lines_new.append(l[pos_indents:])
+    return '\n'.join(lines_new)
+
+def add_necessary_code(code):
+    code = re.sub(r'^(//.*|\n)+', '', code)
+    added_parts = []
+    if not code.startswith("string rootDir = TxApplication.SystemRootDirectory;"):
+        added_code = """string rootDir = TxApplication.SystemRootDirectory;
+
+string weldingLibPath = Path.Combine(rootDir, "Welding");
+string[] weldingModels = Directory.GetDirectories(weldingLibPath, "*.cojt", SearchOption.TopDirectoryOnly);
+
+"""
+        code = added_code + code.lstrip()
+        added_parts.append(added_code)
+        
+    if 'Random rand = new Random();' not in code:
+        added_code = "Random rand = new Random();\nTxPhysicalRoot txPhysicalRoot = TxApplication.ActiveDocument.PhysicalRoot;"
+        code = code.replace("TxPhysicalRoot txPhysicalRoot = TxApplication.ActiveDocument.PhysicalRoot;", added_code)
+        added_parts.append(added_code)
+    
+    code = re.sub(r'Console.Write(Line)?', 'output.Write', code)
+
+    end_code = "TxApplication.RefreshDisplay();"
+    end_pos = code.find(end_code)
+    if end_pos != -1:
+        code = code[:end_pos + len(end_code)]
+    else:
+        code = code.rstrip() + '\n\n' + end_code
+        added_parts.append(end_code)
+    return code, added_parts
+
+def fix_obj_index(code):
+    re_cond = r'(if \([\w\d]+\.Count >(=?\s*\d+\s*)\))'
+    for cond, num in re.findall(re_cond, code):
+        if num != ' 0':
+            new_cond = cond.replace(num, ' 0')
+            code = code.replace(cond, new_cond)
+    re_idx = r'(DirectoryInfo [\w\d]+ = ([\w\d]+)(\[.*?\]);)'
+    for line, lst, idx in re.findall(re_idx, code):
+        new_idx = f'[rand.Next(0, {lst}.Count)]'
+        if idx != new_idx:
+            new_line = line.replace(idx, new_idx)
+            code = code.replace(line, new_line)
+    return code
+
+def legacy_clean_code(code, return_history=False):
+    clean_history = [["Original", code]]
+    if not code:
+        if return_history:
+            return None, None
+        return None
+    code = get_code_from_response(code)
+    if code != clean_history[-1][1]:
+        clean_history.append(["Get code from response", code])
+    code, added_parts = add_necessary_code(code)
+    if len(added_parts) > 0:
+        clean_history.append(["Added following code:\n{}".format("\n\n".join(added_parts)), code])
+    code = fix_obj_index(code)
+    if code != clean_history[-1][1]:
+        clean_history.append(["Fix invalid index", code])
+    if return_history:
+        return code, clean_history
+    return code
+
+def make_response(num_objects, seed=0):
+    # a long model response with the mistakes clean_code repairs
+    rand = random.Random(seed)
+    names = sorted(guidance_index.objects().keys())
+    placement = [{
+        "name": f"{rand.choice(names)} {i}",
+        "position": f"[{rand.randint(-50, 50) * 1000}, {rand.randint(-50, 50) * 1000}, 0]",
+        "orientation": f"{rand.choice([0, 90, 180, 270])} degrees",
+    } for i in range(num_objects)]
+    code = emit_code(placement, guidance_index.objects())
+    code = code.replace("Random rand = new Random();\n", "")
+    code = re.sub(r'\[rand\.Next\(0, (\w+)\.Count\)\]', lambda m: rand.choice([m.group(0), '[0]', '[1]', f'[{m.group(1)}.Count - 1]']), code)
+    code = re.sub(r'(ITxComponent txComponentObject(\d+) = )', lambda m: f'if (robotModelsKR125.Count > {rand.randint(0, 3)})\n    Console.WriteLine("object {m.group(2)}");\n' + m.group(1), code)
+    code = '\n'.join('    ' + l if l else l for l in code.split('\n'))
+    return "Here is the code:\n```csharp\n" + code + "\nConsole.WriteLine(\"done\");\n```\nThe scene has " + str(num_objects) + " objects."
+
+def bench(func, code, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(code)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--objects', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'objects':>8} {'bytes':>9} {'legacy ms':>10} {'clean ms':>10} {'speedup':>8} {'history legacy ms':>18} {'history clean ms':>17} {'legacy history B':>17} {'diff history B':>15}")
+    for num_objects in args.objects:
+        response = make_response(num_objects)
+        legacy_time, legacy_code = bench(legacy_clean_code, response, args.repeat)
+        clean_time, code = bench(clean_code, response, args.repeat)
+        assert code == legacy_code, "clean_code differs from the legacy implementation"
+        legacy_history_time, (_, legacy_history) = bench(lambda c: legacy_clean_code(c, return_history=True), response, args.repeat)
+        history_time, (_, history) = bench(lambda c: clean_code(c, return_history=True), response, args.repeat)
+        assert [h[0] for h in history] == [h[0] for h in legacy_history]
+        assert replay_clean_history(history) == [h[1] for h in legacy_history], "replayed history differs from the legacy snapshots"
+        legacy_bytes = len(json.dumps(legacy_history))
+        history_bytes = len(json.dumps(history))
+        print(f"{num_objects:>8} {len(response):>9} {legacy_time * 1000:>10.2f} {clean_time * 1000:>10.2f} {legacy_time / clean_time:>7.1f}x {legacy_history_time * 1000:>18.2f} {history_time * 1000:>17.2f} {legacy_bytes:>17} {history_bytes:>15}")
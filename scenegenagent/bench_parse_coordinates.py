@@ -0,0 +1,105 @@
+import re
+import json
+import time
+import random
+import traceback
+from argparse import ArgumentParser
+from catalog import permission_list, object_permitted
+from placement_format import parse_table
+from layout_analysis import parse_coordinates, expand_arrangements
+
+# parse_coordinates before the literal parser, kept as the reference
+def legacy_parse_coordinates(text, coordinates, verbose=True):
+    coords = []
+    for re_coord in [
+        r"#Step 2:[\s\S]+?\nPositions:\s*([\s\S]*?)\s*(?:`|#Step 3)",
+        r"#Step 3:[\s\S]+?\nPositions:\s*([\s\S]*?)\s*(?:`|$)",
+    ]:
+        coord = re.findall(re_coord, text)
+        if len(coord) == 0:
+            coord = None
+        else:
+            coord = coord[0]
+            if '{' not in coord and '|' in coord:
+                coord = parse_table(coord)
+            else:
+                startpos, endpos = coord.find('['), coord.rfind(']')
+                coord = None if startpos == -1 or endpos == -1 or startpos >= endpos else coord[startpos:endpos + 1]
+        coords.append(coord)
+    coord_1, coord_2 = coords[0], coords[1]
+    if coord_1 is None or coord_2 is None:
+        return None
+    try:
+        coord_1, coord_2 = [eval(c.strip().replace('//', '#')) if isinstance(c, str) else c for c in [coord_1, coord_2]]
+        assert isinstance(coord_1, list) and isinstance(coord_2, list)
+        coords = {}
+        for cs in [json.loads(coordinates), coord_1, coord_2]:
+            for c in expand_arrangements(cs, coords):
+                name = c.pop('name')
+                if object_permitted(name):
+                    coords[ name ] = c
+        coords = [{"name": n, **p} for n, p in coords.items()]
+        return coords
+    except Exception as e:
+        if verbose:
+            print(traceback.format_exc())
+        return None
+
+def make_output(num_objects, style, seed=0):
+    # an assign_placement response in one of the styles the models write
+    rand = random.Random(seed)
+    placement = [{
+        "name": f"{rand.choice(permission_list)} {i + 1}",
+        "position": f"[{rand.randint(-20, 20) * 500}, {rand.randint(-20, 20) * 500}, 0]",
+        "orientation": f"{rand.choice([0, 90, 180, 270])} degrees",
+    } for i in range(num_objects)]
+    lines = [json.dumps(p, indent=4).replace('\n', '\n    ') for p in placement]
+    if style == 'python':
+        lines = [l.replace('"', "'") for l in lines]
+    commas = [','] * (len(lines) - 1) + [',' if style == 'trailing_comma' else '']
+    comments = [f' // object {i + 1}' if style == 'comments' else '' for i in range(len(lines))]
+    positions = '[\n    ' + '\n    '.join(l + c + m for l, c, m in zip(lines, commas, comments)) + '\n]'
+    return ("#Step 1: Rewrite Relative Position#\nAnalysis: The objects are placed in rows.\nNew Relative Positions:\n[]\n\n"
+            f"#Step 2: Calculate Coordinates#\nAnalysis: Each object is 500 mm apart.\nPositions:\n{positions}\n\n"
+            f"#Step 3: Assign Positions#\nAnalysis: No object overlaps.\nPositions:\n{positions}")
+
+def load_corpus(path):
+    # model outputs saved by collect_assign_placement.py or eval.py
+    corpus = []
+    for line in open(path, encoding='utf-8'):
+        d = json.loads(line)
+        output = d.get('model_output') or d.get('model_output_assign_placement')
+        if output:
+            corpus.append((output, d.get('coordinates') or '[]'))
+    return corpus
+
+def bench(func, corpus, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        results = [func(output, coordinates, verbose=False) for output, coordinates in corpus]
+        best = min(best, time.perf_counter() - start)
+    return best, results
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--corpus', type=str, default=None, help='jsonl file of assign_placement outputs, e.g. data_prompt_assign_placement.jsonl')
+    parser.add_argument('--objects', type=int, nargs='+', default=[5, 20, 100])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    if args.corpus is not None:
+        corpora = [('corpus', len(load_corpus(args.corpus)), load_corpus(args.corpus))]
+    else:
+        corpora = [(style, n, [(make_output(n, style, seed), '[]') for seed in range(20)])
+                   for n in args.objects for style in ['json', 'python', 'comments', 'trailing_comma']]
+
+    print(f"{'style':>15} {'objects':>8} {'legacy ms':>10} {'literal ms':>11} {'speedup':>8} {'legacy parsed':>14} {'literal parsed':>15}")
+    for style, n, corpus in corpora:
+        legacy_time, legacy_results = bench(legacy_parse_coordinates, corpus, args.repeat)
+        literal_time, literal_results = bench(parse_coordinates, corpus, args.repeat)
+        for old, new in zip(legacy_results, literal_results):
+            # the literal parser may accept outputs eval rejected, but never disagrees with it
+            assert old is None or old == new.to_placement(), (old, new)
+        print(f"{style:>15} {n:>8} {legacy_time * 1000:>10.2f} {literal_time * 1000:>11.2f} {legacy_time / literal_time:>7.1f}x "
+              f"{sum(r is not None for r in legacy_results):>14} {sum(r is not None for r in literal_results):>15}")
@@ -0,0 +1,189 @@
+import re
+import json
+import time
+import random
+from argparse import ArgumentParser
+from catalog import item_list
+from rules import normalize_units, filter_descriptions
+
+# the description rules before the rule engine, kept as the reference
+def legacy_change_units(text):
+    text = text.replace('(', '[').replace(')', ']')
+    # remove mm unit outside coord
+    matches = re.findall(r'(\[-?\d+(\.\d+)?,\s*-?\d+(\.\d+)?(,\s*-?\d+(\.\d+)?)?\]\s*(mm| millimeters))', text)
+    for match in matches:
+        value = match[0]
+        value = re.sub(r'\s*mm', '', value).strip()
+        value = re.sub(r'\s*millimeters', '', value).strip()
+        text = text.replace(match[0], value)
+    # convert [x m, y m] to [x * 1000, y * 1000]
+    matches = re.findall(r'(\[(-?\d+(?:\.\d+)?)\s*m,\s*(-?\d+(?:\.\d+)?)\s*m\])', text)
+    for match in matches:
+        value = f"[{int(float(match[1]) * 1000)}, {int(float(match[2]) * 1000)}]"
+        text = text.replace(match[0], value)
+    # convert [x m, y m, z m] to [x * 1000, y * 1000, z * 1000]
+    matches = re.findall(r'(\[(-?\d+(?:\.\d+)?)\s*m,\s*(-?\d+(?:\.\d+)?)\s*m,\s*(-?\d+(?:\.\d+)?)\s*m?\])', text)
+    for match in matches:
+        value = f"[{int(float(match[1]) * 1000)}, {int(float(match[2]) * 1000)}, {int(float(match[3]) * 1000)}]"
+        text = text.replace(match[0], value)
+    # remove mm unit inside coord
+    matches = re.findall(r'(\[(-?\d+(?:\.\d+)?)\s*mm,\s*(-?\d+(?:\.\d+)?)\s*mm(,\s*(-?\d+(?:\.\d+)?)\s*mm)?\])', text)
+    for match in matches:
+        value = re.sub(r'\s*mm', '', match[0]).strip()
+        text = text.replace(match[0], value)
+    # replace cm with m in plain text
+    matches = re.findall(r'(\d+(\.\d+)?\s*(?:cm|centimeters))', text)
+    for match in matches:
+        value = match[0]
+        value = re.sub(r'cm|centimeters', '', value).strip()
+        value = float(value) / 100
+        text = text.replace(match[0], str(value) + ' meters')
+    # add zero to z-axis
+    matches = re.findall(r'(\[(-?\d+(?:\.\d+)?)\s*,\s*(-?\d+(?:\.\d+)?)\s*\])', text)
+    for match in matches:
+        value = match[0][:-1].rstrip() + ', 0]'
+        text = text.replace(match[0], value)
+    # change z-axis to zero
+    matches = re.findall(r'(\[-?\d+(?:\.\d+)?\s*,\s*-?\d+(?:\.\d+)?\s*,\s*(-?\d+(?:\.\d+)?\s*\]))', text)
+    for match in matches:
+        value = re.sub(match[1], '0]', match[0]).strip()
+        text = text.replace(match[0], value)
+    # reformat coords
+    matches = re.findall(r'(\[\s*(-?\d+(?:\.\d+)?)\s*,\s*(-?\d+(?:\.\d+)?)\s*,\s*(-?\d+(?:\.\d+)?)\s*\])', text)
+    for match in matches:
+        value = f"[{match[1]}, {match[2]}, {match[3]}]"
+        text = text.replace(match[0], value)
+    return text
+
+# the legacy unit rules with each match replaced once, where it was found.
+# The legacy code replaced every match all over the text with str.replace, so
+# "50 cm and 150 cm" became "0.5 meters and 10.5 meters"; fixing that is the
+# only intended difference of normalize_units
+def legacy_change_units_in_place(text):
+    text = text.replace('(', '[').replace(')', ']')
+    text = re.sub(r'\[-?\d+(\.\d+)?,\s*-?\d+(\.\d+)?(,\s*-?\d+(\.\d+)?)?\]\s*(mm| millimeters)', lambda m: re.sub(r'\s*millimeters', '', re.sub(r'\s*mm', '', m.group())).strip(), text)
+    text = re.sub(r'\[(-?\d+(?:\.\d+)?)\s*m,\s*(-?\d+(?:\.\d+)?)\s*m\]', lambda m: f"[{int(float(m.group(1)) * 1000)}, {int(float(m.group(2)) * 1000)}]", text)
+    text = re.sub(r'\[(-?\d+(?:\.\d+)?)\s*m,\s*(-?\d+(?:\.\d+)?)\s*m,\s*(-?\d+(?:\.\d+)?)\s*m?\]', lambda m: f"[{int(float(m.group(1)) * 1000)}, {int(float(m.group(2)) * 1000)}, {int(float(m.group(3)) * 1000)}]", text)
+    text = re.sub(r'\[(-?\d+(?:\.\d+)?)\s*mm,\s*(-?\d+(?:\.\d+)?)\s*mm(,\s*(-?\d+(?:\.\d+)?)\s*mm)?\]', lambda m: re.sub(r'\s*mm', '', m.group()).strip(), text)
+    text = re.sub(r'\d+(\.\d+)?\s*(?:cm|centimeters)', lambda m: str(float(re.sub(r'cm|centimeters', '', m.group()).strip()) / 100) + ' meters', text)
+    text = re.sub(r'\[(-?\d+(?:\.\d+)?)\s*,\s*(-?\d+(?:\.\d+)?)\s*\]', lambda m: m.group()[:-1].rstrip() + ', 0]', text)
+    text = re.sub(r'(\[-?\d+(?:\.\d+)?\s*,\s*-?\d+(?:\.\d+)?\s*,\s*)(-?\d+(?:\.\d+)?\s*\])', lambda m: m.group(1) + '0]', text)
+    text = re.sub(r'\[\s*(-?\d+(?:\.\d+)?)\s*,\s*(-?\d+(?:\.\d+)?)\s*,\s*(-?\d+(?:\.\d+)?)\s*\]', lambda m: f"[{m.group(1)}, {m.group(2)}, {m.group(3)}]", text)
+    return text
+
+# (description, legacy result, normalize_units result) of the double replacement
+known_unit_fixes = [
+    ("The Cabinet is 50 cm and the Robot 150 cm from the Conveyor.", "The Cabinet is 0.5 meters and the Robot 10.5 meters from the Conveyor.", "The Cabinet is 0.5 meters and the Robot 1.5 meters from the Conveyor."),
+    ("Place a Guarding at [0cm, 4750cm].", "Place a Guarding at [0.0 meters, 4750.0 meters].", "Place a Guarding at [0.0 meters, 47.5 meters]."),
+]
+
+def legacy_base_filter(text):
+    if len(re.findall(r'[一-鿿]+', text)) > 0 or text == text.upper():
+        return True, "The description should only contain English in proper upper and lower cases."
+    return False, None
+
+def legacy_vertical_nonzero(text):
+    matches = re.findall(r'(\[[-\d\s.m]+\s*,\s*[-\d\s.m]+\s*,\s*([-\d\s.m]+)\])', text)
+    for match in matches:
+        if match[-1] not in ['0', '0.0', '0m', '0.0m', '0mm', '0.0mm']:
+            return True, "The z-coordinates should be 0."
+    return False, None
+
+def legacy_contain_invalid_coordinate(text):
+    matches = re.findall(r'(\[[^\[]+\s*,\s*[^\[]+\s*(,\s*[^\[]+)?\])', text)
+    re_coord = r'^\[-?\d+(\.\d+)?\s*(m|mm)?\s*,\s*-?\d+(\.\d+)?\s*(m|mm)?\s*(,\s*-?\d+(\.\d+)?\s*(m|mm)?)?\]$'
+    for match in matches:
+        if not re.match(re_coord, match[0]):
+            return True, "The coordinates should contain three values in millimeters in the form of [x, y, 0] with x and y being specific numbers."
+    return False, None
+
+def legacy_contain_ban_words(text):
+    text = text.lower()
+    ban_words = [re.findall(w, text)[0] for w in ['\n', 'without', 'instead', r'(?:\s|^)[nN]ot(?:\s|$|\.|,)', r'(?:\s|^)[nN]ow(?:\s|$|\.|,)', r'(?:\s|^)[nN]o(?:\s|$|\.|,)', 'east', 'west', 'north', 'south', 'workbench', 'euclid'] if len(re.findall(w, text)) > 0]
+    if len(ban_words) > 0:
+        return True, f"The description should not contain these words: {ban_words}"
+    return False, None
+
+def legacy_filter_descriptions(texts):
+    results = []
+    for text in texts:
+        filter_reasons = []
+        for func in [legacy_base_filter, legacy_vertical_nonzero, legacy_contain_invalid_coordinate, legacy_contain_ban_words]:
+            should_filter, filter_reason = func(text)
+            if should_filter:
+                filter_reasons.append(filter_reason)
+        results.append((True, '\n'.join(filter_reasons)) if len(filter_reasons) > 0 else (False, None))
+    return results
+
+def make_description(num_objects, seed=0):
+    # a description with the units, coordinate forms and words the rules look for
+    rand = random.Random(seed)
+    def number():
+        return rand.choice([str(rand.randint(-5, 5) * 1000), str(rand.randint(0, 40) * 250), f"{rand.randint(-5, 5)}.{rand.randint(0, 9)}"])
+    coords = [
+        lambda: f"[{number()}, {number()}, 0]",
+        lambda: f"[{number()}, {number()}]",
+        lambda: f"({number()}, {number()}, {number()})",
+        lambda: f"[{number()} m, {number()} m]",
+        lambda: f"[{number()}m, {number()}m, 0m]",
+        lambda: f"[{number()} mm, {number()} mm, 0 mm]",
+        lambda: f"[{number()}, {number()}] mm",
+        lambda: f"[{number()}, {number()}, {number()}] millimeters",
+        lambda: f"[ {number()},{number()} , {number()} ]",
+        lambda: f"[{number()}cm, {number()}cm]",
+        lambda: f"[x, {number()}, 0]",
+        lambda: f"[{number()}, {number()}, 0, 0]",
+    ]
+    sentences = []
+    for i in range(num_objects):
+        name = rand.choice(item_list)
+        sentence = rand.choice([
+            f"Place a {name} at {rand.choice(coords)()}.",
+            f"The {name} is {rand.randint(1, 300)} cm to the left of the previous object",
+            f"Put the {name} {rand.randint(1, 9)}.{rand.randint(0, 9)} centimeters behind the table, facing {rand.choice([90, 180, 270])} degrees.",
+            f"A {name} stands between {rand.choice(coords)()} and {rand.choice(coords)()}.",
+        ])
+        sentences.append(sentence)
+    if rand.random() < 0.3:
+        sentences.append(rand.choice(["Do not rotate it.", "No guarding is needed.", "Place it east of the robot", "It stands\nnext to the workbench.", "Now add a conveyor, without the cabinet.", "NO OBJECT SHOULD OVERLAP.", "机器人 on the left."]))
+    rand.shuffle(sentences)
+    return ' '.join(sentences)
+
+def bench(func, texts, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        results = func(texts)
+        best = min(best, time.perf_counter() - start)
+    return best, results
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--corpus', type=str, default=None, help='jsonl file of descriptions, e.g. data_prompt.jsonl')
+    parser.add_argument('--descriptions', type=int, default=5000)
+    parser.add_argument('--objects', type=int, default=6)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    if args.corpus is not None:
+        texts = [json.loads(line)['description'] for line in open(args.corpus, encoding='utf-8')]
+    else:
+        texts = [make_description(args.objects, seed) for seed in range(args.descriptions)]
+
+    print(f"{'rules':>10} {'descriptions':>13} {'legacy /s':>10} {'engine /s':>10} {'speedup':>8} {'differences':>12}")
+    for name, legacy, engine in [
+        ('units', lambda texts: [legacy_change_units(t) for t in texts], lambda texts: [normalize_units(t) for t in texts]),
+        ('filters', legacy_filter_descriptions, filter_descriptions),
+    ]:
+        legacy_time, legacy_results = bench(legacy, texts, args.repeat)
+        engine_time, engine_results = bench(engine, texts, args.repeat)
+        differences = [(t, old, new) for t, old, new in zip(texts, legacy_results, engine_results) if old != new]
+        for t, old, new in differences[:3]:
+            print(json.dumps([t, old, new], ensure_ascii=False))
+        print(f"{name:>10} {len(texts):>13} {len(texts) / legacy_time:>10.0f} {len(texts) / engine_time:>10.0f} {legacy_time / engine_time:>7.1f}x {len(differences):>12}")
+        if name == 'filters':
+            assert len(differences) == 0, "filter_descriptions differs from the legacy filters"
+        else:
+            assert engine_results == [legacy_change_units_in_place(t) for t in texts], "normalize_units differs from the legacy rules applied in place"
+    for text, legacy, fixed in known_unit_fixes:
+        assert legacy_change_units(text) == legacy and normalize_units(text) == fixed, text
@@ -0,0 +1,120 @@
+import time
+from tokens import prompt_tokens, section_tokens
+
+class BudgetExceeded(Exception):
+    def __init__(self, stage, reason):
+        super().__init__(f"{stage}: {reason}")
+        self.stage = stage
+        self.reason = reason
+        self.partial = None
+
+# A Budget is created once per description and passed from process_prompt and
+# gen_code down to every model call. It bounds the HTTP timeout of each
+# request, the number of model calls per stage and the total wall-clock time.
+# When a bound is hit, BudgetExceeded is raised inside the stage and the
+# pipeline returns what it has so far, with the reason recorded in `failure`.
+# It also counts the prompt tokens sent by each stage and can cap the prompt
+# of a single request with max_prompt_tokens. Requests that raise, e.g. on an
+# HTTP error, are bounded by max_errors per stage even without other limits,
+# so a stage never loops on a server that keeps failing.
+class Budget:
+    def __init__(self, timeout=None, request_timeout=None, max_attempts=None, max_prompt_tokens=None, max_errors=5):
+        self.start = time.monotonic()
+        self.deadline = self.start + timeout if timeout is not None else None
+        self.default_request_timeout = request_timeout
+        # an int applies to every stage, a dict sets limits per stage
+        self.max_attempts = max_attempts
+        self.attempts = {}
+        # an int applies to every stage, a dict sets limits per stage
+        self.max_prompt_tokens = max_prompt_tokens
+        self.prompt_tokens = {}
+        self.prompt_sections = {}
+        # responses a stage could not parse and sampled again
+        self.parse_failures = {}
+        self.max_errors = max_errors
+        self.errors = {}
+        self.failure = None
+
+    def elapsed(self):
+        return time.monotonic() - self.start
+
+    def remaining(self):
+        if self.deadline is None:
+            return None
+        return self.deadline - time.monotonic()
+
+    def expired(self):
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def stage_max_attempts(self, stage):
+        if isinstance(self.max_attempts, dict):
+            return self.max_attempts.get(stage)
+        return self.max_attempts
+
+    def stage_max_prompt_tokens(self, stage):
+        if isinstance(self.max_prompt_tokens, dict):
+            return self.max_prompt_tokens.get(stage)
+        return self.max_prompt_tokens
+
+    def attempt(self, stage, prompt=None):
+        if self.expired():
+            raise BudgetExceeded(stage, f"deadline exceeded after {self.elapsed():.1f}s")
+        max_attempts = self.stage_max_attempts(stage)
+        if max_attempts is not None and self.attempts.get(stage, 0) >= max_attempts:
+            raise BudgetExceeded(stage, f"no valid output after {max_attempts} attempts")
+        if self.max_errors is not None and self.errors.get(stage, 0) >= self.max_errors:
+            raise BudgetExceeded(stage, f"{self.errors[stage]} requests failed")
+        if prompt is not None:
+            tokens = prompt_tokens(prompt)
+            max_prompt_tokens = self.stage_max_prompt_tokens(stage)
+            if max_prompt_tokens is not None and tokens > max_prompt_tokens:
+                raise BudgetExceeded(stage, f"prompt of {tokens} tokens exceeds the limit of {max_prompt_tokens}")
+            self.prompt_tokens[stage] = self.prompt_tokens.get(stage, 0) + tokens
+        self.attempts[stage] = self.attempts.get(stage, 0) + 1
+
+    def error(self, stage):
+        # a request of the stage raised; the next attempt fails once max_errors is reached
+        self.errors[stage] = self.errors.get(stage, 0) + 1
+
+    def parse_failure(self, stage):
+        self.parse_failures[stage] = self.parse_failures.get(stage, 0) + 1
+
+    def record_sections(self, stage, sections):
+        # tokens of each part of a stage template, e.g. the guidance of the code prompt
+        self.prompt_sections[stage] = section_tokens(sections)
+
+    def prompt_report(self):
+        report = {}
+        for stage, tokens in self.prompt_tokens.items():
+            report[stage] = {"requests": self.attempts.get(stage, 0), "prompt_tokens": tokens}
+            if stage in self.prompt_sections:
+                report[stage]["sections"] = self.prompt_sections[stage]
+            if stage in self.parse_failures:
+                report[stage]["parse_failures"] = self.parse_failures[stage]
+        return report
+
+    def request_timeout(self):
+        timeouts = [t for t in [self.default_request_timeout, self.remaining()] if t is not None]
+        if len(timeouts) == 0:
+            return None
+        return max(min(timeouts), 0.001)
+
+    def request_kwargs(self):
+        timeout = self.request_timeout()
+        return {} if timeout is None else {"timeout": timeout}
+
+    def guard(self, abort=None):
+        # also stop streamed responses once the deadline has passed
+        if self.deadline is None:
+            return abort
+        return lambda text: (abort is not None and abort(text)) or self.expired()
+
+    def fail(self, error: BudgetExceeded, partial=None):
+        self.failure = {
+            "stage": error.stage,
+            "reason": error.reason,
+            "elapsed": self.elapsed(),
+            "attempts": dict(self.attempts),
+            "partial": partial,
+        }
+        print(f"Budget exceeded in {error.stage}: {error.reason}")
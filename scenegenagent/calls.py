@@ -0,0 +1,38 @@
+# Stages that call models are written once, as generators that yield each
+# call as (target, method, args, kwargs) and receive its output, or the
+# exception it raised. run_calls makes the calls with the sync methods of the
+# target and run_calls_async with their _async twins, e.g. invoke and
+# invoke_async of a model, so that the sync and async versions of a stage only
+# differ in how the calls are made. Stages call each other with yield from.
+
+def call(target, method, *args, **kwargs):
+    return target, method, args, kwargs
+
+def run_calls(calls):
+    output, error = None, None
+    while True:
+        try:
+            target, method, args, kwargs = calls.send(output) if error is None else calls.throw(error)
+        except StopIteration as e:
+            return e.value
+        try:
+            output, error = getattr(target, method)(*args, **kwargs), None
+        except Exception as e:
+            output, error = None, e
+
+async def run_calls_async(calls):
+    output, error = None, None
+    while True:
+        try:
+            target, method, args, kwargs = calls.send(output) if error is None else calls.throw(error)
+        except StopIteration as e:
+            return e.value
+        try:
+            output, error = await getattr(target, method + '_async')(*args, **kwargs), None
+        except Exception as e:
+            output, error = None, e
+
+def no_calls(result):
+    # the calls of a stage that returns result without calling a model
+    return result
+    yield
@@ -0,0 +1,100 @@
+import os
+import re
+import time
+from types import MappingProxyType
+
+item_list = ["Robot",
+             "Kuka Robot", "Kuka Robot KR125", "Kuka Robot KR350",
+             "ABB Robot", "ABB Robot IRB6600",
+             "YASKAWA Robot", "YASKAWA Robot ma01800",
+             "Table", "Welding Table", "Turntable", "Turntable",
+             "Guarding", "Cabinet", "ValveStand", "Conveyor"]
+
+permission_list = ["Kuka Robot KR125", "Kuka Robot KR350", "ABB Robot IRB6600", "YASKAWA Robot ma01800", "Welding Table", "Turntable", "Cabinet", "ValveStand", "Conveyor", "Guarding"]
+
+def compile_names(names, flags=0):
+    # one alternation for all names, longest first so that "Kuka Robot KR125" wins over "Kuka Robot"
+    names = sorted(set(names), key=len, reverse=True)
+    return re.compile('|'.join(re.escape(n) for n in names), flags)
+
+canonical_names = {i.lower(): i for i in item_list}
+re_item_names = compile_names(item_list, re.IGNORECASE)
+re_permitted = compile_names(permission_list)
+
+def standardize_names(text):
+    return re_item_names.sub(lambda m: canonical_names[m.group().lower()], text)
+
+def object_permitted(object):
+    return re_permitted.search(object) is not None
+
+def guidance_key(name):
+    # the lower-case object type of an instance name, e.g. "Welding Table 2" -> "welding table"
+    return re.sub(r'\s+\d+$', '', name).lower()
+
+# The guidance files of guidance/object, keyed by lower-case object type. The
+# files are read on first use, not at import, from the directory of this
+# module rather than the working directory. Afterwards the directory is
+# rescanned at most every check_interval seconds and only files whose mtime
+# changed are read again, so objects can be added or edited without a
+# restart. A reload builds new dicts and swaps them in, and objects() returns
+# a read-only view, so the index can be built once before forking workers and
+# read by all of them.
+class GuidanceIndex:
+    def __init__(self, directory, check_interval=1.0):
+        self.directory = directory
+        self.check_interval = check_interval
+        self.mtimes = {}
+        self.guidance = {}
+        self.pattern = None
+        self.checked = None
+
+    def refresh(self, force=False):
+        now = time.monotonic()
+        if not force and self.checked is not None and now - self.checked < self.check_interval:
+            return False
+        self.checked = now
+        files = {}
+        if os.path.isdir(self.directory):
+            for entry in os.scandir(self.directory):
+                if entry.is_file() and entry.name.endswith('.txt'):
+                    files[entry.name[:-4]] = (entry.path, entry.stat().st_mtime_ns)
+        if {k: m for k, (_, m) in files.items()} == self.mtimes:
+            return False
+        guidance = {}
+        for name, (path, mtime) in sorted(files.items()):
+            key = name.lower()
+            if self.mtimes.get(name) == mtime and key in self.guidance:
+                guidance[key] = self.guidance[key]
+                continue
+            with open(path, 'r', encoding='utf-8') as file:
+                guidance[key] = file.read().strip()
+        if set(files) != set(self.mtimes):
+            # a guidance object with an optional instance number, e.g. "cabinet 2"
+            self.pattern = re.compile(r'(' + compile_names(files).pattern + r')(?:\s+(\d+))?', re.IGNORECASE) if len(files) > 0 else None
+        self.guidance = guidance
+        self.mtimes = {k: m for k, (_, m) in files.items()}
+        return True
+
+    def objects(self):
+        self.refresh()
+        return MappingProxyType(self.guidance)
+
+    def match(self, name):
+        # (object type, instance number, guidance) of a name, or None if no guidance file covers it
+        self.refresh()
+        pattern, guidance = self.pattern, self.guidance
+        m = pattern.fullmatch(name.strip()) if pattern is not None else None
+        key = m.group(1).lower() if m is not None else None
+        if key not in guidance:
+            return None
+        return key, int(m.group(2)) if m.group(2) else None, guidance[key]
+
+guidance_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'guidance', 'object')
+guidance_index = GuidanceIndex(guidance_dir)
+
+def match_object(name):
+    return guidance_index.match(name)
+
+def lookup_guidance(name):
+    match = guidance_index.match(name)
+    return match[2] if match is not None else None
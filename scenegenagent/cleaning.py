@@ -1,5 +1,14 @@
 import re
 import json
+from budget import Budget
+from csharp import check_script
+from catalog import item_list, standardize_names
+from rules import normalize_units, filter_descriptions
+from placement_format import stage_formats
+from scene import Scene
+from memo import memo_get, memo_put, normalize_text
+from schemas import positional_error_format
+from calls import call, run_calls, run_calls_async
 
 ##########
 # Prompt #
@@ -9,38 +18,15 @@ def contain_scalars(text):
     re_scalar = r'(?:^|\s)(\d+(\.\d+)?\s*m)'
     return bool(re.findall(re_scalar, text))
 
+def contain_coords(text):
+    re_coord = r'\[-?\d+(\.\d+)?\s*,\s*-?\d+(\.\d+)?\s*,\s*-?\d+(\.\d+)?\s*\]'
+    return bool(re.findall(re_coord, text))
+
 def contain_numbers(text):
     re_coord = r'\[-?\d+(\.\d+)?\s*,\s*-?\d+(\.\d+)?\s*,\s*-?\d+(\.\d+)?\s*\]'
     re_scalar = r'(?:^|\s)(\d+(\.\d+)?\s*m)'
     return bool(re.findall(re_coord, text)) or bool(re.findall(re_scalar, text))
 
-def base_filter(text):
-    if len(re.findall(r'[\u4e00-\u9fff]+', text)) > 0 or text == text.upper():
-        return True, "The description should only contain English in proper upper and lower cases."
-    return False, None
-
-def vertical_nonzero(text):
-    matches = re.findall(r'(\[[-\d\s.m]+\s*,\s*[-\d\s.m]+\s*,\s*([-\d\s.m]+)\])', text)
-    for match in matches:
-        if match[-1] not in ['0', '0.0', '0m', '0.0m', '0mm', '0.0mm']:
-            return True, "The z-coordinates should be 0."
-    return False, None
-
-def contain_invalid_coordinate(text):
-    matches = re.findall(r'(\[[^\[]+\s*,\s*[^\[]+\s*(,\s*[^\[]+)?\])', text)
-    re_coord = r'^\[-?\d+(\.\d+)?\s*(m|mm)?\s*,\s*-?\d+(\.\d+)?\s*(m|mm)?\s*(,\s*-?\d+(\.\d+)?\s*(m|mm)?)?\]$'
-    for match in matches:
-        if not re.match(re_coord, match[0]):
-            return True, "The coordinates should contain three values in millimeters in the form of [x, y, 0] with x and y being specific numbers."
-    return False, None
-
-def contain_ban_words(text):
-    text = text.lower()
-    ban_words = [re.findall(w, text)[0] for w in ['\n', 'without', 'instead', r'(?:\s|^)[nN]ot(?:\s|$|\.|,)', r'(?:\s|^)[nN]ow(?:\s|$|\.|,)', r'(?:\s|^)[nN]o(?:\s|$|\.|,)', 'east', 'west', 'north', 'south', 'workbench', 'euclid'] if len(re.findall(w, text)) > 0]
-    if len(ban_words) > 0:
-        return True, f"The description should not contain these words: {ban_words}"
-    return False, None
-
 check_relative_position_prompt = """You are given a description of a workstation, which is used to build a scene in Process Simulate (PS).
 The description includes several objects and their positions. The description is as follows:
 ```
@@ -69,106 +55,65 @@ Error: <Based on the analysis, decide whether there are errors in the descriptio
 Do not say anything else.
 """
 
-def contain_positional_error(text, positions, model):
-    model_input = check_relative_position_prompt.format(prompt=text, positions=json.dumps(positions, indent=2))
-    run_success = False
+def parse_positional_error(model_output):
+    result = re.findall(r'\nError:.*?(Yes|No)', model_output)
+    analysis = re.findall(r'(Relations:[\s\S]*?)\s*\nError:', model_output)
+    if len(analysis) > 0 and len(result) > 0:
+        return result[0] == "Yes", analysis[0]
+    return None
+
+def leave_format(text, head):
+    text = re.sub(r'^\s*(```\w*\s*)?', '', text)
+    return len(text) >= len(head) and not text.startswith(head)
+
+def positional_error_until(text):
+    return parse_positional_error(text) is not None
+
+def positional_error_abort(text):
+    return leave_format(text, 'Relations:')
+
+def contain_positional_error_calls(text, positions, model, budget=None):
+    budget = budget if budget is not None else Budget()
+    positions = Scene.from_placement(positions).format(stage_formats['check_positional_error'])
+    key, memo = memo_get('check_positional_error', model.model, normalize_text(text), positions)
+    if memo is not None:
+        return tuple(memo)
+    model_input = check_relative_position_prompt.format(prompt=text, positions=positions)
     for retry in range(5):
-        model_output = model.generate(model_input)
-        result = re.findall(r'\nError:.*?(Yes|No)', model_output)
-        analysis = re.findall(r'(Relations:[\s\S]*?)\s*\nError:', model_output)
-        if len(analysis) > 0 and len(result) > 0:
-            run_success = True
-            break
+        budget.attempt('check_positional_error', model_input)
+        model_output = yield call(model, 'generate', model_input, until=positional_error_until, abort=budget.guard(positional_error_abort), schema=positional_error_format, **budget.request_kwargs())
+        result = parse_positional_error(model_output)
+        if result is not None:
+            memo_put('check_positional_error', key, result)
+            return result
+        budget.parse_failure('check_positional_error')
         print(model_output)
-    if not run_success:
-        return False, None
-    result = result[0]
-    analysis = analysis[0]
-    return result == "Yes", analysis
+    return False, None
 
-def filter_prompt(text, model):
+def contain_positional_error(text, positions, model, budget=None):
+    return run_calls(contain_positional_error_calls(text, positions, model, budget))
+
+async def contain_positional_error_async(text, positions, model, budget=None):
+    return await run_calls_async(contain_positional_error_calls(text, positions, model, budget))
+
+def filter_prompt(text, positions, model, budget=None):
     assert text
-    filter_reasons = []
-    for func in [
-        base_filter,
-        vertical_nonzero,
-        contain_invalid_coordinate,
-        contain_ban_words,
-    ]:
-        should_filter, filter_reason = func(text)
-        if should_filter:
-            filter_reasons.append(filter_reason)
-    if len(filter_reasons) > 0:
-        return True, '\n'.join(filter_reasons)
-    should_filter, filter_reason = contain_positional_error(text, model)
+    should_filter, filter_reason = filter_descriptions([text])[0]
+    if should_filter:
+        return True, filter_reason
+    should_filter, filter_reason = contain_positional_error(text, positions, model, budget)
     if should_filter:
         return True, filter_reason
     return False, None
 
-def change_units(text):
-    text = text.replace('(', '[').replace(')', ']')
-    # remove mm unit outside coord
-    matches = re.findall(r'(\[-?\d+(\.\d+)?,\s*-?\d+(\.\d+)?(,\s*-?\d+(\.\d+)?)?\]\s*(mm| millimeters))', text)
-    for match in matches:
-        value = match[0]
-        value = re.sub(r'\s*mm', '', value).strip()
-        value = re.sub(r'\s*millimeters', '', value).strip()
-        text = text.replace(match[0], value)
-    # convert [x m, y m] to [x * 1000, y * 1000]
-    matches = re.findall(r'(\[(-?\d+(?:\.\d+)?)\s*m,\s*(-?\d+(?:\.\d+)?)\s*m\])', text)
-    for match in matches:
-        value = f"[{int(float(match[1]) * 1000)}, {int(float(match[2]) * 1000)}]"
-        text = text.replace(match[0], value)
-    # convert [x m, y m, z m] to [x * 1000, y * 1000, z * 1000]
-    matches = re.findall(r'(\[(-?\d+(?:\.\d+)?)\s*m,\s*(-?\d+(?:\.\d+)?)\s*m,\s*(-?\d+(?:\.\d+)?)\s*m?\])', text)
-    for match in matches:
-        value = f"[{int(float(match[1]) * 1000)}, {int(float(match[2]) * 1000)}, {int(float(match[3]) * 1000)}]"
-        text = text.replace(match[0], value)
-    # remove mm unit inside coord
-    matches = re.findall(r'(\[(-?\d+(?:\.\d+)?)\s*mm,\s*(-?\d+(?:\.\d+)?)\s*mm(,\s*(-?\d+(?:\.\d+)?)\s*mm)?\])', text)
-    for match in matches:
-        value = re.sub(r'\s*mm', '', match[0]).strip()
-        text = text.replace(match[0], value)
-    # replace cm with m in plain text
-    matches = re.findall(r'(\d+(\.\d+)?\s*(?:cm|centimeters))', text)
-    for match in matches:
-        value = match[0]
-        value = re.sub(r'cm|centimeters', '', value).strip()
-        value = float(value) / 100
-        text = text.replace(match[0], str(value) + ' meters')
-    # add zero to z-axis
-    matches = re.findall(r'(\[(-?\d+(?:\.\d+)?)\s*,\s*(-?\d+(?:\.\d+)?)\s*\])', text)
-    for match in matches:
-        value = match[0][:-1].rstrip() + ', 0]'
-        text = text.replace(match[0], value)
-    # change z-axis to zero
-    matches = re.findall(r'(\[-?\d+(?:\.\d+)?\s*,\s*-?\d+(?:\.\d+)?\s*,\s*(-?\d+(?:\.\d+)?\s*\]))', text)
-    for match in matches:
-        value = re.sub(match[1], '0]', match[0]).strip()
-        text = text.replace(match[0], value)
-    # reformat coords
-    matches = re.findall(r'(\[\s*(-?\d+(?:\.\d+)?)\s*,\s*(-?\d+(?:\.\d+)?)\s*,\s*(-?\d+(?:\.\d+)?)\s*\])', text)
-    for match in matches:
-        value = f"[{match[1]}, {match[2]}, {match[3]}]"
-        text = text.replace(match[0], value)
-    return text
-
 def rule_clean(text):
-    text = change_units(text)
+    text = normalize_units(text)
     text = text.lstrip(".\"' ").rstrip("\"' ")
     text = text.replace('"', '').replace("'", "")
     return text.strip()
 
-item_list = ["Robot", 
-             "Kuka Robot", "Kuka Robot KR125", "Kuka Robot KR350", 
-             "ABB Robot", "ABB Robot IRB6600", 
-             "YASKAWA Robot", "YASKAWA Robot ma01800", 
-             "Table", "Welding Table", "Turntable", "Turntable", 
-             "Guarding", "Cabinet", "ValveStand", "Conveyor"]
-
 def standardize_name(text):
-    for item in item_list:
-        text = re.sub(item, item, text, flags=re.IGNORECASE)
+    text = standardize_names(text)
     return text.strip()
 
 def clean_prompt(text):
@@ -194,8 +139,41 @@ def contain_invalid_code(code):
             return True, f"Code contains invalid content '{ban_word}'"
     return False, None
 
+compact_place_code = """var sceneObjects = new[]
+{
+    new { Models = obj1Models, Name = "obj1", X = x1, Y = y1, Rot = degree1 },
+    new { Models = obj2Models, Name = "obj2", X = x2, Y = y2, Rot = degree2 },
+};
+
+foreach (var sceneObject in sceneObjects)
+{
+    DirectoryInfo objModel = sceneObject.Models[rand.Next(0, sceneObject.Models.Count)];
+    string objName = Path.GetFileNameWithoutExtension(objModel.Name) + "_" + DateTime.Now.ToString("yyyy-MM-dd-HH-mm-ss");
+    TxInsertComponentCreationData txInsertDataObj = new TxInsertComponentCreationData(objName, objModel.FullName);
+    ITxComponent txComponentObject = txPhysicalRoot.InsertComponent(txInsertDataObj);
+
+    double rotValue = sceneObject.Rot * Math.PI / 180.0;
+    TxTransformation txTransTransXYRotZ = new TxTransformation(new TxVector(sceneObject.X, sceneObject.Y, 0.0), new TxVector(0.0, 0.0, rotValue), TxTransformation.TxRotationType.RPY_ZYX);
+    ITxLocatableObject obj = (ITxLocatableObject)txComponentObject;
+    obj.AbsoluteLocation *= txTransTransXYRotZ;
+}"""
+re_compact_loop = r'foreach \(var (\w+) in (\w+)\)'
+re_compact_row = r'new \{ Models = \w+, Name = "[^"]*", X = -?\d+\.\d+, Y = -?\d+\.\d+, Rot = -?\d+\.\d+ \}'
+
 def miss_necessary_code(code):
     must_word = 'TxTransformation.TxRotationType.RPY_ZYX'
+    # compact form: one table of objects and a single insertion loop
+    loop = re.search(re_compact_loop, code)
+    if loop and f'var {loop.group(2)} = new[]' in code:
+        rows = re.findall(r'new \{\s*Models\s*=', code)
+        if must_word not in code[loop.end():] or len(rows) == 0 or len(re.findall(re_compact_row, code)) != len(rows):
+            return True, f"""You should use the following code to place objects:
+```csharp
+{compact_place_code}
+```
+Write every X, Y and Rot value as a number with a decimal point, e.g. 2000.0.
+Do not use other methods made by yourself."""
+        return False, None
     if must_word not in code:
         return True, """You should use the following code to place objects:
 ```csharp
@@ -222,13 +200,20 @@ string[] weldingModels = Directory.GetDirectories(weldingLibPath, "*.cojt", Sear
         return True, f"Code must start with:\n```csharp\n{start_code}\n```"
     return False, None
 
-def filter_code(code, return_reason=False):
+def contain_static_errors(code, placement=None):
+    diagnostics = check_script(code, placement)
+    if len(diagnostics) > 0:
+        return True, "The code does not compile or does not match the placement:\n" + '\n'.join(diagnostics)
+    return False, None
+
+def filter_code(code, return_reason=False, placement=None):
     assert code
     filter_reasons = []
     for func in [
         contain_invalid_code,
         miss_necessary_code,
         wrong_start,
+        lambda code: contain_static_errors(code, placement),
     ]:
         should_filter, filter_reason = func(code)
         if should_filter:
@@ -242,87 +227,126 @@ def filter_code(code, return_reason=False):
         return should_filter, filter_reason
     return should_filter
 
-def get_code_from_response(code):
-    head = '```csharp\n'
-    tail = '```'
-    pos_head = code.find(head)
-    if pos_head != -1:
-        code = code[pos_head + len(head):]
-        pos_tail = code.find(tail)
-        if pos_tail != -1:
-            code = code[:pos_tail]
-    marker_start = 'string rootDir = TxApplication.SystemRootDirectory;'
-    if code.find(marker_start) == -1:
-        return ""
-    pos_indents = -1
-    lines = code.split('\n')
-    lines_new = []
-    for l in lines:
-        if pos_indents == -1 and marker_start in l:
-            pos_indents = l.find(marker_start)
-        if pos_indents >= 0:
-            if l.strip() == '' or l.startswith(' ' * pos_indents):
-                lines_new.append(l[pos_indents:])
-    return '\n'.join(lines_new)
-
-def add_necessary_code(code):
-    code = re.sub(r'^(//.*|\n)+', '', code)
-    added_parts = []
-    if not code.startswith("string rootDir = TxApplication.SystemRootDirectory;"):
-        added_code = """string rootDir = TxApplication.SystemRootDirectory;
+code_marker_start = 'string rootDir = TxApplication.SystemRootDirectory;'
+code_header = """string rootDir = TxApplication.SystemRootDirectory;
 
 string weldingLibPath = Path.Combine(rootDir, "Welding");
 string[] weldingModels = Directory.GetDirectories(weldingLibPath, "*.cojt", SearchOption.TopDirectoryOnly);
 
 """
-        code = added_code + code.lstrip()
-        added_parts.append(added_code)
-        
-    if 'Random rand = new Random();' not in code:
-        added_code = "Random rand = new Random();\nTxPhysicalRoot txPhysicalRoot = TxApplication.ActiveDocument.PhysicalRoot;"
-        code = code.replace("TxPhysicalRoot txPhysicalRoot = TxApplication.ActiveDocument.PhysicalRoot;", added_code)
-        added_parts.append(added_code)
-    
-    code = re.sub(r'Console.Write(Line)?', 'output.Write', code)
+code_physical_root = "TxPhysicalRoot txPhysicalRoot = TxApplication.ActiveDocument.PhysicalRoot;"
+code_random = "Random rand = new Random();"
+code_end = "TxApplication.RefreshDisplay();"
+re_leading_comments = re.compile(r'^(//.*|\n)+')
+re_console = re.compile(r'Console.Write(Line)?')
+re_count_cond = re.compile(r'(if \([\w\d]+\.Count >)(=?\s*\d+\s*)(\))')
+re_pick_index = re.compile(r'(DirectoryInfo [\w\d]+ = ([\w\d]+))(\[.*?\]);')
 
-    end_code = "TxApplication.RefreshDisplay();"
-    end_pos = code.find(end_code)
+def extract_code(code):
+    # the code block of the response, from the first line of the template, at its indentation
+    head = '```csharp\n'
+    pos_head = code.find(head)
+    if pos_head != -1:
+        pos_tail = code.find('```', pos_head + len(head))
+        code = code[pos_head + len(head):pos_tail if pos_tail != -1 else len(code)]
+    pos = code.find(code_marker_start)
+    if pos == -1:
+        return ""
+    start = code.rfind('\n', 0, pos) + 1
+    indent = ' ' * (pos - start)
+    return '\n'.join(l[len(indent):] for l in code[start:].split('\n') if l.strip() == '' or l.startswith(indent))
+
+def add_template_code(code):
+    code = re_leading_comments.sub('', code)
+    added_parts = []
+    if not code.startswith(code_marker_start):
+        code = code_header + code.lstrip()
+        added_parts.append(code_header)
+    if code_random not in code:
+        added_code = f"{code_random}\n{code_physical_root}"
+        code = code.replace(code_physical_root, added_code)
+        added_parts.append(added_code)
+    code = re_console.sub('output.Write', code)
+    end_pos = code.find(code_end)
     if end_pos != -1:
-        code = code[:end_pos + len(end_code)]
+        code = code[:end_pos + len(code_end)]
     else:
-        code = code.rstrip() + '\n\n' + end_code
-        added_parts.append(end_code)
+        code = code.rstrip() + '\n\n' + code_end
+        added_parts.append(code_end)
     return code, added_parts
 
-def fix_obj_index(code):
-    re_cond = r'(if \([\w\d]+\.Count >(=?\s*\d+\s*)\))'
-    for cond, num in re.findall(re_cond, code):
-        if num != ' 0':
-            new_cond = cond.replace(num, ' 0')
-            code = code.replace(cond, new_cond)
-    re_idx = r'(DirectoryInfo [\w\d]+ = ([\w\d]+)(\[.*?\]);)'
-    for line, lst, idx in re.findall(re_idx, code):
-        new_idx = f'[rand.Next(0, {lst}.Count)]'
-        if idx != new_idx:
-            new_line = line.replace(idx, new_idx)
-            code = code.replace(line, new_line)
-    return code
+def fix_count_cond(match):
+    return match.group(0) if match.group(2) == ' 0' else match.group(0).replace(match.group(2), ' 0')
+
+def fix_pick_index(match):
+    return f'{match.group(1)}[rand.Next(0, {match.group(2)}.Count)];'
+
+def fix_code_index(code):
+    # models are picked at random from lists that are checked for being non-empty
+    return re_pick_index.sub(fix_pick_index, re_count_cond.sub(fix_count_cond, code))
+
+def resync(a, b, i, j, window=8):
+    # the nearest lines a[i2] == b[j2] after a difference at a[i], b[j]
+    for d in range(1, 2 * window + 1):
+        for di in range(max(0, d - window), min(d, window) + 1):
+            i2, j2 = i + di, j + d - di
+            if i2 < len(a) and j2 < len(b) and a[i2] == b[j2]:
+                return i2, j2
+    return len(a), len(b)
 
+def line_edits(old, new):
+    # the edits that turn the lines of old into those of new, from the bottom up
+    # so that the line numbers of each edit refer to old. The steps of clean_code
+    # only change lines locally, so the lines are aligned greedily in one pass.
+    a, b = old.split('\n'), new.split('\n')
+    edits, i, j = [], 0, 0
+    while i < len(a) or j < len(b):
+        if i < len(a) and j < len(b) and a[i] == b[j]:
+            i, j = i + 1, j + 1
+            continue
+        i2, j2 = resync(a, b, i, j)
+        edits.append([i, i2, b[j:j2]])
+        i, j = i2, j2
+    return edits[::-1]
+
+def replay_clean_history(clean_history):
+    # the code after each step of a history returned by clean_code
+    snapshots = [clean_history[0][1]]
+    for _, edits in clean_history[1:]:
+        lines = snapshots[-1].split('\n')
+        for i1, i2, new_lines in edits:
+            lines[i1:i2] = new_lines
+        snapshots.append('\n'.join(lines))
+    return snapshots
+
+# Cleans a model response: extracts the code block, adds the parts of the
+# template that are missing, renames Console output and fixes the indices
+# used to pick models. Each step is a single pass over the code. With
+# return_history, the steps are recorded as line edits of the previous
+# snapshot rather than full copies; replay_clean_history rebuilds the snapshots.
 def clean_code(code, return_history=False):
-    clean_history = [["Original", code]]
     if not code:
         if return_history:
             return None, None
         return None
-    code = get_code_from_response(code)
-    if code != clean_history[-1][1]:
-        clean_history.append(["Get code from response", code])
-    code, added_parts = add_necessary_code(code)
+    clean_history = [["Original", code]]
+    snapshot = code
+
+    def record(step, new):
+        nonlocal snapshot
+        if return_history:
+            clean_history.append([step, line_edits(snapshot, new)])
+        snapshot = new
+
+    extracted = extract_code(code)
+    if extracted != code:
+        record("Get code from response", extracted)
+    added, added_parts = add_template_code(extracted)
     if len(added_parts) > 0:
-        clean_history.append(["Added following code:\n{}".format("\n\n".join(added_parts)), code])
-    code = fix_obj_index(code)
-    if code != clean_history[-1][1]:
-        clean_history.append(["Fix invalid index", code])
+        record("Added following code:\n{}".format("\n\n".join(added_parts)), added)
+    fixed = fix_code_index(added)
+    if fixed != snapshot:
+        record("Fix invalid index", fixed)
     if return_history:
-        return code, clean_history
-    return code
+        return fixed, clean_history
+    return fixed
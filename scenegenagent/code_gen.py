@@ -1,10 +1,15 @@
-import os
-import re
 import json
 import traceback
-from copy import deepcopy
 from termcolor import colored
-from cleaning import filter_code, clean_code
+from cleaning import filter_code, clean_code, compact_place_code
+from emitter import emit_code
+from catalog import guidance_index, match_object
+from placement_format import stage_formats
+from scene import Scene
+from memo import memo_get, memo_put, normalize_text
+from budget import Budget, BudgetExceeded
+import sampling
+from calls import call, no_calls, run_calls, run_calls_async
 
 code_gen_template = """You are given a description of a workstation, which is used to build a scene in Process Simulate (PS). You should write C# code with specific packages to build this scene.
 The description is as follows:
@@ -50,7 +55,15 @@ For the "load models" part, you should check whether the current `directoryInfo`
 You should use the following methods to load the objects:
 {guidance_obj}
 
-For the "add objects into the scene" part, you should add the objects into the scene and set its positions. For each object in the scene, pick the model from the model lists, put it into the scene, and set its coordinate and orientation.
+{place_guidance}
+
+Now, you should generate the complete code to build this scene. Only generate the complete code. Your code will be run directly in the production environment, so don't omit anything.
+Please strictly follow the given code snippets to load and place objects. Do not generate a class or a function, instead directly generate the function body. Do not define or call custom classes or functions by yourself.
+Please use .NET Framework 4.6.2 or below, or the code will not run.
+Do not say anything else.
+"""
+
+place_guidance = """For the "add objects into the scene" part, you should add the objects into the scene and set its positions. For each object in the scene, pick the model from the model lists, put it into the scene, and set its coordinate and orientation.
 To pick an object `obj1` from the list `objModels`, place it at [`x`, `y`, 0], and rotate it for `degree` degrees:
 ```csharp
 DirectoryInfo objModel1 = objModels[rand.Next(0, objModels.Count)];
@@ -64,42 +77,41 @@ double rotValue1 = degree * Math.PI / 180.0;
 TxTransformation txTransTransXYRotZ = new TxTransformation(new TxVector(transXValue1, transYValue1, 0.0), new TxVector(0.0, 0.0, rotValue1), TxTransformation.TxRotationType.RPY_ZYX);
 ITxLocatableObject obj1 = (ITxLocatableObject)txComponentObject1;
 obj1.AbsoluteLocation *= txTransTransXYRotZ;
-```
-
-Now, you should generate the complete code to build this scene. Only generate the complete code. Your code will be run directly in the production environment, so don't omit anything.
-Please strictly follow the given code snippets to load and place objects. Do not generate a class or a function, instead directly generate the function body. Do not define or call custom classes or functions by yourself.
-Please use .NET Framework 4.6.2 or below, or the code will not run.
-Do not say anything else.
-"""
+```"""
 
-def read_file_tree(directory):
-    file_tree = {}
-    for root, dirs, files in os.walk(directory):
-        current_node = file_tree
-        for dir_name in root[len(directory):].split(os.path.sep):
-            current_node = current_node.setdefault(dir_name, {})
-        
-        for file_name in files:
-            file_path = os.path.join(root, file_name)
-            if file_name.endswith('.txt'):
-                file_name = file_name[:-4]
-                with open(file_path, 'r', encoding='utf-8') as file:
-                    current_node[file_name] = file.read().strip()
-    return file_tree['']
-
-examples = read_file_tree('guidance')
-examples_lower_case = deepcopy(examples)
-examples_lower_case['object'] = {k.lower(): v for k, v in examples_lower_case['object'].items()}
-
-def build_code_gen_prompt(prompt, objects, positions):
-    guidances_obj = []
-    objects_pos = [o['name'] for o in positions]
-    for o in objects_pos:
-        o_lower = re.sub('\s+\d+$', '', o).lower()
-        if o_lower in examples_lower_case['object']:
-            guidances_obj.append(examples_lower_case['object'][o_lower])
-    guidance_obj = '\n'.join(guidances_obj)
-    p = code_gen_template.format(prompt=prompt, objects=objects, positions=json.dumps(positions, indent=2), guidance_obj=guidance_obj)
+# for large scenes: one table of objects and a single insertion loop
+place_guidance_compact = """For the "add objects into the scene" part, you should add the objects into the scene and set its positions. List all objects of the scene in one table, with the model list to pick from, the object name, its coordinate and its orientation, and insert them with a single loop.
+To place `obj1` from the list `obj1Models` at [`x1`, `y1`, 0] rotated for `degree1` degrees, `obj2` from the list `obj2Models` at [`x2`, `y2`, 0] rotated for `degree2` degrees, and so on:
+```csharp
+{compact_place_code}
+```
+Write every X, Y and Rot value as a number with a decimal point, e.g. 2000.0.""".format(compact_place_code=compact_place_code)
+
+def build_code_gen_prompt(prompt, objects, positions, compact=False, return_sections=False):
+    scene = Scene.from_placement(positions)
+    key, memo = memo_get('code_gen_prompt', normalize_text(prompt), str(objects), scene.format(stage_formats['generate_code']), compact)
+    if memo is not None:
+        # callers get their own sections, whatever the memo keeps
+        return (memo[0], dict(memo[1])) if return_sections else memo[0]
+    # every object type gets its loading snippet once, however many instances it has
+    guidances_obj, seen = [], set()
+    for o in scene.names:
+        match = match_object(o)
+        if match is not None and match[0] not in seen:
+            seen.add(match[0])
+            guidances_obj.append(match[2])
+    sections = {
+        "prompt": prompt,
+        "objects": str(objects),
+        "positions": scene.format(stage_formats['generate_code']),
+        "guidance_obj": '\n'.join(guidances_obj),
+        "place_guidance": place_guidance_compact if compact else place_guidance,
+    }
+    p = code_gen_template.format(**sections)
+    sections["template"] = code_gen_template.format(**{k: '' for k in sections})
+    memo_put('code_gen_prompt', key, [p, sections])
+    if return_sections:
+        return p, sections
     return p
 
 code_feedback_prompt = """Your code contains the following error:
@@ -109,38 +121,93 @@ code_feedback_prompt = """Your code contains the following error:
 Please write the code again, fixing the errors.
 Only generate the code. Do not say anything else."""
 
-def gen_code(prompt, objects, placement, model, model_generate_code: str = None, model_fix_code: str = None):
-    code_final = None
-    code_gen_prompt = build_code_gen_prompt(prompt, objects, placement)
+def check_code(model_output, code_gen_prompt, placement=None):
+    model_output = clean_code(model_output)
+    should_filter, filter_reason = filter_code(model_output, return_reason=True, placement=placement)
+    if should_filter:
+        print(colored(f"Prompt: {json.dumps([code_gen_prompt])}", 'red') + f"Code: {[model_output]}" + f"\nFilter reason: {[filter_reason]}")
+    return model_output, should_filter, filter_reason
+
+def code_feedback(messages, model_output, filter_reason):
+    new_messages = [
+        {"role": "assistant", "content": model_output},
+        {"role": "user", "content": code_feedback_prompt.format(feedback=filter_reason)}
+    ]
+    messages = messages[:1]
+    messages.extend(new_messages)
+    return messages
+
+def gen_code_calls(prompt, objects, placement, model, model_generate_code: str = None, model_fix_code: str = None, budget=None, num_candidates=1, use_emitter=False, compact=False):
+    # placements of known objects are rendered directly; the model is the fallback
+    placement = Scene.from_placement(placement)
+    code = emit_code(placement, guidance_index.objects(), compact) if use_emitter else None
+    if code is not None and not filter_code(code, placement=placement):
+        return code, 0
+    key, memo = memo_get('generate_code', model.model, normalize_text(prompt), str(objects), placement.format('json'), compact)
+    if memo is not None:
+        return tuple(memo)
+    budget = budget if budget is not None else Budget()
+    code_final, model_output = None, None
+    code_gen_prompt, sections = build_code_gen_prompt(prompt, objects, placement, compact, return_sections=True)
+    budget.record_sections('generate_code', sections)
     messages = [{
         "role": "user",
         "content": code_gen_prompt
     }]
     failed_rounds = 0
+    if num_candidates > 1:
+        # sample the first round in parallel and repair only if every candidate fails
+        def request():
+            return call(model, 'invoke', list(messages), abort=budget.guard(), **budget.request_kwargs())
+
+        def validate(output):
+            output, should_filter, filter_reason = check_code(output.strip(), code_gen_prompt, placement)
+            return no_calls((not should_filter, (output, filter_reason)))
+
+        try:
+            accepted, rejected = yield call(sampling, 'sample_candidates', num_candidates, request, validate, 'generate_code', budget, messages)
+        except BudgetExceeded as e:
+            e.partial = {"code": None, "failed_rounds": failed_rounds}
+            budget.fail(e, partial=e.partial)
+            return None, failed_rounds
+        if accepted is not None:
+            memo_put('generate_code', key, [accepted[0], failed_rounds])
+            return accepted[0], failed_rounds
+        if len(rejected) > 0:
+            model_output, filter_reason = rejected[0]
+            failed_rounds += 1
+            messages = code_feedback(messages, model_output, filter_reason)
     while failed_rounds < 5:
         try:
-            model_output = model.invoke(messages).strip()
-            model_output = clean_code(model_output)
-            should_filter, filter_reason = filter_code(model_output, return_reason=True)
+            budget.attempt('generate_code', messages)
+            model_output = (yield call(model, 'invoke', messages, abort=budget.guard(), **budget.request_kwargs())).strip()
+            model_output, should_filter, filter_reason = check_code(model_output, code_gen_prompt, placement)
             if should_filter:
                 failed_rounds += 1
-                print(colored(f"Prompt: {json.dumps([code_gen_prompt])}", 'red') + f"Code: {[model_output]}" + f"\nFilter reason: {[filter_reason]}")
-                new_messages = [
-                    {"role": "assistant", "content": model_output},
-                    {"role": "user", "content": code_feedback_prompt.format(feedback=filter_reason)}
-                ]
-                messages = messages[:1]
-                messages.extend(new_messages)
+                messages = code_feedback(messages, model_output, filter_reason)
                 continue
             code_final = model_output
             break
+        except BudgetExceeded as e:
+            e.partial = {"code": model_output, "failed_rounds": failed_rounds}
+            budget.fail(e, partial=e.partial)
+            break
         except Exception as e:
             print(traceback.format_exc())
+            budget.error('generate_code')
             continue
     if code_final is None:
         code_final = model_output
+    else:
+        memo_put('generate_code', key, [code_final, failed_rounds])
     return code_final, failed_rounds
 
+def gen_code(prompt, objects, placement, model, model_generate_code: str = None, model_fix_code: str = None, budget=None, num_candidates=1, use_emitter=False, compact=False):
+    return run_calls(gen_code_calls(prompt, objects, placement, model, model_generate_code, model_fix_code, budget, num_candidates, use_emitter, compact))
+
+async def gen_code_async(prompt, objects, placement, model, model_generate_code: str = None, model_fix_code: str = None, budget=None, num_candidates=1, use_emitter=False, compact=False):
+    return await run_calls_async(gen_code_calls(prompt, objects, placement, model, model_generate_code, model_fix_code, budget, num_candidates, use_emitter, compact))
+
 def show_complete_code(code):
     template = """using System;
 using System.IO;
@@ -0,0 +1,254 @@
+import re
+import numpy as np
+from scene import Scene
+from placement_format import re_number, format_number
+
+keywords = {
+    'abstract', 'as', 'base', 'bool', 'break', 'byte', 'case', 'catch', 'char', 'checked', 'class', 'const', 'continue',
+    'decimal', 'default', 'delegate', 'do', 'double', 'dynamic', 'else', 'enum', 'event', 'explicit', 'extern', 'false',
+    'finally', 'fixed', 'float', 'for', 'foreach', 'goto', 'if', 'implicit', 'in', 'int', 'interface', 'internal', 'is',
+    'lock', 'long', 'nameof', 'namespace', 'new', 'null', 'object', 'operator', 'out', 'override', 'params', 'private',
+    'protected', 'public', 'readonly', 'ref', 'return', 'sbyte', 'sealed', 'short', 'sizeof', 'stackalloc', 'static',
+    'string', 'struct', 'switch', 'this', 'throw', 'true', 'try', 'typeof', 'uint', 'ulong', 'unchecked', 'unsafe',
+    'ushort', 'using', 'var', 'virtual', 'void', 'volatile', 'while',
+}
+# contextual keywords are identifiers outside of the construct they belong to, e.g. a query expression
+contextual_keywords = {
+    'add', 'and', 'ascending', 'async', 'await', 'by', 'descending', 'equals', 'from', 'get', 'global', 'group', 'init',
+    'into', 'join', 'let', 'nameof', 'not', 'on', 'or', 'orderby', 'partial', 'remove', 'select', 'set', 'value', 'when',
+    'where', 'with', 'yield',
+}
+type_keywords = {'bool', 'byte', 'char', 'decimal', 'double', 'dynamic', 'float', 'int', 'long', 'object', 'short', 'string', 'var'}
+
+re_token = re.compile(r'''
+    (?P<space>\s+)
+  | (?P<comment>//[^\n]*|/\*[\s\S]*?\*/)
+  | (?P<string>@"(?:[^"]|"")*"|\$?"(?:[^"\\\n]|\\.)*"|'(?:[^'\\\n]|\\.)+')
+  | (?P<number>\d+(?:\.\d+)?(?:[eE][+-]?\d+)?[fFdDmMlL]?|\.\d+(?:[eE][+-]?\d+)?[fFdDmM]?)
+  | (?P<ident>@?[A-Za-z_]\w*)
+  | (?P<op>=>|\+\+|--|&&|\|\||[=!<>+\-*/%&|^]=|<<|>>|\?\?|[{}()\[\];,.<>=+\-*/%!&|^~?:])
+  | (?P<error>.)
+''', re.VERBOSE)
+
+class Token:
+    __slots__ = ['kind', 'value', 'line']
+
+    def __init__(self, kind, value, line):
+        self.kind = kind
+        self.value = value
+        self.line = line
+
+def tokenize(code):
+    tokens, line = [], 1
+    for m in re_token.finditer(code):
+        kind, value = m.lastgroup, m.group()
+        if kind not in ['space', 'comment']:
+            tokens.append(Token(kind, value, line))
+        line += value.count('\n')
+    return tokens
+
+def match_type(tokens, i):
+    # returns the index after a type such as List<DirectoryInfo>, string[] or Tecnomatix.Engineering.TxVector
+    if i >= len(tokens) or tokens[i].kind != 'ident' or (tokens[i].value in keywords and tokens[i].value not in type_keywords):
+        return None
+    i += 1
+    while i + 1 < len(tokens) and tokens[i].value == '.' and tokens[i + 1].kind == 'ident':
+        i += 2
+    if i < len(tokens) and tokens[i].value == '<':
+        depth = 0
+        while i < len(tokens):
+            if tokens[i].value == '<':
+                depth += 1
+            elif tokens[i].value == '>':
+                depth -= 1
+                if depth == 0:
+                    break
+            elif tokens[i].value == '>>':
+                depth -= 2
+                if depth <= 0:
+                    break
+            elif tokens[i].kind != 'ident' and tokens[i].value not in [',', '.', '[', ']']:
+                return None
+            i += 1
+        if i >= len(tokens):
+            return None
+        i += 1
+    while i + 1 < len(tokens) and tokens[i].value == '[' and tokens[i + 1].value == ']':
+        i += 2
+    return i
+
+def check_brackets(tokens):
+    diagnostics, stack = [], []
+    pairs = {')': '(', ']': '[', '}': '{'}
+    for t in tokens:
+        if t.value in '([{' and t.kind == 'op':
+            stack.append(t)
+        elif t.value in pairs and t.kind == 'op':
+            if len(stack) == 0 or stack[-1].value != pairs[t.value]:
+                diagnostics.append(f"Line {t.line}: `{t.value}` has no matching `{pairs[t.value]}`.")
+                continue
+            stack.pop()
+    for t in stack:
+        diagnostics.append(f"Line {t.line}: `{t.value}` is never closed.")
+    return diagnostics
+
+def local_names(tokens):
+    # parameters of lambdas, `d` in `d => d.Name` or `(a, b) => a + b`, and range
+    # variables of queries, `d` in `from DirectoryInfo d in models` or `let n = d.Name`
+    names = set()
+    for i, t in enumerate(tokens):
+        if t.value == '=>' and i > 0:
+            j = i - 1
+            if tokens[j].value == ')':
+                while j > 0 and tokens[j].value != '(':
+                    j -= 1
+                    names.add(tokens[j].value)
+            else:
+                names.add(tokens[j].value)
+        elif t.value in ['from', 'join'] and t.kind == 'ident':
+            end = match_type(tokens, i + 1)
+            if end is not None and end < len(tokens) and tokens[end].value == 'in':
+                names.add(tokens[end - 1].value)
+            elif end is not None and end + 1 < len(tokens) and tokens[end + 1].value == 'in':
+                names.add(tokens[end].value)
+        elif t.value in ['let', 'into'] and t.kind == 'ident' and i + 1 < len(tokens) and tokens[i + 1].kind == 'ident':
+            names.add(tokens[i + 1].value)
+    return names
+
+# Walks the statements of the script, tracking the local variables of each
+# block. C# forbids redeclaring a local in the same or a nested block, and
+# every lower-case identifier of the script shape is a local, so such an
+# identifier that was never declared is an error too, unless it is a lambda
+# parameter, a range variable of a query or a contextual keyword.
+def check_declarations(tokens):
+    diagnostics, declared_types, reported = [], {}, set()
+    # `output` is the parameter of the method that show_complete_code wraps around the script
+    scopes, pending = [{'output'}], set()
+    bound_names = local_names(tokens)
+    statement_start = True
+    for i, t in enumerate(tokens):
+        if t.kind == 'op':
+            if t.value == '{':
+                scopes.append(pending)
+                pending = set()
+            elif t.value == '}':
+                if len(scopes) > 1:
+                    scopes.pop()
+            statement_start = t.value in ['{', '}', ';']
+            continue
+        if t.kind != 'ident':
+            statement_start = False
+            continue
+        in_loop_header = i >= 2 and tokens[i - 1].value == '(' and tokens[i - 2].value in ['foreach', 'for', 'using', 'catch']
+        out_variable = i > 0 and tokens[i - 1].value == 'out'
+        if statement_start or in_loop_header or out_variable:
+            end = match_type(tokens, i)
+            followers = ['=', ';', ',', 'in'] + ([')'] if in_loop_header or out_variable else [])
+            if end is not None and end + 1 < len(tokens) and tokens[end].kind == 'ident' and tokens[end].value not in keywords and tokens[end + 1].value in followers:
+                name = tokens[end].value
+                if any(name in s for s in scopes) or name in pending:
+                    diagnostics.append(f"Line {tokens[end].line}: the variable `{name}` is declared more than once.")
+                (pending if in_loop_header else scopes[-1]).add(name)
+                declared_types[name] = ''.join(tok.value for tok in tokens[i:end])
+                tokens[end].kind = 'declaration'
+        statement_start = False
+        if t.value in keywords or t.value in contextual_keywords or t.value in bound_names or not t.value[0].islower():
+            continue
+        if i > 0 and tokens[i - 1].value == '.':
+            continue
+        if i + 1 < len(tokens) and tokens[i + 1].value in [':', '=>']:
+            continue
+        if not any(t.value in s for s in scopes) and t.value not in pending and t.value not in reported:
+            reported.add(t.value)
+            diagnostics.append(f"Line {t.line}: `{t.value}` is used but not declared.")
+    return diagnostics, declared_types
+
+def check_model_lists(tokens, declared_types):
+    diagnostics = []
+    model_lists = [n for n, ty in declared_types.items() if ty == 'List<DirectoryInfo>']
+    for name in model_lists:
+        filled = used = None
+        for i, t in enumerate(tokens[:-2]):
+            if t.value != name or t.kind == 'declaration':
+                continue
+            if tokens[i + 1].value == '.' and tokens[i + 2].value == 'Add':
+                filled = filled or t
+            elif tokens[i + 1].value == '[' or (tokens[i + 1].value == '.' and tokens[i + 2].value == 'Count'):
+                used = used or t
+            elif i > 0 and tokens[i - 1].value == '=' and i > 1 and tokens[i - 2].value == 'Models':
+                used = used or t
+        if used is not None and filled is None:
+            diagnostics.append(f"Line {used.line}: objects are picked from the model list `{name}`, but no model is added to it in the \"load models\" part.")
+    return diagnostics
+
+re_value = '(' + re_number + ')'
+re_trans_x = r'double\s+transXValue(\w*)\s*=\s*' + re_value + r'\s*;'
+re_trans_y = r'double\s+transYValue(\w*)\s*=\s*' + re_value + r'\s*;'
+re_rot_degree = r'double\s+rotValue(\w*)\s*=\s*' + re_value + r'\s*\*\s*Math\.PI\s*/\s*180(?:\.0)?\s*;'
+re_row = r'new\s*\{\s*Models\s*=\s*\w+\s*,\s*Name\s*=\s*"((?:[^"\\]|\\.)*)"\s*,\s*X\s*=\s*' + re_value + r'\s*,\s*Y\s*=\s*' + re_value + r'\s*,\s*Rot\s*=\s*' + re_value + r'\s*\}'
+
+def line_of(code, pos):
+    return code.count('\n', 0, pos) + 1
+
+def placed_objects(code):
+    # (line, x, y, degree, name) of every object the script places; only the
+    # rows of the compact table name their object
+    xs = {m.group(1): (line_of(code, m.start()), float(m.group(2))) for m in re.finditer(re_trans_x, code)}
+    ys = {m.group(1): float(m.group(2)) for m in re.finditer(re_trans_y, code)}
+    rots = {m.group(1): float(m.group(2)) for m in re.finditer(re_rot_degree, code)}
+    objects = [(line, x, ys[k], rots.get(k), None) for k, (line, x) in xs.items() if k in ys]
+    for m in re.finditer(re_row, code):
+        name = re.sub(r'\\(.)', r'\1', m.group(1))
+        objects.append((line_of(code, m.start()), float(m.group(2)), float(m.group(3)), float(m.group(4)), name))
+    return objects
+
+def same_degree(a, b):
+    return a is None or b is None or abs((a - b + 180) % 360 - 180) <= 0.5
+
+def check_placement_values(code, placement):
+    objects = placed_objects(code)
+    if len(objects) == 0:
+        return []
+    scene = Scene.from_placement(placement)
+    expected = [(name, float(x), float(y), None if np.isnan(degree) else float(degree))
+                for name, (x, y, _), degree, valid in zip(scene.names, scene.positions, scene.orientations, scene.valid()) if valid]
+    diagnostics, matched = [], set()
+    # named rows are compared with the object of that name, the others with any object at their position
+    names = {name: j for j, (name, _, _, _) in reversed(list(enumerate(expected)))}
+    for line, x, y, degree, placed_name in sorted(objects, key=lambda o: o[4] is None):
+        rotation = f" rotated {format_number(degree, 3)} degrees" if degree is not None else ""
+        j = names.get(placed_name)
+        if j is not None and j not in matched:
+            name, ex, ey, edegree = expected[j]
+            matched.add(j)
+            if abs(x - ex) > 1 or abs(y - ey) > 1 or not same_degree(degree, edegree):
+                expected_rotation = f" rotated {format_number(edegree, 3)} degrees" if edegree is not None else ""
+                diagnostics.append(f"Line {line}: {name} is placed at [{format_number(x, 3)}, {format_number(y, 3)}, 0]{rotation}, but the placement puts it at [{format_number(ex, 3)}, {format_number(ey, 3)}, 0]{expected_rotation}.")
+            continue
+        for j, (name, ex, ey, edegree) in enumerate(expected):
+            if j not in matched and abs(x - ex) <= 1 and abs(y - ey) <= 1 and same_degree(degree, edegree):
+                matched.add(j)
+                break
+        else:
+            diagnostics.append(f"Line {line}: an object is placed at [{format_number(x, 3)}, {format_number(y, 3)}, 0]{rotation}, but no object of the placement has this position and orientation.")
+    for j, (name, ex, ey, edegree) in enumerate(expected):
+        if j not in matched:
+            rotation = f" rotated {format_number(edegree, 3)} degrees" if edegree is not None else ""
+            diagnostics.append(f"{name} should be placed at [{format_number(ex, 3)}, {format_number(ey, 3)}, 0]{rotation}, but the code does not place it there.")
+    return diagnostics
+
+# Checks the fixed shape of the generated script: balanced brackets, unique
+# and declared variables, model lists that are filled before objects are
+# picked from them and, given the placement, that the coordinates and angles
+# in the code are the ones of the placement. Returns diagnostics with line
+# numbers; an empty list means the script passes.
+def check_script(code, placement=None):
+    tokens = tokenize(code)
+    diagnostics = [f"Line {t.line}: unexpected character `{t.value}`." for t in tokens if t.kind == 'error']
+    diagnostics += check_brackets(tokens)
+    declaration_diagnostics, declared_types = check_declarations(tokens)
+    diagnostics += declaration_diagnostics
+    diagnostics += check_model_lists(tokens, declared_types)
+    if placement is not None:
+        diagnostics += check_placement_values(code, placement)
+    return diagnostics
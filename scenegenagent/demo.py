@@ -1,7 +1,10 @@
 import gradio as gr
+from argparse import ArgumentParser
 from layout_analysis import process_prompt
 from code_gen import gen_code, show_complete_code
 from model import LocalModel, GPT4O
+from budget import Budget
+from memo import StageMemo, set_stage_memo
 
 def generate(text):
     # Set the models you want to use. Set to None to use the default model
@@ -18,21 +21,35 @@ def generate(text):
     assert model_dict['default'] is not None
     model_default = model_dict['default']
     model_dict = {k: v if v else model_default for k, v in model_dict.items()}
+    # give up on a description instead of pinning the worker
+    budget = Budget(timeout=600, request_timeout=180, max_attempts=10)
     objects, placement, rewritten_prompt, _, _ = process_prompt(text,
         model_retrieve_objects=model_dict.get('retrieve_objects', model_default),
         model_extract_layout=model_dict.get('extract_layout', model_default),
         model_assign_placement=model_dict.get('assign_placement', model_default),
         model_check_positional_error=model_dict.get('check_positional_error', model_default),
-        model_fix_positional_error=model_dict.get('fix_positional_error', model_default)
+        model_fix_positional_error=model_dict.get('fix_positional_error', model_default),
+        budget=budget
     )
+    if placement is None:
+        return f"// Failed to generate the scene: {budget.failure['stage']}: {budget.failure['reason']}"
     code, _ = gen_code(rewritten_prompt, objects, placement,
         model=model_default,
         model_generate_code=model_dict.get('generate_code', model_default),
-        model_fix_code=model_dict.get('fix_code', model_default)
+        model_fix_code=model_dict.get('fix_code', model_default),
+        budget=budget
     )
+    if code is None:
+        return f"// Failed to generate the scene: {budget.failure['stage']}: {budget.failure['reason']}"
     code = show_complete_code(code)
     return code
 
+parser = ArgumentParser()
+parser.add_argument('--memo-entries', type=int, default=None, help='Answer resubmitted descriptions from the stage results of the first run, keeping up to this many in memory')
+args = parser.parse_args()
+if args.memo_entries is not None:
+    set_stage_memo(StageMemo(max_entries=args.memo_entries))
+
 descriptions = [
     "Create a scene with multiple robots and cabinets and 3 worktables. Position 3 worktables with a 2.5-meter interval between each. Ensure that every table is closely accompanied by two robots and one cabinet.",
     "Create a layout featuring 6 robots positioned alongside two conveyor belts that are lined up end-to-end. Arrange 3 robots on each side of the conveyor belts in a straight line, with 1.5-meter intervals between each arm.",
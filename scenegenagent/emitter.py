@@ -0,0 +1,93 @@
+import re
+import numpy as np
+from scene import Scene
+from cleaning import compact_place_code
+from catalog import guidance_key
+
+start_code = """string rootDir = TxApplication.SystemRootDirectory;
+string weldingLibPath = Path.Combine(rootDir, "Welding");
+string[] weldingModels = Directory.GetDirectories(weldingLibPath, "*.cojt", SearchOption.TopDirectoryOnly);"""
+
+load_code = """foreach (string model in weldingModels)
+{{
+    DirectoryInfo directoryInfo = new DirectoryInfo(model);
+
+{load_models}
+}}
+
+Random rand = new Random();
+TxPhysicalRoot txPhysicalRoot = TxApplication.ActiveDocument.PhysicalRoot;"""
+
+place_code = """DirectoryInfo objModel{i} = {model_list}[rand.Next(0, {model_list}.Count)];
+string obj{i}Name = Path.GetFileNameWithoutExtension(objModel{i}.Name) + "_" + DateTime.Now.ToString("yyyy-MM-dd-HH-mm-ss");
+TxInsertComponentCreationData txInsertDataObj{i} = new TxInsertComponentCreationData(obj{i}Name, objModel{i}.FullName);
+ITxComponent txComponentObject{i} = txPhysicalRoot.InsertComponent(txInsertDataObj{i});
+
+double transXValue{i} = {x};
+double transYValue{i} = {y};
+double rotValue{i} = {degree} * Math.PI / 180.0;
+TxTransformation txTransTransXYRotZ{i} = new TxTransformation(new TxVector(transXValue{i}, transYValue{i}, 0.0), new TxVector(0.0, 0.0, rotValue{i}), TxTransformation.TxRotationType.RPY_ZYX);
+ITxLocatableObject obj{i} = (ITxLocatableObject)txComponentObject{i};
+obj{i}.AbsoluteLocation *= txTransTransXYRotZ{i};"""
+
+compact_row_code = '    new {{ Models = {model_list}, Name = {name}, X = {x}, Y = {y}, Rot = {degree} }},'
+compact_loop_code = compact_place_code[compact_place_code.index('foreach'):]
+
+end_code = "TxApplication.RefreshDisplay();"
+
+def parse_snippet(guidance):
+    # the C# block of a guidance file and the model list it fills
+    snippet = re.findall(r'```csharp\n([\s\S]*?)\n```', guidance)
+    model_list = re.findall(r'(\w+)\.Add\(directoryInfo\);', guidance)
+    if len(snippet) != 1 or len(set(model_list)) != 1:
+        return None
+    return snippet[0], model_list[0]
+
+def csharp_number(value):
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+def csharp_double(value):
+    # rows of an anonymous type table must all infer the same field types
+    return repr(float(value))
+
+def csharp_string(value):
+    return '"' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+# Renders the scene script from a validated placement without calling a model.
+# The loaders come from the guidance snippets of each object type, and every
+# object gets the insert-and-transform block of code_gen_template with its own
+# variable names. Returns None if an object has no guidance or its position or
+# orientation is not a plain number, so that the model can write the code.
+# In compact mode the objects are listed in one table and inserted by a
+# single loop, which keeps scripts of large scenes short.
+def emit_code(placement, guidance, compact=False):
+    scene = Scene.from_placement(placement)
+    model_lists, loaders, blocks = [], [], []
+    for i, (name, position, degree) in enumerate(zip(scene.names, scene.positions, scene.orientations), 1):
+        key = guidance_key(name)
+        if key not in guidance:
+            return None
+        snippet = parse_snippet(guidance[key])
+        if snippet is None or np.isnan(position).any() or np.isnan(degree):
+            return None
+        loader, model_list = snippet
+        if model_list not in model_lists:
+            model_lists.append(model_list)
+            loaders.append('\n'.join(f'    {line}' if line else line for line in loader.split('\n')))
+        if compact:
+            blocks.append(compact_row_code.format(model_list=model_list, name=csharp_string(name), x=csharp_double(position[0]), y=csharp_double(position[1]), degree=csharp_double(degree)))
+        else:
+            blocks.append(place_code.format(i=i, model_list=model_list, x=csharp_number(position[0]), y=csharp_number(position[1]), degree=csharp_number(degree)))
+    if len(blocks) == 0:
+        return None
+    if compact:
+        blocks = ['var sceneObjects = new[]\n{\n' + '\n'.join(blocks) + '\n};', compact_loop_code]
+    declarations = '\n'.join(f'List<DirectoryInfo> {m} = new List<DirectoryInfo>();' for m in model_lists)
+    return '\n\n'.join([
+        start_code,
+        declarations,
+        load_code.format(load_models='\n\n'.join(loaders)),
+        '\n\n'.join(blocks),
+        end_code,
+    ])
@@ -1,12 +1,20 @@
 import os
 import json
+import asyncio
 import pandas as pd
 from multiprocessing import Process
 from tqdm import tqdm
 from argparse import ArgumentParser
-from layout_analysis import process_prompt
-from code_gen import gen_code, show_complete_code
+from layout_analysis import process_prompt, process_prompt_async
+from code_gen import gen_code, gen_code_async, show_complete_code
 from model import GPT4O, LocalModel
+from cache import ResponseCache, replay_scope
+from memo import StageMemo, set_stage_memo, memo_stats
+from budget import Budget
+from catalog import guidance_index
+from tokens import set_tokenizer
+from placement_format import stage_formats, placement_formats
+from schemas import guided_decoding_modes
 
 model_dict = {
     'default': LocalModel('<model-checkpoint-path>', base_url='http://localhost:8000/v1'),
@@ -21,53 +29,174 @@ model_dict = {
 assert model_dict['default'] is not None
 model_default = model_dict['default']
 model_dict = {k: v if v else model_default for k, v in model_dict.items()}
+budget_kwargs = {}
+pipeline_kwargs = {}
+code_gen_kwargs = {}
 
 def generate(text):
+    budget = Budget(**budget_kwargs)
     objects, placement, rewritten_prompt, _, _ = process_prompt(text,
         model_retrieve_objects=model_dict.get('retrieve_objects', model_default),
         model_extract_layout=model_dict.get('extract_layout', model_default),
         model_assign_placement=model_dict.get('assign_placement', model_default),
         model_check_positional_error=model_dict.get('check_positional_error', model_default),
-        model_fix_positional_error=model_dict.get('fix_positional_error', model_default)
+        model_fix_positional_error=model_dict.get('fix_positional_error', model_default),
+        budget=budget,
+        **pipeline_kwargs
     )
+    if placement is None:
+        return None, budget
     code, _ = gen_code(rewritten_prompt, objects, placement,
         model=model_default,
         model_generate_code=model_dict.get('generate_code', model_default),
-        model_fix_code=model_dict.get('fix_code', model_default)
+        model_fix_code=model_dict.get('fix_code', model_default),
+        budget=budget,
+        **code_gen_kwargs
     )
-    code = show_complete_code(code)
-    return code
+    code = show_complete_code(code) if code else None
+    return code, budget
+
+async def generate_async(text):
+    budget = Budget(**budget_kwargs)
+    objects, placement, rewritten_prompt, _, _ = await process_prompt_async(text,
+        model_retrieve_objects=model_dict.get('retrieve_objects', model_default),
+        model_extract_layout=model_dict.get('extract_layout', model_default),
+        model_assign_placement=model_dict.get('assign_placement', model_default),
+        model_check_positional_error=model_dict.get('check_positional_error', model_default),
+        model_fix_positional_error=model_dict.get('fix_positional_error', model_default),
+        budget=budget,
+        **pipeline_kwargs
+    )
+    if placement is None:
+        return None, budget
+    code, _ = await gen_code_async(rewritten_prompt, objects, placement,
+        model=model_default,
+        model_generate_code=model_dict.get('generate_code', model_default),
+        model_fix_code=model_dict.get('fix_code', model_default),
+        budget=budget,
+        **code_gen_kwargs
+    )
+    code = show_complete_code(code) if code else None
+    return code, budget
+
+def add_prompt_tokens(total, report):
+    for stage, r in report.items():
+        total.setdefault(stage, {"requests": 0, "prompt_tokens": 0})
+        total[stage]["requests"] += r["requests"]
+        total[stage]["prompt_tokens"] += r["prompt_tokens"]
+
+async def worker_async(data, output_path, concurrency):
+    prompt_tokens = {}
+    semaphore = asyncio.Semaphore(concurrency)
+    pbar = tqdm(total=len(data))
+    with open(output_path, 'w', encoding='utf-8') as f:
+        async def run(d):
+            # each run is a task of its own, so the scope is not shared
+            replay_scope.set(d['id'])
+            async with semaphore:
+                d['code'], budget = await generate_async(d['description'])
+            if budget.failure is not None:
+                d['failure'] = budget.failure
+            d['prompt_tokens'] = budget.prompt_report()
+            add_prompt_tokens(prompt_tokens, d['prompt_tokens'])
+            f.write(json.dumps(d, ensure_ascii=False) + '\n')
+            f.flush()
+            pbar.update(1)
+        await asyncio.gather(*[run(d) for d in data])
+    pbar.close()
+    print(f"Prompt tokens: {prompt_tokens}")
+    if model_default.cache is not None:
+        print(f"Cache: {model_default.cache.stats()}")
+    if memo_stats() is not None:
+        print(f"Stage memo: {memo_stats()}")
 
 def worker(id, data, output_path):
+    prompt_tokens = {}
     with open(output_path, 'w', encoding='utf-8') as f:
         for i in tqdm(range(len(data))):
-            code = generate(data[i]['description'])
+            replay_scope.set(data[i]['id'])
+            code, budget = generate(data[i]['description'])
             data[i]['code'] = code
+            if budget.failure is not None:
+                data[i]['failure'] = budget.failure
+            data[i]['prompt_tokens'] = budget.prompt_report()
+            add_prompt_tokens(prompt_tokens, data[i]['prompt_tokens'])
             f.write(json.dumps(data[i], ensure_ascii=False) + '\n')
             f.flush()
+    print(f"Worker {id} prompt tokens: {prompt_tokens}")
+    if model_default.cache is not None:
+        print(f"Worker {id} cache: {model_default.cache.stats()}")
+    if memo_stats() is not None:
+        print(f"Worker {id} stage memo: {memo_stats()}")
 
 if __name__ == '__main__':
     parser = ArgumentParser()
     parser.add_argument('--prompts', type=str, default='benchmark/test_data.csv')
     parser.add_argument('--output-path', type=str, required=True)
+    parser.add_argument('--use-async', action='store_true', help='Run all requests in a single process with asyncio')
+    parser.add_argument('--concurrency', type=int, default=128, help='Maximum number of descriptions in flight with --use-async')
+    parser.add_argument('--cache-path', type=str, default=None, help='SQLite file to cache model responses in')
+    parser.add_argument('--cache-replay', action='store_true', help='Only serve responses from the cache and fail on misses')
+    parser.add_argument('--cache-max-entries', type=int, default=None, help='Evict the least recently used cached responses beyond this many')
+    parser.add_argument('--cache-max-bytes', type=int, default=None, help='Evict the least recently used cached responses beyond this total size')
+    parser.add_argument('--cache-max-age', type=float, default=None, help='Drop cached responses older than this many seconds')
+    parser.add_argument('--memo-entries', type=int, default=None, help='Reuse the stage results of repeated descriptions, keeping up to this many in memory')
+    parser.add_argument('--memo-path', type=str, default=None, help='SQLite file to also keep the stage results in across runs and workers')
+    parser.add_argument('--stream', action='store_true', help='Stream responses and stop each stage as soon as its answer can be parsed')
+    parser.add_argument('--timeout', type=float, default=None, help='Wall-clock budget in seconds for each description')
+    parser.add_argument('--request-timeout', type=float, default=None, help='HTTP timeout in seconds for each model request')
+    parser.add_argument('--max-attempts', type=int, default=None, help='Maximum number of model calls per stage for each description')
+    parser.add_argument('--solver', action='store_true', help='Solve the coordinates locally when every extracted relation reduces to distances and directions, instead of assigning them with the model')
+    parser.add_argument('--num-candidates', type=int, default=1, help='Sample this many placements and programs in parallel and keep the first valid one')
+    parser.add_argument('--explicit-layout', action='store_true', help='Skip the layout stages when the description gives every object a coordinate')
+    parser.add_argument('--emitter', action='store_true', help='Render the code from the placement and the object loaders, calling the model only for what they do not cover')
+    parser.add_argument('--compact-code', action='store_true', help='Write the objects as one table and a single insertion loop instead of one block per object')
+    parser.add_argument('--max-prompt-tokens', type=int, default=None, help='Fail a description when the prompt of a single request exceeds this many tokens')
+    parser.add_argument('--tokenizer', type=str, default=None, help='Hugging Face tokenizer used to count prompt tokens (an approximate count is used by default)')
+    parser.add_argument('--guided-decoding', type=str, default=None, choices=guided_decoding_modes, help='Constrain the structured stages to their step format with vLLM guided_regex/guided_json or OpenAI response_format')
+    parser.add_argument('--arrangement-macros', action='store_true', help='Let assign_placement write rows, grids, circles and mirrored copies as one entry that is expanded locally')
+    parser.add_argument('--placement-format', type=str, nargs='+', default=[], help=f'Format of the placements in the prompts, one of {placement_formats}, for every stage or as stage=format, e.g. assign_placement=table')
     args = parser.parse_args()
+    for f in args.placement_format:
+        stage, fmt = f.split('=') if '=' in f else (None, f)
+        assert fmt in placement_formats and (stage is None or stage in stage_formats), f"invalid placement format: {f}"
+        stage_formats.update({stage: fmt} if stage is not None else {s: fmt for s in stage_formats})
+    set_tokenizer(args.tokenizer)
+    pipeline_kwargs.update(use_solver=args.solver, num_candidates=args.num_candidates, use_explicit_layout=args.explicit_layout, use_macros=args.arrangement_macros)
+    code_gen_kwargs.update(num_candidates=args.num_candidates, use_emitter=args.emitter, compact=args.compact_code)
+    budget_kwargs.update(timeout=args.timeout, request_timeout=args.request_timeout, max_attempts=args.max_attempts, max_prompt_tokens=args.max_prompt_tokens)
+    for m in model_dict.values():
+        m.stream = args.stream
+        m.guided_decoding = args.guided_decoding
+    if args.cache_path:
+        cache = ResponseCache(args.cache_path, max_entries=args.cache_max_entries, max_bytes=args.cache_max_bytes, max_age=args.cache_max_age, readonly=args.cache_replay)
+        for m in model_dict.values():
+            m.cache = cache
+    if args.memo_entries is not None or args.memo_path:
+        set_stage_memo(StageMemo(args.memo_entries if args.memo_entries is not None else 1024, args.memo_path))
     data = pd.read_csv(args.prompts)
     data = [dict(i[1]) for i in data.iterrows()]
     data = [{k: d[k] for k in ['id', 'description']} for d in data]
     os.makedirs(os.path.split(args.output_path)[0], exist_ok=True)
 
-    num_workers = 8
+    if args.use_async:
+        asyncio.run(worker_async(data, args.output_path.replace('.json', '_0.json'), args.concurrency))
+        num_workers = 1
+    else:
+        num_workers = 8
+        # read the guidance once here so that the forked workers share it
+        guidance_index.refresh()
 
-    k, m = divmod(len(data), num_workers)
-    data_workers = [data[i * k + min(i, m) : (i + 1) * k + min(i + 1, m)] for i in range(num_workers)]
+        k, m = divmod(len(data), num_workers)
+        data_workers = [data[i * k + min(i, m) : (i + 1) * k + min(i + 1, m)] for i in range(num_workers)]
 
-    processes = []
-    for i in range(num_workers):
-        p = Process(target=worker, args=(i, data_workers[i], args.output_path.replace('.json', f'_{i}.json')))
-        p.start()
-        processes.append(p)
-    for p in processes:
-        p.join()
+        processes = []
+        for i in range(num_workers):
+            p = Process(target=worker, args=(i, data_workers[i], args.output_path.replace('.json', f'_{i}.json')))
+            p.start()
+            processes.append(p)
+        for p in processes:
+            p.join()
 
     results = [i for j in [list(map(json.loads, open(args.output_path.replace('.json', f'_{k}.json'), encoding='utf-8').readlines())) for k in range(num_workers)] for i in j]
     results = sorted(results, key=lambda x: x['id'])
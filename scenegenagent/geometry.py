@@ -0,0 +1,131 @@
+import re
+import json
+import numpy as np
+from scene import Scene, parse_position, parse_degree
+from placement_format import format_number
+from solver import parse_relation, re_distance, to_millimeters
+from catalog import object_permitted
+
+min_distance = 1000
+
+def load_records(records):
+    # the dicts of a JSON list given as text or already parsed
+    if not records:
+        return []
+    if isinstance(records, str):
+        try:
+            records = json.loads(records)
+        except ValueError:
+            return []
+    return [r for r in records if isinstance(r, dict)]
+
+def explicit_positions(coordinates):
+    positions = {}
+    for c in load_records(coordinates):
+        if 'name' not in c:
+            continue
+        position = parse_position(c.get('position'))
+        if position is not None:
+            positions[c['name']] = position
+    return positions
+
+def stated_distances(relations):
+    # the shortest distance the relations state between each pair of objects
+    distances = {}
+    for r in load_records(relations):
+        names, relation = (r.get('object 1'), r.get('object 2')), str(r.get('relation', ''))
+        stated = [to_millimeters(value, unit) for value, unit in re.findall(re_distance, relation.lower())]
+        try:
+            displacement, _ = parse_relation(relation)
+            if displacement is not None:
+                stated.append(float(np.hypot(*displacement)))
+        except ValueError:
+            pass
+        if len(stated) > 0 and None not in names:
+            for pair in [names, names[::-1]]:
+                distances[pair] = min([distances.get(pair, np.inf)] + [abs(d) for d in stated])
+    return distances
+
+def format_position(position):
+    return '[{}]'.format(', '.join(format_number(v, 3) for v in position))
+
+# Checks the rules of the positional-error checker that are pure geometry:
+# every object of the object list is placed, every object has a coordinate
+# [x, y, 0], coordinates given in the description are kept, and objects are more than 1000 apart (Guarding excepted, as are
+# pairs whose coordinates were both given explicitly, and pairs a relation
+# puts at most 1000 apart, which are left to the checker). Returns the
+# violations as feedback messages; an empty list means the placement passes.
+def check_placement(placement, coordinates=None, relations=None, objects=None):
+    errors = []
+    explicit = explicit_positions(coordinates)
+    stated = stated_distances(relations)
+    scene = Scene.from_placement(placement)
+    for name in load_objects(objects):
+        if name not in scene.names:
+            errors.append(f"{name} is in the object list, but it is not placed.")
+    for i in np.flatnonzero(~scene.valid()):
+        errors.append(f"The position of {scene.names[i]} is {json.dumps(scene.position_values[i])}, which is not a coordinate in the form of [x, y, 0].")
+    keep = np.flatnonzero(scene.valid())
+    if len(keep) == 0:
+        return errors
+    names, positions = [scene.names[i] for i in keep], scene.positions[keep]
+
+    for i in np.flatnonzero(positions[:, 2] != 0):
+        errors.append(f"The z-coordinate of {names[i]} {format_position(positions[i])} should be 0.")
+
+    is_explicit = np.array([n in explicit for n in names])
+    for i in np.flatnonzero(is_explicit):
+        expected = np.asarray(explicit[names[i]], dtype=np.float64)
+        if np.abs(positions[i, :2] - expected[:2]).max() > 1:
+            errors.append(f"The coordinate of {names[i]} is given as {format_position(expected)} in the description, but it is placed at {format_position(positions[i])}.")
+
+    is_guarding = np.array(['guarding' in n.lower() for n in names])
+    distance = scene.distances()[np.ix_(keep, keep)]
+    overlap = distance <= min_distance
+    overlap &= np.triu(np.ones_like(overlap), k=1)
+    overlap &= ~(is_guarding[:, None] | is_guarding[None, :])
+    overlap &= ~(is_explicit[:, None] & is_explicit[None, :])
+    for i, j in zip(*np.nonzero(overlap)):
+        if stated.get((names[i], names[j]), np.inf) <= min_distance:
+            continue
+        errors.append(f"The Euclidean distance between {names[i]} {format_position(positions[i])} and {names[j]} {format_position(positions[j])} is {distance[i, j]:.0f}, which is not greater than {min_distance}, so they overlap with each other.")
+    return errors
+
+def load_objects(objects):
+    # the permitted names of an object list given as JSON text or a list
+    if not objects:
+        return []
+    if isinstance(objects, str):
+        try:
+            objects = json.loads(objects)
+        except ValueError:
+            return []
+    return [o for o in objects if isinstance(o, str) and object_permitted(o)]
+
+# True when the description only gives coordinates, and angles if any, of
+# every placed object, so that check_placement covers all of it and nothing
+# is left for the positional-error checker. Relations, objects without a
+# coordinate and orientations that are not angles, e.g. "towards the
+# Conveyor", all need the checker.
+def covers_description(placement, coordinates=None, relations=None):
+    if has_relations(relations):
+        return False
+    scene = Scene.from_placement(placement)
+    explicit = {c['name']: c for c in load_records(coordinates) if 'name' in c}
+    if len(scene.names) == 0:
+        return False
+    for name, degree in zip(scene.names, scene.orientations):
+        if name not in explicit or parse_position(explicit[name].get('position')) is None:
+            return False
+        expected = parse_degree(explicit[name].get('orientation'))
+        if expected is None or np.isnan(degree) or abs((degree - expected + 180) % 360 - 180) > 0.5:
+            return False
+    return True
+
+def has_relations(relations):
+    if not relations:
+        return False
+    try:
+        return len(json.loads(relations) if isinstance(relations, str) else relations) > 0
+    except ValueError:
+        return True
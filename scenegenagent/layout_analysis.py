@@ -1,11 +1,31 @@
 import re
 import json
+import math
 import traceback
-from typing import List
-from cleaning import clean_prompt, contain_positional_error
+from catalog import permission_list, object_permitted
+from cleaning import clean_prompt, contain_coords, item_list, contain_positional_error_calls, leave_format
+from budget import Budget, BudgetExceeded
+from geometry import check_placement, covers_description, parse_position, parse_degree
+from solver import solve_placement
+import sampling
+from calls import call, run_calls, run_calls_async
+from placement_format import format_number, stage_formats, format_placement, parse_table, parse_placement_list, json_spec, table_spec
+from schemas import list_objects_format, extract_layout_format, assign_placement_format
+from steps import StepParser, parse_steps
+from scene import Scene
+from memo import memo_get, memo_put, normalize_text, normalize_objects
 
-def re_find(regex, text):
-    return targets[0] if len(targets := re.findall(regex, text)) > 0 else None
+def leave_step_format(text, num_steps):
+    steps = parse_steps(text)
+    if leave_format(steps.text, '#Step 1'):
+        return True
+    numbers = steps.numbers()
+    return numbers != list(range(1, len(numbers) + 1)) or len(numbers) > num_steps
+
+def step_format_abort(num_steps):
+    # a streaming check that parses the text as it arrives
+    steps = StepParser()
+    return lambda text: leave_step_format(steps.update(text), num_steps)
 
 ### retrieve objects
 prompt_fix_objects = """You are given a description of a workstation, which is used to build a scene in Process Simulate (PS).
@@ -47,31 +67,50 @@ New Description: <new description>
 ```
 Do not say anything else."""
 
-def list_objects(text, model_retrieve_objects):
-    def parse_analysis(text):
-        analysis = []
-        re_steps = [
-            r'#Step 1:[\s\S]+?\nAnalysis:\s*([\s\S]*?)\s*\nObjects:',
-            r'#Step 2:[\s\S]+?\nAnalysis:\s*([\s\S]*?)\s*\nObjects:',
-            r'#Step 3:[\s\S]+?\nAnalysis:\s*([\s\S]*?)\s*\nNew Description:',
-        ]
-        step_names = ['Find all objects', 'Fix object names', 'Rewrite description']
-        for re_step, step_name in zip(re_steps, step_names):
-            as1 = re_find(re_step, text)
-            if as1:
-                analysis.append((step_name, as1))
-        return analysis
+def parse_analysis(text, step_names):
+    # the analysis of step i + 1 for each name
+    steps = parse_steps(text)
+    analysis = []
+    for i, step_name in enumerate(step_names):
+        as1 = steps.get(i + 1, 'Analysis')
+        if as1:
+            analysis.append((step_name, as1))
+    return analysis
+
+def parse_list_objects_analysis(text):
+    step_names = ['Find all objects', 'Fix object names', 'Rewrite description']
+    return parse_analysis(text, step_names)
 
+def parse_objects(text):
+    steps = parse_steps(text)
+    obj_lists = [m.group() for objects in steps.values('Objects') for m in [re.match(r'\[.*?\]', objects, re.DOTALL)] if m is not None]
+    descriptions = steps.values('New Description')
+    if len(obj_lists) > 0 and len(descriptions) > 0:
+        print("Objects:", steps.text)
+        print()
+        analysis = parse_list_objects_analysis(steps)
+        return obj_lists[-1], descriptions[-1], analysis
+    return None
+
+def list_objects_abort():
+    return step_format_abort(3)
+
+def list_objects_calls(text, model_retrieve_objects, budget=None):
+    budget = budget if budget is not None else Budget()
     model_input = prompt_fix_objects.format(prompt=text)
     while True:
-        text = model_retrieve_objects.generate(model_input)
-        obj_lists = re.findall(r"Objects:\s*(\[.*?\])", text)
-        descriptions = [l for l in re.findall(r'New Description:\s*([\s\S]*?)(?:$|`)', text)]
-        if len(obj_lists) > 0 and len(descriptions) > 0:
-            print("Objects:", text)
-            print()
-            analysis = parse_analysis(text)
-            return obj_lists[-1], descriptions[-1], analysis
+        budget.attempt('retrieve_objects', model_input)
+        text = yield call(model_retrieve_objects, 'generate', model_input, abort=budget.guard(list_objects_abort()), schema=list_objects_format, **budget.request_kwargs())
+        result = parse_objects(text)
+        if result is not None:
+            return result
+        budget.parse_failure('retrieve_objects')
+
+def list_objects(text, model_retrieve_objects, budget=None):
+    return run_calls(list_objects_calls(text, model_retrieve_objects, budget))
+
+async def list_objects_async(text, model_retrieve_objects, budget=None):
+    return await run_calls_async(list_objects_calls(text, model_retrieve_objects, budget))
 
 standard_item_name = """The objects in the description must be from the list: {item_list}.
 If there are objects that are not in the above list, replace them with the most resembling objects from the list or remove it.
@@ -159,17 +198,11 @@ Relative Positions:
 Do not say anything else."""
 
 def parse_placement(text):
+    steps = parse_steps(text)
     ocr = []
-    for re_ocr in [
-        r"#Step 1:[\s\S]+?\nObjects:\s*([\s\S]*?)\s*#Step 2",
-        r"#Step 2:[\s\S]+?\nPositions:\s*([\s\S]*?)\s*#Step 3",
-        r"#Step 3:[\s\S]+?\nRelative Positions:\s*([\s\S]*?)\s*(?:`|$)",
-    ]:
-        o = re.findall(re_ocr, text)
-        if len(o) == 0:
-            o = None
-        else:
-            o = o[0]
+    for step, label in [(1, 'Objects'), (2, 'Positions'), (3, 'Relative Positions')]:
+        o = steps.get(step, label)
+        if o is not None:
             startpos, endpos = o.find('['), o.rfind(']')
             o = None if startpos == -1 or endpos == -1 or startpos >= endpos else o[startpos:endpos + 1]
             if o:
@@ -181,30 +214,43 @@ def parse_placement(text):
     o, c, r = ocr[0], ocr[1], ocr[2]
     return o, c, r
 
-def extract_layout(text, objects, model_extract_layout):
-    def parse_analysis(text):
-        analysis = []
-        re_steps = [
-            r'#Step 1:[\s\S]+?\nAnalysis:\s*([\s\S]*?)\s*\nObjects:',
-            r'#Step 2:[\s\S]+?\nAnalysis:\s*([\s\S]*?)\s*\nPositions:',
-            r'#Step 3:[\s\S]+?\nAnalysis:\s*([\s\S]*?)\s*\nRelative Positions:',
-        ]
-        step_names = ['Identify Objects', 'Absolute Positions', 'Relative Positions']
-        for re_step, step_name in zip(re_steps, step_names):
-            as1 = re_find(re_step, text)
-            if as1:
-                analysis.append((step_name, as1))
-        return analysis
+def parse_extract_layout_analysis(text):
+    step_names = ['Identify Objects', 'Absolute Positions', 'Relative Positions']
+    return parse_analysis(text, step_names)
+
+def extract_layout_until(steps=None):
+    # the stage passes its own parser, to reuse what the stream parsed for the answer
+    steps = steps if steps is not None else StepParser()
+    return lambda text: text.rstrip().rstrip('`').rstrip().endswith(']') and all(parse_placement(steps.update(text)))
+
+def extract_layout_abort():
+    return step_format_abort(3)
 
+def extract_layout_calls(text, objects, model_extract_layout, budget=None):
+    key, memo = memo_get('extract_layout', model_extract_layout.model, normalize_text(text), normalize_objects(objects))
+    if memo is not None:
+        return tuple(memo)
+    budget = budget if budget is not None else Budget()
     model_input = prompt_extract_layout.format(prompt=text, objects=objects)
     while True:
-        model_output = model_extract_layout.generate(model_input)
-        o, c, r = parse_placement(model_output)
+        budget.attempt('extract_layout', model_input)
+        steps = StepParser()
+        model_output = yield call(model_extract_layout, 'generate', model_input, until=extract_layout_until(steps), abort=budget.guard(extract_layout_abort()), schema=extract_layout_format, **budget.request_kwargs())
+        steps = steps.update(model_output)
+        o, c, r = parse_placement(steps)
         if o and c and r:
             print("Positions:", model_output)
             print()
-            analysis = parse_analysis(model_output)
+            analysis = parse_extract_layout_analysis(steps)
+            memo_put('extract_layout', key, [model_output, o, c, r, analysis])
             return model_output, o, c, r, analysis
+        budget.parse_failure('extract_layout')
+
+def extract_layout(text, objects, model_extract_layout, budget=None):
+    return run_calls(extract_layout_calls(text, objects, model_extract_layout, budget))
+
+async def extract_layout_async(text, objects, model_extract_layout, budget=None):
+    return await run_calls_async(extract_layout_calls(text, objects, model_extract_layout, budget))
 
 ### assign placement
 prompt_assign_placement = """You are given a description of a workstation wherein a series of objects exist, with their respective positions mentioned in the form of coordinates and relative positioning to one another. The description is as follows:
@@ -279,43 +325,130 @@ Positions:
 Do not say anything else.
 """
 
-permission_list = ["Kuka Robot KR125", "Kuka Robot KR350", "ABB Robot IRB6600", "YASKAWA Robot ma01800", "Welding Table", "Turntable", "Cabinet", "ValveStand", "Conveyor", "Guarding"]
-def object_permitted(object):
-    for p in permission_list:
-        if p in object:
-            return True
-    return False
+### arrangement macros
+arrangement_guidance = """Instead of listing every object of a regular arrangement, you may write one entry for the whole arrangement in Step 2 and Step 3, which will be expanded into objects named "<object name> 1", "<object name> 2", and so on:
+- A row of objects: {{"name": "<object name>", "arrangement": "row", "count": <number of objects>, "origin": "[x, y, 0]", "spacing": <distance between neighbors>, "heading": <direction of the row in degrees>, "orientation": "<orientation>"}}
+- A grid of objects: {{"name": "<object name>", "arrangement": "grid", "rows": <number of rows>, "columns": <number of columns>, "origin": "[x, y, 0]", "spacing": "[<distance along the row>, <distance between rows>, 0]", "heading": <direction of the rows in degrees>, "orientation": "<orientation>"}}
+- A circle of objects: {{"name": "<object name>", "arrangement": "circle", "count": <number of objects>, "center": "[x, y, 0]", "radius": <radius>, "heading": <direction of the first object from the center in degrees>, "orientation": "<orientation, or towards the center>"}}
+- Mirrored copies of placed objects: {{"name": "<object name>", "arrangement": "mirror", "of": "<name of the objects to copy>", "across": "<name of the object to mirror across>", "axis": "<x, y or point>"}}, where axis "x" mirrors across the line through that object parallel to the x-axis.
+The heading 0 is the positive direction of the x-axis and 90 is the positive direction of the y-axis.
+"""
 
-def parse_coordinates(text, coordinates):
-    coords = []
-    for re_coord in [
-        r"#Step 2:[\s\S]+?\nPositions:\s*([\s\S]*?)\s*(?:`|#Step 3)",
-        r"#Step 3:[\s\S]+?\nPositions:\s*([\s\S]*?)\s*(?:`|$)",
-    ]:
-        coord = re.findall(re_coord, text)
-        if len(coord) == 0:
-            coord = None
+def arrangement_number(macro, key, default=None):
+    value = macro.get(key, default)
+    if value is None:
+        raise ValueError(f"The {macro.get('arrangement')} arrangement of {macro.get('name')} needs \"{key}\".")
+    number = re.fullmatch(r'\s*(-?\d+(?:\.\d+)?)\s*(?:mm|degrees?|deg|°)?\s*', str(value))
+    if number is None:
+        raise ValueError(f"\"{key}\" of the {macro.get('arrangement')} arrangement of {macro.get('name')} should be a number, not {json.dumps(value)}.")
+    return float(number.group(1))
+
+def arrangement_point(macro, key):
+    point = parse_position(macro.get(key))
+    if point is None:
+        raise ValueError(f"\"{key}\" of the {macro.get('arrangement')} arrangement of {macro.get('name')} should be a coordinate in the form of [x, y, 0].")
+    return point[0], point[1]
+
+def instance_names(name, count, listed):
+    # numbers continue after the instances listed before in the same list
+    taken = [int(m.group(1)) for n in listed for m in [re.fullmatch(re.escape(name) + r' (\d+)', n)] if m is not None]
+    if count == 1 and name not in listed and len(taken) == 0:
+        return [name]
+    start = max(taken, default=0) + 1
+    return [f"{name} {i}" for i in range(start, start + count)]
+
+def arrangement_orientation(orientation, degree):
+    # "towards the center" of a circle becomes the angle pointing at it
+    if isinstance(orientation, str) and re.search(r'\b(towards?|facing|face) the center\b|\binwards?\b', orientation.lower()):
+        return f"{format_number((degree + 180) % 360)} degrees"
+    return orientation if orientation is not None else "0 degrees"
+
+def mirror_orientation(orientation, axis):
+    degree = parse_degree(orientation)
+    if degree is None:
+        return orientation
+    degree = -degree if axis == 'x' else 180 - degree if axis == 'y' else degree + 180
+    return f"{format_number(degree % 360)} degrees"
+
+# Expands one arrangement macro into explicit placements. placed maps the
+# names placed so far to their positions, which mirror copies from, and
+# listed holds the names of the list the macro is in. Raises ValueError with
+# a message for the model if the macro is incomplete.
+def expand_arrangement(macro, placed, listed):
+    name, kind = macro.get('name'), str(macro.get('arrangement')).lower()
+    if kind in ['row', 'grid']:
+        origin = arrangement_point(macro, 'origin')
+        heading = math.radians(arrangement_number(macro, 'heading', 0))
+        if kind == 'row':
+            offsets = [(i * arrangement_number(macro, 'spacing'), 0) for i in range(int(arrangement_number(macro, 'count')))]
         else:
-            coord = coord[0]
-            startpos, endpos = coord.find('['), coord.rfind(']')
-            coord = None if startpos == -1 or endpos == -1 or startpos >= endpos else coord[startpos:endpos + 1]
+            spacing = parse_position(macro.get('spacing'))
+            spacing = (spacing[0], spacing[1]) if spacing is not None else (arrangement_number(macro, 'spacing'),) * 2
+            offsets = [(c * spacing[0], r * spacing[1]) for r in range(int(arrangement_number(macro, 'rows'))) for c in range(int(arrangement_number(macro, 'columns')))]
+        points = [(origin[0] + u * math.cos(heading) - v * math.sin(heading), origin[1] + u * math.sin(heading) + v * math.cos(heading)) for u, v in offsets]
+        orientations = [arrangement_orientation(macro.get('orientation'), 0)] * len(points)
+    elif kind == 'circle':
+        center = arrangement_point(macro, 'center')
+        count, radius = int(arrangement_number(macro, 'count')), arrangement_number(macro, 'radius')
+        degrees = [arrangement_number(macro, 'heading', 0) + 360 * i / max(count, 1) for i in range(count)]
+        points = [(center[0] + radius * math.cos(math.radians(d)), center[1] + radius * math.sin(math.radians(d))) for d in degrees]
+        orientations = [arrangement_orientation(macro.get('orientation'), d) for d in degrees]
+    elif kind == 'mirror':
+        source, across, axis = macro.get('of'), macro.get('across'), str(macro.get('axis', 'point')).lower()
+        if across not in placed:
+            raise ValueError(f"{name} is mirrored across {across}, which has no coordinate.")
+        copies = [(n, p) for n, p in placed.items() if n == source or re.fullmatch(re.escape(str(source)) + r' \d+', n)]
+        if len(copies) == 0:
+            raise ValueError(f"{name} mirrors {source}, which has no coordinate.")
+        center = parse_position(placed[across]['position'])
+        points, orientations = [], []
+        for n, p in copies:
+            position = parse_position(p['position'])
+            x = 2 * center[0] - position[0] if axis != 'x' else position[0]
+            y = 2 * center[1] - position[1] if axis != 'y' else position[1]
+            points.append((x, y))
+            orientations.append(mirror_orientation(p.get('orientation'), axis))
+    else:
+        raise ValueError(f"The arrangement of {name} should be row, grid, circle or mirror, not {json.dumps(macro.get('arrangement'))}.")
+    if len(points) == 0:
+        raise ValueError(f"The {kind} arrangement of {name} has no objects.")
+    names = instance_names(name, len(points), listed)
+    return [{"name": n, "position": f"[{format_number(x)}, {format_number(y)}, 0]", "orientation": o} for n, (x, y), o in zip(names, points, orientations)]
+
+def expand_arrangements(placement, placed=None):
+    placed = dict(placed or {})
+    expanded = []
+    for p in placement:
+        for q in expand_arrangement(p, placed, [e['name'] for e in expanded]) if 'arrangement' in p else [p]:
+            placed[q['name']] = q
+            expanded.append(q)
+    return expanded
+
+def parse_coordinates(text, coordinates, verbose=True, use_macros=False):
+    steps = parse_steps(text)
+    coords = []
+    for step in [2, 3]:
+        coord = steps.get(step, 'Positions')
+        if coord is not None:
+            coord = parse_table(coord) if '{' not in coord and '|' in coord else parse_placement_list(coord)
         coords.append(coord)
     coord_1, coord_2 = coords[0], coords[1]
     if coord_1 is None or coord_2 is None:
         return None
     try:
-        coord_1, coord_2 = eval(coord_1.strip().replace('//', '#')), eval(coord_2.strip().replace('//', '#'))
-        assert isinstance(coord_1, List) and isinstance(coord_2, List)
         coords = {}
-        for cs in [json.loads(coordinates), coord_1, coord_2]:
-            for c in cs:
+        # the known coordinates can be parsed once by the caller
+        for cs in [json.loads(coordinates) if isinstance(coordinates, str) else coordinates, coord_1, coord_2]:
+            # arrangement entries are only expanded when the prompt offered them
+            for c in expand_arrangements(cs, coords) if use_macros else cs:
+                c = dict(c)
                 name = c.pop('name')
                 if object_permitted(name):
                     coords[ name ] = c
-        coords = [{"name": n, **p} for n, p in coords.items()]
-        return coords
+        return Scene.from_placement([{"name": n, **p} for n, p in coords.items()])
     except Exception as e:
-        print(traceback.format_exc())
+        if verbose:
+            print(traceback.format_exc())
         return None
 
 assign_coordinate_feedback_prompt = """Your position allocation contains the following error:
@@ -325,83 +458,318 @@ assign_coordinate_feedback_prompt = """Your position allocation contains the fol
 Please write the response again, fixing the errors.
 Only generate the response. Do not say anything else."""
 
-def assign_placement(prompt,
-                     objects,
-                     coordinates,
-                     relations,
-                     model_assign_placement,
-                     model_check_positional_error,
-                     model_fix_positional_error,
-                     ):
-    def parse_analysis(text):
-        analysis = []
-        re_steps = [
-            r'#Step 1:[\s\S]+?\nAnalysis:\s*([\s\S]*?)\s*\nNew Relative Positions:',
-            r'#Step 2:[\s\S]+?\nAnalysis:\s*([\s\S]*?)\s*\nPositions:',
-            r'#Step 3:[\s\S]+?\nAnalysis:\s*([\s\S]*?)\s*\nPositions:',
-        ]
-        step_names = ['Rewrite Relative Position', 'Calculate Coordinates', 'Assign Coordinates']
-        for re_step, step_name in zip(re_steps, step_names):
-            as1 = re_find(re_step, text)
-            if as1:
-                analysis.append((step_name, as1))
-        return analysis
-    
-    model_input_assign_placement = prompt_assign_placement.format(prompt=prompt, objects=objects, coordinates=coordinates, relations=relations)
-    messages = [{
+def parse_assign_placement_analysis(text):
+    step_names = ['Rewrite Relative Position', 'Calculate Coordinates', 'Assign Coordinates']
+    return parse_analysis(text, step_names)
+
+def assign_placement_until(coordinates, steps=None, use_macros=False):
+    steps = steps if steps is not None else StepParser()
+    return lambda text: text.rstrip().rstrip('`').rstrip().endswith(']') and 3 in steps.update(text).numbers() and parse_coordinates(steps, coordinates, verbose=False, use_macros=use_macros) is not None
+
+def assign_placement_abort():
+    return step_format_abort(3)
+
+# the same prompt asking for the positions as "name | x | y | orientation" rows
+prompt_assign_placement_table = prompt_assign_placement.replace(json_spec.replace('{', '{{').replace('}', '}}'), table_spec)
+
+def assign_placement_messages(prompt, objects, coordinates, relations, use_macros=False):
+    fmt = stage_formats['assign_placement']
+    template = prompt_assign_placement_table if fmt == 'table' else prompt_assign_placement
+    if use_macros and fmt != 'table':
+        template = template.replace("You must not skip any step.\n", "You must not skip any step.\n" + arrangement_guidance)
+    if fmt != 'json':
+        coordinates = format_placement(json.loads(coordinates), fmt)
+    model_input_assign_placement = template.format(prompt=prompt, objects=objects, coordinates=coordinates, relations=relations)
+    return [{
         "role": "user",
         "content": model_input_assign_placement
     }]
-    coords_final = None
+
+def assign_placement_feedback(messages, coords, filter_reason):
+    new_messages = [
+        {"role": "assistant", "content": Scene.from_placement(coords).format(stage_formats['assign_placement'])},
+        {"role": "user", "content": assign_coordinate_feedback_prompt.format(feedback=filter_reason)}
+    ]
+    messages = messages[:1]
+    messages.extend(new_messages)
+    return messages
+
+def placement_errors_calls(prompt, objects, coords, coordinates, relations, model_check_positional_error, budget):
+    # geometric rules are checked locally; the model judges the rest of the description
+    errors = check_placement(coords, coordinates, relations, objects)
+    if len(errors) > 0:
+        return True, '\n'.join(errors)
+    if covers_description(coords, coordinates, relations):
+        return False, "Every object is placed at the coordinate given in the description."
+    return (yield from contain_positional_error_calls(prompt, coords, model_check_positional_error, budget))
+
+def assign_placement_calls(prompt,
+                           objects,
+                           coordinates,
+                           relations,
+                           model_assign_placement,
+                           model_check_positional_error,
+                           model_fix_positional_error,
+                           budget=None,
+                           num_candidates=1,
+                           use_macros=False,
+                           ):
+    budget = budget if budget is not None else Budget()
+    messages = assign_placement_messages(prompt, objects, coordinates, relations, use_macros)
+    schema = assign_placement_format(stage_formats['assign_placement'], use_macros)
+    known = json.loads(coordinates)
+    coords, coords_final = None, None
     failed_rounds = 0
+    if num_candidates > 1:
+        # sample the first round in parallel and repair only if every candidate fails
+        def request():
+            return call(model_assign_placement, 'invoke', list(messages), until=assign_placement_until(known, use_macros=use_macros), abort=budget.guard(assign_placement_abort()), schema=schema, **budget.request_kwargs())
+
+        def validate(output):
+            coords = parse_coordinates(output, known, verbose=False, use_macros=use_macros)
+            if coords is None:
+                budget.parse_failure('assign_placement')
+                return False, None
+            should_filter, filter_reason = yield from placement_errors_calls(prompt, objects, coords, coordinates, relations, model_check_positional_error, budget)
+            return not should_filter, (output, coords, filter_reason)
+
+        try:
+            accepted, rejected = yield call(sampling, 'sample_candidates', num_candidates, request, validate, 'assign_placement', budget, messages)
+        except BudgetExceeded as e:
+            e.partial = {"placement": None, "failed_rounds": failed_rounds}
+            raise
+        if accepted is not None:
+            model_output_assign_placement, coords_final, filter_reason = accepted
+            print("Coordinates:", model_output_assign_placement)
+            print("Not filter reason:", filter_reason)
+            return coords_final, model_output_assign_placement, parse_assign_placement_analysis(model_output_assign_placement), failed_rounds
+        rejected = [r for r in rejected if r is not None]
+        if len(rejected) > 0:
+            model_output_assign_placement, coords, filter_reason = rejected[0]
+            failed_rounds += 1
+            print("Filter reason:", filter_reason)
+            print()
+            messages = assign_placement_feedback(messages, coords, filter_reason)
     while True:
         try:
             # generate until valid coordinates appear
             while True:
                 model_to_use = model_assign_placement if failed_rounds == 0 else model_fix_positional_error
-                model_output_assign_placement = model_to_use.invoke(messages)
-                coords = parse_coordinates(model_output_assign_placement, coordinates)
+                budget.attempt('assign_placement', messages)
+                steps = StepParser()
+                model_output_assign_placement = yield call(model_to_use, 'invoke', messages, until=assign_placement_until(known, steps, use_macros), abort=budget.guard(assign_placement_abort()), schema=schema, **budget.request_kwargs())
+                steps = steps.update(model_output_assign_placement)
+                coords = parse_coordinates(steps, known, use_macros=use_macros)
                 if coords is not None:
                     print("Coordinates:", model_output_assign_placement)
-                    analysis = parse_analysis(model_output_assign_placement)
+                    analysis = parse_assign_placement_analysis(steps)
                     break
-            should_filter, filter_reason = contain_positional_error(prompt, coords, model_check_positional_error)
+                budget.parse_failure('assign_placement')
+            should_filter, filter_reason = yield from placement_errors_calls(prompt, objects, coords, coordinates, relations, model_check_positional_error, budget)
             if should_filter:
                 failed_rounds += 1
                 print("Filter reason:", filter_reason)
                 print()
-                new_messages = [
-                    {"role": "assistant", "content": json.dumps(coords, indent=2)},
-                    {"role": "user", "content": assign_coordinate_feedback_prompt.format(feedback=filter_reason)}
-                ]
-                messages = messages[:1]
-                messages.extend(new_messages)
+                messages = assign_placement_feedback(messages, coords, filter_reason)
                 continue
             print("Not filter reason:", filter_reason)
             coords_final = coords
             break
+        except BudgetExceeded as e:
+            # the last parsed placement has not passed the checker
+            e.partial = {"placement": coords.to_placement() if coords is not None else None, "failed_rounds": failed_rounds}
+            raise
         except Exception as e:
             print(traceback.format_exc())
+            budget.error('assign_placement')
     return coords_final, model_output_assign_placement, analysis, failed_rounds
 
-def retrieve_objects(prompt, model_retrieve_objects):
-    objects, rewritten_prompt, analysis_list_objects = list_objects(prompt, model_retrieve_objects)
+def assign_placement(prompt,
+                     objects,
+                     coordinates,
+                     relations,
+                     model_assign_placement,
+                     model_check_positional_error,
+                     model_fix_positional_error,
+                     budget=None,
+                     num_candidates=1,
+                     use_macros=False,
+                     ):
+    return run_calls(assign_placement_calls(prompt, objects, coordinates, relations, model_assign_placement, model_check_positional_error, model_fix_positional_error, budget, num_candidates, use_macros))
+
+async def assign_placement_async(prompt,
+                                 objects,
+                                 coordinates,
+                                 relations,
+                                 model_assign_placement,
+                                 model_check_positional_error,
+                                 model_fix_positional_error,
+                                 budget=None,
+                                 num_candidates=1,
+                                 use_macros=False,
+                                 ):
+    return await run_calls_async(assign_placement_calls(prompt, objects, coordinates, relations, model_assign_placement, model_check_positional_error, model_fix_positional_error, budget, num_candidates, use_macros))
+
+def solve_coordinates(objects, coordinates, relations):
+    coords = solve_placement(objects, coordinates, relations)
+    if coords is None:
+        return None
+    coords = Scene.from_placement([c for c in coords if object_permitted(c['name'])])
+    errors = check_placement(coords, coordinates, relations, objects)
+    if len(errors) > 0:
+        print("Solved coordinates rejected:", '\n'.join(errors))
+        return None
+    print("Solved coordinates:", coords.dumps())
+    return coords
+
+### explicit layouts
+# general names that only have one object in the permission list
+specific_names = {p: p for p in permission_list}
+specific_names.update({"ABB Robot": "ABB Robot IRB6600", "YASKAWA Robot": "YASKAWA Robot ma01800"})
+re_item = r'\b(' + '|'.join(re.escape(i) for i in sorted(set(item_list), key=len, reverse=True)) + r')\b'
+re_explicit_coord = r'\[(-?\d+(?:\.\d+)?), (-?\d+(?:\.\d+)?), 0\]'
+# what may stand between an object and its coordinate, e.g. "is located at coordinates"
+re_explicit_link = r'(?:s)?\s*(?:[\(\[]\s*)?(?:(?:is|are|should be|will be|to be)\s+)?(?:(?:located|positioned|placed|situated|set|put|installed|standing)\s+)?(?:(?:at|in|on)\s+)?(?:(?:the\s+)?(?:coordinates?|position|location|point)\s+)?[:=]?\s*'
+# words the model would turn into objects, orientations or relations
+re_explicit_ban = r'\bfenc|\bbelts?\b|\barms?\b|\bmanipulators?\b|\bmachines?\b|\bpositioners?\b|\bworkbench|\bdegree|\brotat|\borient|\bfacing\b|\bface\b|\bfaces\b|\btowards?\b|\bsurround|\baround\b|\bbetween\b|\bnext to\b|\bbeside\b|\bnear\b|\bfront\b|\bbehind\b|\bleft\b|\bright\b|\bmeters?\b|\bmillimet|\bcentimet|\d+(?:\.\d+)?\s*(?:m|mm|cm)\b|\bfrom\b|\baway\b|\bapart\b|\binterval|\bdistance\b|\badd\b|\bmore\b|\bother\b|\banother\b|\bsome\b|\bseveral\b|\bmultiple\b|\beach\b|\brandom'
+
+# Builds the objects and placement directly when the description gives every
+# object a coordinate, e.g. "A Cabinet is at [0, 0, 0]. A Conveyor is at
+# [2000, 0, 0].", so that the layout stages can be skipped. Returns None as soon
+# as anything is left for the model to decide: general object names, plurals,
+# objects without a coordinate, coordinates without an object, or relations
+# and orientations.
+def parse_explicit_layout(prompt):
+    text = clean_prompt(prompt)
+    if not text or not contain_coords(text) or re.search(re_explicit_ban, text, flags=re.IGNORECASE):
+        return None
+    mentions = list(re.finditer(re_item, text))
+    if len(mentions) == 0 or len(mentions) != len(re.findall(re_explicit_coord, text)):
+        return None
+    names, positions = [], []
+    for mention in mentions:
+        name = specific_names.get(mention.group(1))
+        link = re.match(re_explicit_link + re_explicit_coord, text[mention.end():])
+        if name is None or link is None or link.group(0).startswith('s'):
+            return None
+        names.append(name)
+        positions.append(f"[{link.group(1)}, {link.group(2)}, 0]")
+    counts = {n: names.count(n) for n in names}
+    numbered, placement = {}, []
+    for name, position in zip(names, positions):
+        if counts[name] > 1:
+            numbered[name] = numbered.get(name, 0) + 1
+            name = f"{name} {numbered[name]}"
+        placement.append({"name": name, "position": position, "orientation": "0 degrees"})
+    placement = Scene.from_placement(placement)
+    if len(check_placement(placement, placement.to_placement())) > 0:
+        return None
+    # the rewritten description only differs in the object names
+    for mention in reversed(mentions):
+        text = text[:mention.start()] + specific_names[mention.group(1)] + text[mention.end():]
+    return json.dumps(names), placement, text
+
+def retrieve_objects_calls(prompt, model_retrieve_objects, budget=None):
+    key, memo = memo_get('retrieve_objects', model_retrieve_objects.model, normalize_text(clean_prompt(prompt)))
+    if memo is not None:
+        return tuple(memo)
+    objects, rewritten_prompt, analysis_list_objects = yield from list_objects_calls(prompt, model_retrieve_objects, budget)
     rewritten_prompt_cleaned = clean_prompt(rewritten_prompt)
+    memo_put('retrieve_objects', key, [objects, rewritten_prompt_cleaned, analysis_list_objects])
     return objects, rewritten_prompt_cleaned, analysis_list_objects
 
+def retrieve_objects(prompt, model_retrieve_objects, budget=None):
+    return run_calls(retrieve_objects_calls(prompt, model_retrieve_objects, budget))
+
+async def retrieve_objects_async(prompt, model_retrieve_objects, budget=None):
+    return await run_calls_async(retrieve_objects_calls(prompt, model_retrieve_objects, budget))
+
+def get_placement_calls(prompt,
+                        objects,
+                        model_extract_layout,
+                        model_assign_placement,
+                        model_check_positional_error,
+                        model_fix_positional_error,
+                        budget=None,
+                        use_solver=False,
+                        num_candidates=1,
+                        use_macros=False,
+                        ):
+    analysis = []
+    model_output_extract_layout, objects, coordinates, relations, analysis_extract_layout = yield from extract_layout_calls(prompt, objects, model_extract_layout, budget)
+    analysis.extend(analysis_extract_layout)
+    # relations that reduce to distances and directions are solved locally
+    coords = solve_coordinates(objects, coordinates, relations) if use_solver else None
+    if coords is not None:
+        analysis.append(('Solve coordinates', coords.dumps()))
+        return objects, coords, analysis, 0
+    key, memo = memo_get('assign_placement', [model_assign_placement.model, model_check_positional_error.model, model_fix_positional_error.model], normalize_text(prompt), objects, coordinates, relations, [stage_formats['assign_placement'], stage_formats['check_positional_error']], use_macros)
+    if memo is not None:
+        coords, analysis_coordinates, failed_rounds = Scene.from_placement(memo[0]), memo[1], memo[2]
+    else:
+        coords, model_output_assign_placement, analysis_coordinates, failed_rounds = yield from assign_placement_calls(prompt, objects, coordinates, relations, model_assign_placement, model_check_positional_error, model_fix_positional_error, budget, num_candidates, use_macros)
+        if coords is not None:
+            memo_put('assign_placement', key, [coords.to_placement(), analysis_coordinates, failed_rounds])
+    analysis.extend(analysis_coordinates)
+    return objects, coords, analysis, failed_rounds
+
 def get_placement(prompt,
                   objects,
                   model_extract_layout,
                   model_assign_placement,
                   model_check_positional_error,
                   model_fix_positional_error,
+                  budget=None,
+                  use_solver=False,
+                  num_candidates=1,
+                  use_macros=False,
                   ):
-    analysis = []
-    model_output_extract_layout, objects, coordinates, relations, analysis_extract_layout = extract_layout(prompt, objects, model_extract_layout)
-    analysis.extend(analysis_extract_layout)
-    coords, model_output_assign_placement, analysis_coordinates, failed_rounds = assign_placement(prompt, objects, coordinates, relations, model_assign_placement, model_check_positional_error, model_fix_positional_error)
-    analysis.extend(analysis_coordinates)
-    return objects, coords, analysis, failed_rounds
+    return run_calls(get_placement_calls(prompt, objects, model_extract_layout, model_assign_placement, model_check_positional_error, model_fix_positional_error, budget, use_solver, num_candidates, use_macros))
+
+async def get_placement_async(prompt,
+                              objects,
+                              model_extract_layout,
+                              model_assign_placement,
+                              model_check_positional_error,
+                              model_fix_positional_error,
+                              budget=None,
+                              use_solver=False,
+                              num_candidates=1,
+                              use_macros=False,
+                              ):
+    return await run_calls_async(get_placement_calls(prompt, objects, model_extract_layout, model_assign_placement, model_check_positional_error, model_fix_positional_error, budget, use_solver, num_candidates, use_macros))
+
+def process_prompt_calls(prompt,
+                         model_retrieve_objects,
+                         model_extract_layout,
+                         model_assign_placement,
+                         model_check_positional_error,
+                         model_fix_positional_error,
+                         budget=None,
+                         use_solver=False,
+                         num_candidates=1,
+                         use_explicit_layout=False,
+                         use_macros=False,
+    ):
+    # with a budget, stages give up instead of retrying forever; the outputs
+    # of the stages that did finish are returned and budget.failure is set
+    budget = budget if budget is not None else Budget()
+    objects, placement, rewritten_prompt, analysis, failed_rounds = None, None, prompt, [], 0
+    # descriptions that give every object a coordinate go straight to code generation
+    explicit_layout = parse_explicit_layout(prompt) if use_explicit_layout else None
+    if explicit_layout is not None:
+        objects, placement, rewritten_prompt = explicit_layout
+        print("Explicit layout:", placement.dumps())
+        return objects, placement.to_placement(), rewritten_prompt, [('Explicit layout', placement.dumps())], failed_rounds
+    try:
+        objects, rewritten_prompt, analysis = yield from retrieve_objects_calls(prompt, model_retrieve_objects, budget)
+        objects, placement, analysis_get_placement, failed_rounds = yield from get_placement_calls(rewritten_prompt, objects, model_extract_layout, model_assign_placement, model_check_positional_error, model_fix_positional_error, budget, use_solver, num_candidates, use_macros)
+        analysis = analysis + analysis_get_placement
+    except BudgetExceeded as e:
+        budget.fail(e, partial=e.partial)
+    # the placement leaves the pipeline as plain dicts that can be dumped as JSON
+    placement = placement.to_placement() if placement is not None else None
+    return objects, placement, rewritten_prompt, analysis, failed_rounds
 
 def process_prompt(prompt,
                    model_retrieve_objects,
@@ -409,8 +777,24 @@ def process_prompt(prompt,
                    model_assign_placement,
                    model_check_positional_error,
                    model_fix_positional_error,
+                   budget=None,
+                   use_solver=False,
+                   num_candidates=1,
+                   use_explicit_layout=False,
+                   use_macros=False,
     ):
-    objects, rewritten_prompt, analysis_list_objects = retrieve_objects(prompt, model_retrieve_objects)
-    objects, placement, analysis_get_placement, failed_rounds = get_placement(rewritten_prompt, objects, model_extract_layout, model_assign_placement, model_check_positional_error, model_fix_positional_error)
-    analysis = analysis_list_objects + analysis_get_placement
-    return objects, placement, rewritten_prompt, analysis, failed_rounds
+    return run_calls(process_prompt_calls(prompt, model_retrieve_objects, model_extract_layout, model_assign_placement, model_check_positional_error, model_fix_positional_error, budget, use_solver, num_candidates, use_explicit_layout, use_macros))
+
+async def process_prompt_async(prompt,
+                               model_retrieve_objects,
+                               model_extract_layout,
+                               model_assign_placement,
+                               model_check_positional_error,
+                               model_fix_positional_error,
+                               budget=None,
+                               use_solver=False,
+                               num_candidates=1,
+                               use_explicit_layout=False,
+                               use_macros=False,
+    ):
+    return await run_calls_async(process_prompt_calls(prompt, model_retrieve_objects, model_extract_layout, model_assign_placement, model_check_positional_error, model_fix_positional_error, budget, use_solver, num_candidates, use_explicit_layout, use_macros))
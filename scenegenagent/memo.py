@@ -0,0 +1,118 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+# Results of the stages that only depend on their inputs once those are
+# normalized: the cleaned description with its whitespace collapsed, the
+# sorted object list, the placement and the settings that change the prompt.
+# A repeated description is answered from here instead of sampling the stages
+# again. Results are kept as JSON in a least recently used map of at most
+# max_entries, and with a path also in an SQLite file that outlives the
+# process and is shared by the eval workers. Hits and misses are counted per
+# stage.
+class StageMemo:
+    def __init__(self, max_entries=1024, path=None):
+        self.max_entries = max_entries
+        self.path = path
+        self.entries = OrderedDict()
+        self.hits = {}
+        self.misses = {}
+        self.lock = threading.Lock()
+        self._conn = None
+        self._conn_pid = None
+        if path is not None and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        # sqlite connections must not cross a fork
+        if self._conn is None or self._conn_pid != os.getpid():
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=60)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""CREATE TABLE IF NOT EXISTS stages (
+                key TEXT PRIMARY KEY,
+                stage TEXT NOT NULL,
+                value TEXT NOT NULL,
+                created REAL NOT NULL
+            )""")
+            conn.commit()
+            self._conn = conn
+            self._conn_pid = os.getpid()
+        return self._conn
+
+    @staticmethod
+    def stage_key(stage, inputs):
+        return hashlib.sha256(json.dumps([stage, inputs], sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+    def remember(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def get(self, stage, inputs):
+        # (key, value), with None as the value on a miss
+        key = self.stage_key(stage, inputs)
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+            elif self.path is not None:
+                row = self.conn.execute("SELECT value FROM stages WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    value = row[0]
+                    self.remember(key, value)
+            counts = self.hits if value is not None else self.misses
+            counts[stage] = counts.get(stage, 0) + 1
+        return key, json.loads(value) if value is not None else None
+
+    def put(self, stage, key, value):
+        value = json.dumps(value, ensure_ascii=False)
+        with self.lock:
+            self.remember(key, value)
+            if self.path is not None:
+                self.conn.execute("INSERT OR REPLACE INTO stages VALUES (?, ?, ?, ?)", (key, stage, value, time.time()))
+                self.conn.commit()
+
+    def stats(self):
+        with self.lock:
+            stats = {}
+            for stage in sorted(set(self.hits) | set(self.misses)):
+                hits, misses = self.hits.get(stage, 0), self.misses.get(stage, 0)
+                stats[stage] = {"hits": hits, "misses": misses, "hit_rate": hits / (hits + misses)}
+            stats["entries"] = len(self.entries)
+        return stats
+
+stage_memo = None
+
+def set_stage_memo(memo=None):
+    # a StageMemo shared by the stages, or None to always run them
+    global stage_memo
+    stage_memo = memo
+
+def normalize_text(text):
+    return ' '.join(text.split()) if text else text
+
+def normalize_objects(objects):
+    # the object list as written by retrieve_objects, in any order
+    try:
+        return sorted(json.loads(objects))
+    except (TypeError, ValueError):
+        return objects
+
+def memo_get(stage, *inputs):
+    # (key, value) of the stage for the inputs; the key is None when memoization is off
+    if stage_memo is None:
+        return None, None
+    return stage_memo.get(stage, inputs)
+
+def memo_put(stage, key, value):
+    if stage_memo is not None and key is not None:
+        stage_memo.put(stage, key, value)
+
+def memo_stats():
+    return stage_memo.stats() if stage_memo is not None else None
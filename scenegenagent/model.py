@@ -1,17 +1,176 @@
 import io
+import os
+import time
 import base64
+import traceback
+import json
+import asyncio
+import hashlib
+import weakref
+import threading
+import contextvars
+from collections import OrderedDict
+from contextlib import contextmanager
 from typing import (
     Any,
+    Callable,
     Dict,
+    List,
+    Union,
 )
+import httpx
 from PIL import Image
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI, DefaultHttpxClient, DefaultAsyncHttpxClient, APIConnectionError
+from openai.types.chat import ChatCompletion
+from cache import ResponseCache
+from schemas import StepFormat, constrain_request, render_answer
 
 def image_to_base64(image: Image):
     buffered = io.BytesIO()
     image.save(buffered, format="JPEG")
     return base64.b64encode(buffered.getvalue()).decode("utf-8")
 
+# Clients are shared by every Model pointing at the same endpoint, so that
+# connections are pooled and kept alive across Model instances.
+pool_limits = {
+    "max_connections": 256,
+    "max_keepalive_connections": 64,
+    "keepalive_expiry": 60.0,
+}
+_clients = {}
+_async_clients = weakref.WeakKeyDictionary()
+_clients_lock = threading.Lock()
+
+def set_pool_limits(**kwargs):
+    with _clients_lock:
+        pool_limits.update(kwargs)
+
+def get_client(base_url, api_key):
+    key = (base_url, api_key)
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = OpenAI(
+                api_key=api_key,
+                base_url=base_url,
+                http_client=DefaultHttpxClient(limits=httpx.Limits(**pool_limits)),
+            )
+        return _clients[key]
+
+def get_async_client(base_url, api_key):
+    # async connections belong to the event loop that opened them
+    key = (base_url, api_key)
+    loop = asyncio.get_running_loop()
+    with _clients_lock:
+        clients = _async_clients.setdefault(loop, {})
+        if key not in clients:
+            clients[key] = AsyncOpenAI(
+                api_key=api_key,
+                base_url=base_url,
+                http_client=DefaultAsyncHttpxClient(limits=httpx.Limits(**pool_limits)),
+            )
+        return clients[key]
+
+class Replica:
+    def __init__(self, base_url):
+        self.base_url: str = base_url
+        self.outstanding: int = 0
+        self.served: int = 0
+        self.failures: int = 0
+        self.healthy: bool = True
+
+# the index of the candidate a request samples, set by sampling.py
+candidate_index = contextvars.ContextVar('candidate_index', default=None)
+
+# Requests go to the healthy replica with the fewest outstanding requests.
+# Requests that share their first message (e.g. the rounds of one
+# assign_placement feedback loop) stick to one replica to reuse its prefix
+# cache. Parallel candidates also share their first message, so they are
+# keyed by their candidate index as well and spread over the replicas. Replicas failing max_failures requests in a row are ejected until a
+# health probe of their /models endpoint succeeds again.
+class ReplicaPool:
+    def __init__(self, base_urls, api_key, probe_interval=10.0, max_failures=3, max_sessions=4096):
+        self.replicas = [Replica(base_url) for base_url in base_urls]
+        self.api_key = api_key
+        self.probe_interval = probe_interval
+        self.max_failures = max_failures
+        self.max_sessions = max_sessions
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+        self.prober = None
+
+    @staticmethod
+    def session_key(request):
+        first_message = request["messages"][0]["content"]
+        return hashlib.sha1(json.dumps([first_message, candidate_index.get()], ensure_ascii=False).encode('utf-8')).hexdigest()
+
+    def acquire(self, request) -> Replica:
+        if self.prober is None:
+            self.prober = threading.Thread(target=self.probe_forever, daemon=True)
+            self.prober.start()
+        session = self.session_key(request)
+        with self.lock:
+            candidates = [r for r in self.replicas if r.healthy] or self.replicas
+            replica = self.sessions.get(session)
+            if replica is None or replica not in candidates:
+                replica = min(candidates, key=lambda r: (r.outstanding, r.served))
+            self.sessions[session] = replica
+            self.sessions.move_to_end(session)
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+            replica.outstanding += 1
+            replica.served += 1
+        return replica
+
+    def release(self, replica, ok):
+        with self.lock:
+            replica.outstanding -= 1
+            if ok:
+                replica.failures = 0
+            else:
+                replica.failures += 1
+                if replica.failures >= self.max_failures and replica.healthy:
+                    print(f"Ejecting replica {replica.base_url}")
+                    replica.healthy = False
+
+    def probe(self, replica):
+        try:
+            get_client(replica.base_url, self.api_key).with_options(timeout=5.0, max_retries=0).models.list()
+            return True
+        except Exception:
+            return False
+
+    def probe_forever(self):
+        while True:
+            time.sleep(self.probe_interval)
+            for replica in self.replicas:
+                healthy = self.probe(replica)
+                with self.lock:
+                    if healthy and not replica.healthy:
+                        print(f"Restoring replica {replica.base_url}")
+                        replica.failures = 0
+                    elif not healthy and replica.healthy:
+                        print(f"Ejecting replica {replica.base_url}")
+                    replica.healthy = healthy
+
+_pools = {}
+
+def get_replica_pool(base_urls, api_key):
+    key = (tuple(base_urls), api_key)
+    with _clients_lock:
+        if key not in _pools:
+            _pools[key] = ReplicaPool(base_urls, api_key)
+        return _pools[key]
+
+def _reset_clients():
+    global _clients_lock
+    _clients_lock = threading.Lock()
+    _clients.clear()
+    _async_clients.clear()
+    _pools.clear()
+
+# connections must not be shared with forked worker processes
+os.register_at_fork(after_in_child=_reset_clients)
+
 class Model:
     @property
     def _default_params(self) -> Dict[str, Any]:
@@ -24,49 +183,229 @@ class Model:
             params["temperature"] = self.temperature
         return params
 
-    def __init__(self, model_name, base_url, api_key):
+    def __init__(self, model_name, base_url: Union[str, List[str]], api_key, cache: ResponseCache = None, stream: bool = False):
         self.model: str = model_name
         self.max_tokens: int = 4096
-        self.client = OpenAI(
-            api_key=api_key,
-            base_url=base_url,
-        )
+        # a list of base URLs serves the model from several replicas
+        self.base_url: Union[str, List[str]] = base_url
+        self.api_key: str = api_key
+        self.cache = cache
+        # stream responses and stop as soon as the stage has what it needs
+        self.stream: bool = stream
+        # one of guided_decoding_modes to constrain stages with a StepFormat to it
+        self.guided_decoding: str = None
+
+    @property
+    def client(self) -> OpenAI:
+        return get_client(self.base_urls[0], self.api_key)
+
+    @property
+    def async_client(self) -> AsyncOpenAI:
+        return get_async_client(self.base_urls[0], self.api_key)
+
+    @property
+    def base_urls(self) -> List[str]:
+        return [self.base_url] if isinstance(self.base_url, str) else list(self.base_url)
+
+    @contextmanager
+    def connect(self, request: Any, use_async: bool = False):
+        pool = get_replica_pool(self.base_urls, self.api_key) if len(self.base_urls) > 1 else None
+        replica = pool.acquire(request) if pool is not None else None
+        base_url = replica.base_url if replica is not None else self.base_urls[0]
+        ok = False
+        try:
+            yield get_async_client(base_url, self.api_key) if use_async else get_client(base_url, self.api_key)
+            ok = True
+        except APIConnectionError:
+            raise
+        except Exception:
+            # only connection errors count against the replica
+            ok = True
+            raise
+        finally:
+            if pool is not None:
+                pool.release(replica, ok)
+
+    def check_response(self, response: Any) -> bool:
+        try:
+            choice = response.choices[0]
+        except (AttributeError, IndexError, TypeError):
+            print(f"Response content: {response}")
+            return False
+        if choice.finish_reason != 'stop':
+            print(f"Finish reason: {choice.finish_reason}")
+            print(f"Response content: {response}")
+            return False
+        return True
 
     def post(self, request: Any) -> Any:
+        if self.cache is not None:
+            cache_key, response = self.cache.get(request, candidate_index.get())
+            if response is not None:
+                return response
         retries = 5
-        for _ in range(retries):
-            response = self.client.chat.completions.create(**request)
+        for retry in range(retries):
             try:
-                choice = response.choices[0]
-                if choice.finish_reason != 'stop':
-                    print(f"Finish reason: {choice.finish_reason}")
-                    raise NotImplementedError
+                with self.connect(request) as client:
+                    response = client.chat.completions.create(**request)
+            except APIConnectionError:
+                if len(self.base_urls) == 1 or retry == retries - 1:
+                    raise
+                print(traceback.format_exc())
+                continue
+            if self.check_response(response):
+                if self.cache is not None:
+                    self.cache.put(cache_key, response)
                 return response
-            except:
-                print(f"Response content: {response}")
         raise NotImplementedError
-    
-    def generate(self, prompt: str, model: str=None):
-        request = {
-            "messages": [
-                {
-                    "role": "user",
-                    "content": prompt,
-                }
-            ]
-        }
+
+    async def post_async(self, request: Any) -> Any:
+        if self.cache is not None:
+            cache_key, response = self.cache.get(request, candidate_index.get())
+            if response is not None:
+                return response
+        retries = 5
+        for retry in range(retries):
+            try:
+                with self.connect(request, use_async=True) as client:
+                    response = await client.chat.completions.create(**request)
+            except APIConnectionError:
+                if len(self.base_urls) == 1 or retry == retries - 1:
+                    raise
+                print(traceback.format_exc())
+                continue
+            if self.check_response(response):
+                if self.cache is not None:
+                    self.cache.put(cache_key, response)
+                return response
+        raise NotImplementedError
+
+    def completion_from_text(self, request: Any, text: str) -> ChatCompletion:
+        return ChatCompletion.model_validate({
+            "id": "stream",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request["model"],
+            "choices": [{
+                "index": 0,
+                "finish_reason": "stop",
+                "message": {"role": "assistant", "content": text},
+            }],
+        })
+
+    # `until` and `abort` are called with the text received so far. The stream
+    # is closed once `until` holds (the stage can already parse its answer) or
+    # `abort` holds (the output left the expected format), and the partial text
+    # is returned.
+    def post_stream(self, request: Any, until: Callable[[str], bool] = None, abort: Callable[[str], bool] = None) -> str:
+        if self.cache is not None:
+            cache_key, response = self.cache.get(request, candidate_index.get())
+            if response is not None:
+                return response.choices[0].message.content
+        request = dict(request, stream=True)
+        retries = 5
+        for retry in range(retries):
+            text, finish_reason = "", None
+            try:
+                with self.connect(request) as client:
+                    stream = client.chat.completions.create(**request)
+                    try:
+                        for chunk in stream:
+                            if len(chunk.choices) == 0:
+                                continue
+                            text += chunk.choices[0].delta.content or ""
+                            finish_reason = chunk.choices[0].finish_reason or finish_reason
+                            if until is not None and until(text):
+                                return text
+                            if abort is not None and abort(text):
+                                print(f"Stream aborted: {text}")
+                                return text
+                    finally:
+                        stream.close()
+            except APIConnectionError:
+                if len(self.base_urls) == 1 or retry == retries - 1:
+                    raise
+                print(traceback.format_exc())
+                continue
+            if finish_reason == 'stop':
+                if self.cache is not None:
+                    self.cache.put(cache_key, self.completion_from_text(request, text))
+                return text
+            print(f"Finish reason: {finish_reason}")
+        raise NotImplementedError
+
+    async def post_stream_async(self, request: Any, until: Callable[[str], bool] = None, abort: Callable[[str], bool] = None) -> str:
+        if self.cache is not None:
+            cache_key, response = self.cache.get(request, candidate_index.get())
+            if response is not None:
+                return response.choices[0].message.content
+        request = dict(request, stream=True)
+        retries = 5
+        for retry in range(retries):
+            text, finish_reason = "", None
+            try:
+                with self.connect(request, use_async=True) as client:
+                    stream = await client.chat.completions.create(**request)
+                    try:
+                        async for chunk in stream:
+                            if len(chunk.choices) == 0:
+                                continue
+                            text += chunk.choices[0].delta.content or ""
+                            finish_reason = chunk.choices[0].finish_reason or finish_reason
+                            if until is not None and until(text):
+                                return text
+                            if abort is not None and abort(text):
+                                print(f"Stream aborted: {text}")
+                                return text
+                    finally:
+                        await stream.close()
+            except APIConnectionError:
+                if len(self.base_urls) == 1 or retry == retries - 1:
+                    raise
+                print(traceback.format_exc())
+                continue
+            if finish_reason == 'stop':
+                if self.cache is not None:
+                    self.cache.put(cache_key, self.completion_from_text(request, text))
+                return text
+            print(f"Finish reason: {finish_reason}")
+        raise NotImplementedError
+
+    def complete(self, request: Any, until: Callable[[str], bool] = None, abort: Callable[[str], bool] = None, schema: StepFormat = None) -> str:
+        request, render_format = constrain_request(request, schema, self.guided_decoding)
+        if render_format is not None:
+            # a JSON answer is only rendered into the step format once it is complete
+            response = self.post(request)
+            return render_answer(response.choices[0].message.content, render_format).rstrip()
+        if self.stream and (until is not None or abort is not None):
+            return self.post_stream(request, until, abort).rstrip()
+        response = self.post(request)
+        return response.choices[0].message.content.rstrip()
+
+    async def complete_async(self, request: Any, until: Callable[[str], bool] = None, abort: Callable[[str], bool] = None, schema: StepFormat = None) -> str:
+        request, render_format = constrain_request(request, schema, self.guided_decoding)
+        if render_format is not None:
+            response = await self.post_async(request)
+            return render_answer(response.choices[0].message.content, render_format).rstrip()
+        if self.stream and (until is not None or abort is not None):
+            return (await self.post_stream_async(request, until, abort)).rstrip()
+        response = await self.post_async(request)
+        return response.choices[0].message.content.rstrip()
+
+    def generate_request(self, prompt: str, model: str=None, **kwargs: Any):
+        request = kwargs
+        request["messages"] = [
+            {
+                "role": "user",
+                "content": prompt,
+            }
+        ]
         request.update(self._default_params)
         if model:
             request['model'] = model
-        response = self.post(request)
-        return response.choices[0].message.content.rstrip()
+        return request
 
-    def invoke(
-        self,
-        messages,
-        model=None,
-        **kwargs: Any,
-    ) -> str:
+    def invoke_request(self, messages, model=None, **kwargs: Any):
         request = kwargs
         for i in range(len(messages)):
             messages[i] = {key: messages[i][key] for key in ['role', 'content']}
@@ -74,19 +413,46 @@ class Model:
         request.update(self._default_params)
         if model:
             request['model'] = model
-        response = self.post(request)
-        return response.choices[0].message.content.rstrip()
+        return request
+
+    def generate(self, prompt: str, model: str=None, until=None, abort=None, schema=None, **kwargs: Any):
+        return self.complete(self.generate_request(prompt, model, **kwargs), until, abort, schema)
+
+    async def generate_async(self, prompt: str, model: str=None, until=None, abort=None, schema=None, **kwargs: Any):
+        return await self.complete_async(self.generate_request(prompt, model, **kwargs), until, abort, schema)
+
+    def invoke(
+        self,
+        messages,
+        model=None,
+        until=None,
+        abort=None,
+        schema=None,
+        **kwargs: Any,
+    ) -> str:
+        return self.complete(self.invoke_request(messages, model, **kwargs), until, abort, schema)
+
+    async def invoke_async(
+        self,
+        messages,
+        model=None,
+        until=None,
+        abort=None,
+        schema=None,
+        **kwargs: Any,
+    ) -> str:
+        return await self.complete_async(self.invoke_request(messages, model, **kwargs), until, abort, schema)
 
 class LocalModel(Model):
-    def __init__(self, model_name, base_url="http://localhost:8000/v1"):
-        super().__init__(model_name, base_url, api_key='EMPTY')
+    def __init__(self, model_name, base_url: Union[str, List[str]] = "http://localhost:8000/v1", cache: ResponseCache = None, stream: bool = False):
+        super().__init__(model_name, base_url, api_key='EMPTY', cache=cache, stream=stream)
 
 class GPT4O(Model):
-    def __init__(self, model_name="gpt-4o-2024-05-13", base_url="https://api.openai.com/v1"):
+    def __init__(self, model_name="gpt-4o-2024-05-13", base_url="https://api.openai.com/v1", cache: ResponseCache = None, stream: bool = False):
         api_key=open('openai_key').read()
-        super().__init__(model_name, base_url, api_key=api_key)
+        super().__init__(model_name, base_url, api_key=api_key, cache=cache, stream=stream)
 
-    def generate(self, prompt: str, model: str=None, base64_image: str = None):
+    def generate_request(self, prompt: str, model: str=None, base64_image: str = None, **kwargs: Any):
         messages = [{"role": "user"}]
         if base64_image:
             messages[0]['content'] = [
@@ -103,11 +469,15 @@ class GPT4O(Model):
             ]
         else:
             messages[0]['content'] = prompt
-        request = {
-            "messages": messages
-        }
+        request = kwargs
+        request["messages"] = messages
         request.update(self._default_params)
         if model:
             request['model'] = model
-        response = self.post(request)
-        return response.choices[0].message.content.rstrip()
+        return request
+
+    def generate(self, prompt: str, model: str=None, base64_image: str = None, until=None, abort=None, schema=None, **kwargs: Any):
+        return self.complete(self.generate_request(prompt, model, base64_image, **kwargs), until, abort, schema)
+
+    async def generate_async(self, prompt: str, model: str=None, base64_image: str = None, until=None, abort=None, schema=None, **kwargs: Any):
+        return await self.complete_async(self.generate_request(prompt, model, base64_image, **kwargs), until, abort, schema)
@@ -0,0 +1,131 @@
+import re
+import json
+from literal import parse_literal
+
+placement_formats = ['json', 'lines', 'table']
+# format of the placements in the prompts and responses of each stage; "json"
+# is the format the models were trained on
+stage_formats = {
+    'assign_placement': 'json',
+    'check_positional_error': 'json',
+    'generate_code': 'lines',
+}
+
+# a decimal number as written in positions, orientations and code
+re_number = r'-?\d+(?:\.\d+)?'
+table_header = 'name | x | y | orientation'
+
+# how assign_placement asks for the positions in each format
+json_spec = """Positions:
+[
+    {
+        "name": "<object name>",
+        "position": "[x, y, 0]",
+        "orientation": "<orientation>"
+    },
+    ...
+]"""
+table_spec = """Positions:
+name | x | y | orientation
+<object name> | <x> | <y> | <orientation>
+..."""
+
+def format_number(value, decimals=0):
+    # a plain decimal, never in exponent notation, rounded to decimals places
+    # without trailing zeros; placements are written in whole millimeters
+    text = f'{round(float(value), decimals):.{decimals}f}'
+    if '.' in text:
+        text = text.rstrip('0').rstrip('.')
+    return '0' if text == '-0' else text
+
+def format_orientation(orientation):
+    orientation = str(orientation if orientation is not None else '').strip()
+    degree = re.fullmatch(r'(' + re_number + r')\s*(?:degrees?|deg|°)?', orientation.lower())
+    if degree is not None:
+        return format_number(degree.group(1), 3)
+    return orientation.replace('|', '/').replace('\n', ' ')
+
+def format_table_row(p):
+    values = re.findall(re_number, str(p.get('position')))
+    if len(values) not in [2, 3]:
+        return None
+    return f"{p['name']} | {format_number(values[0])} | {format_number(values[1])} | {format_orientation(p.get('orientation'))}"
+
+def format_placement(positions, fmt='json'):
+    if fmt == 'json':
+        return json.dumps(positions, indent=2)
+    if fmt == 'lines':
+        # one object per line
+        if len(positions) == 0:
+            return '[]'
+        return '[\n' + ',\n'.join(json.dumps(p, ensure_ascii=False) for p in positions) + '\n]'
+    if fmt == 'table':
+        rows = [format_table_row(p) for p in positions]
+        if all(r is not None for r in rows):
+            return '\n'.join([table_header] + rows)
+        # positions that are not plain numbers stay in json
+        return format_placement(positions, 'lines')
+    raise ValueError(f"unknown placement format: {fmt}")
+
+def parse_table(text):
+    # rows of "name | x | y | orientation"; the header, markdown borders and separators are optional
+    placement = []
+    for line in text.strip().strip('`').split('\n'):
+        line = line.strip()
+        if line == '' or re.fullmatch(r'[\s|:\-]+', line) or re.fullmatch(r'\w*', line):
+            continue
+        cells = [c.strip() for c in line.strip('|').split('|')]
+        if cells[0].lower() == 'name':
+            continue
+        if len(cells) == 3:
+            # the position in one cell, e.g. "Cabinet | [1000, 0, 0] | 90"
+            values = re.findall(re_number, cells[1])
+            if len(values) not in [2, 3]:
+                return None
+            x, y = values[0], values[1]
+        elif len(cells) in [4, 5]:
+            x, y = cells[1], cells[2]
+            if re.fullmatch(re_number + r'\s*(?:mm)?', x) is None or re.fullmatch(re_number + r'\s*(?:mm)?', y) is None:
+                return None
+            x, y = re.findall(re_number, x)[0], re.findall(re_number, y)[0]
+        else:
+            return None
+        orientation = cells[-1]
+        if re.fullmatch(re_number, orientation):
+            orientation = f'{format_number(orientation, 3)} degrees'
+        placement.append({"name": cells[0], "position": f"[{format_number(x)}, {format_number(y)}, 0]", "orientation": orientation})
+    return placement
+
+def parse_placement_list(text):
+    # the list of placements in a json or python literal, or None
+    start, end = text.find('['), text.rfind(']')
+    if start == -1 or end == -1 or start >= end:
+        return None
+    try:
+        placement = parse_literal(text[start:end + 1])
+    except ValueError:
+        return None
+    if not isinstance(placement, list) or not all(isinstance(p, dict) and 'name' in p for p in placement):
+        return None
+    return placement
+
+def parse_placement(text):
+    # a json list as written by the models, or a table
+    if '{' not in text:
+        return parse_table(text)
+    return parse_placement_list(text)
+
+def convert_placements(text, fmt):
+    # rewrites the placement lists of a prompt or response in another format,
+    # e.g. to turn collected training data into the table format
+    if fmt == 'json':
+        return text
+    if fmt == 'table':
+        text = text.replace(json_spec, table_spec)
+
+    def convert(m):
+        placement = parse_placement(m.group())
+        if placement is None or not all('position' in p for p in placement):
+            return m.group()
+        return format_placement(placement, fmt)
+    return re.sub(r'\[\s*\{[^\[\]]*?"name"(?:[^\[\]]|\[[^\[\]]*\])*\]', convert, text)
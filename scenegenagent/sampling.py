@@ -0,0 +1,117 @@
+import asyncio
+import threading
+import contextvars
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FutureTimeoutError
+from budget import BudgetExceeded
+from calls import run_calls, run_calls_async
+from model import candidate_index
+
+def reserve_attempts(num_candidates, stage, budget, prompt=None):
+    # attempts are counted up front so that candidates never race on the budget
+    reserved = 0
+    for _ in range(num_candidates):
+        try:
+            budget.attempt(stage, prompt)
+        except BudgetExceeded:
+            if reserved == 0:
+                raise
+            break
+        reserved += 1
+    return reserved
+
+# Samples num_candidates responses concurrently and validates them in the
+# order they arrive. request() returns a fresh model call as yielded by a stage
+# (see calls.py), and validate(output) returns the calls of a stage that ends
+# with (valid, result). Returns the result of the first valid candidate (or
+# None) and the results of the rejected ones. Stages sample through
+# call(sampling, 'sample_candidates', ...), so that the sync and async versions
+# are picked like the methods of a model.
+# Requests that are not streamed cannot be interrupted from a thread, so they
+# finish in the background and are discarded; streamed ones stop once a winner
+# is found.
+def sample_candidates(num_candidates, request, validate, stage, budget, prompt=None):
+    num_candidates = reserve_attempts(num_candidates, stage, budget, prompt)
+    cancelled = threading.Event()
+
+    def run(index):
+        token = candidate_index.set(index)
+        try:
+            target, method, args, kwargs = request()
+            abort = kwargs.get('abort')
+            kwargs['abort'] = lambda text: cancelled.is_set() or (abort is not None and abort(text))
+            return getattr(target, method)(*args, **kwargs)
+        except Exception as e:
+            if not cancelled.is_set():
+                print(traceback.format_exc())
+            return None
+        finally:
+            candidate_index.reset(token)
+
+    executor = ThreadPoolExecutor(max_workers=num_candidates)
+    # the threads run in copies of the caller's context, e.g. its replay scope
+    futures = [executor.submit(contextvars.copy_context().run, run, i) for i in range(num_candidates)]
+    rejected = []
+    try:
+        for future in as_completed(futures, timeout=budget.remaining()):
+            output = future.result()
+            if output is None:
+                continue
+            try:
+                valid, result = run_calls(validate(output))
+            except BudgetExceeded:
+                raise
+            except Exception as e:
+                print(traceback.format_exc())
+                continue
+            if valid:
+                return result, rejected
+            rejected.append(result)
+    except FutureTimeoutError:
+        raise BudgetExceeded(stage, f"deadline exceeded after {budget.elapsed():.1f}s")
+    finally:
+        cancelled.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+    print(f"All {num_candidates} candidates of {stage} were rejected")
+    return None, rejected
+
+async def sample_candidates_async(num_candidates, request, validate, stage, budget, prompt=None):
+    num_candidates = reserve_attempts(num_candidates, stage, budget, prompt)
+
+    async def run(index):
+        token = candidate_index.set(index)
+        try:
+            target, method, args, kwargs = request()
+            return await getattr(target, method + '_async')(*args, **kwargs)
+        except Exception as e:
+            print(traceback.format_exc())
+            return None
+        finally:
+            candidate_index.reset(token)
+
+    # pending requests are cancelled as soon as a candidate is accepted
+    tasks = [asyncio.ensure_future(run(i)) for i in range(num_candidates)]
+    rejected = []
+    try:
+        for next_done in asyncio.as_completed(tasks, timeout=budget.remaining()):
+            try:
+                output = await next_done
+            except asyncio.TimeoutError:
+                raise BudgetExceeded(stage, f"deadline exceeded after {budget.elapsed():.1f}s")
+            if output is None:
+                continue
+            try:
+                valid, result = await run_calls_async(validate(output))
+            except BudgetExceeded:
+                raise
+            except Exception as e:
+                print(traceback.format_exc())
+                continue
+            if valid:
+                return result, rejected
+            rejected.append(result)
+    finally:
+        for task in tasks:
+            task.cancel()
+    print(f"All {num_candidates} candidates of {stage} were rejected")
+    return None, rejected
@@ -0,0 +1,130 @@
+import re
+import json
+import numpy as np
+from catalog import permission_list, re_permitted
+from placement_format import re_number, format_number, format_orientation, format_placement, table_header
+
+re_values = re.compile(re_number)
+re_degree = re.compile(r'(' + re_number + r')\s*(?:degrees?|deg|°)?')
+type_index = {n: i for i, n in enumerate(permission_list)}
+
+def parse_position(position):
+    if isinstance(position, (list, tuple)):
+        values = position
+    else:
+        values = re_values.findall(str(position))
+    if len(values) not in [2, 3]:
+        return None
+    try:
+        values = [float(v) for v in values]
+    except (TypeError, ValueError):
+        return None
+    return values if len(values) == 3 else values + [0.0]
+
+def parse_degree(orientation):
+    if orientation is None or isinstance(orientation, (int, float)):
+        return float(orientation or 0)
+    orientation = str(orientation).strip().lower()
+    if orientation in ['', 'default', 'none', 'n/a']:
+        return 0.0
+    degree = re_degree.fullmatch(orientation)
+    if degree is None:
+        return None
+    return float(degree.group(1))
+
+def object_type(name):
+    # the index of the object type in permission_list, or -1
+    m = re_permitted.search(name)
+    return type_index[m.group()] if m is not None else -1
+
+# A placement as arrays: the object names, their types as indices into
+# permission_list (-1 for other objects), an (N, 3) array of positions and an
+# array of orientations in degrees. Positions that are not coordinates and
+# orientations that are not angles, e.g. "towards the Cabinet", are NaN. The
+# position and orientation values are also kept as written, so that the
+# placement converts back to the same {"name", "position", "orientation"}
+# dicts, and the arrays are only parsed from them when first used, as most
+# placements parsed from streamed outputs are never checked. Each prompt
+# format is rendered once and kept, as the same placement goes into the
+# checker prompt, the feedback and the code generation prompt.
+class Scene:
+    __slots__ = ['names', 'position_values', 'orientation_values', 'rendered', '_types', '_positions', '_orientations']
+
+    def __init__(self, names, position_values, orientation_values):
+        self.names = list(names)
+        self.position_values = list(position_values)
+        self.orientation_values = list(orientation_values)
+        self.rendered = {}
+        self._types = None
+        self._positions = None
+        self._orientations = None
+
+    @property
+    def types(self):
+        if self._types is None:
+            self._types = np.array([object_type(n) for n in self.names], dtype=np.int16)
+        return self._types
+
+    @property
+    def positions(self):
+        if self._positions is None:
+            positions = []
+            for p in self.position_values:
+                p = parse_position(p) if p is not None else None
+                positions.extend(p if p is not None else [np.nan] * 3)
+            self._positions = np.array(positions, dtype=np.float64).reshape(-1, 3)
+        return self._positions
+
+    @property
+    def orientations(self):
+        if self._orientations is None:
+            degrees = [parse_degree(o) for o in self.orientation_values]
+            self._orientations = np.array([d if d is not None else np.nan for d in degrees], dtype=np.float64)
+        return self._orientations
+
+    @classmethod
+    def from_placement(cls, placement):
+        if isinstance(placement, Scene):
+            return placement
+        return cls([p['name'] for p in placement], [p.get('position') for p in placement], [p.get('orientation') for p in placement])
+
+    def to_placement(self):
+        placement = []
+        for name, position, orientation in zip(self.names, self.position_values, self.orientation_values):
+            p = {"name": name}
+            if position is not None:
+                p["position"] = position
+            if orientation is not None:
+                p["orientation"] = orientation
+            placement.append(p)
+        return placement
+
+    def __len__(self):
+        return len(self.names)
+
+    def __iter__(self):
+        return iter(self.to_placement())
+
+    def __repr__(self):
+        return f"Scene({self.to_placement()!r})"
+
+    def valid(self):
+        # the objects whose position is a coordinate
+        return ~np.isnan(self.positions).any(axis=1)
+
+    def distances(self):
+        # the pairwise distances on the ground
+        diff = self.positions[:, None, :2] - self.positions[None, :, :2]
+        return np.sqrt((diff ** 2).sum(axis=-1))
+
+    def format(self, fmt='json'):
+        if fmt not in self.rendered:
+            if fmt == 'table' and self.valid().all():
+                rows = [f"{name} | {format_number(x)} | {format_number(y)} | {format_orientation(o)}" for name, (x, y, _), o in zip(self.names, self.positions, self.orientation_values)]
+                self.rendered[fmt] = '\n'.join([table_header] + rows)
+            else:
+                self.rendered[fmt] = format_placement(self.to_placement(), fmt)
+        return self.rendered[fmt]
+
+    def dumps(self):
+        return json.dumps(self.to_placement())
@@ -0,0 +1,191 @@
+import re
+import json
+from placement_format import format_placement, table_header
+
+# Step formats of the structured stages, written as a sequence of parts:
+# ('text', literal) is copied as is, ('free', key) is free text such as an
+# analysis, and ('list', key, item) is a JSON list, or a table, of items. From
+# one format we derive the regex for vLLM's guided_regex, the JSON schema for
+# guided_json or OpenAI's response_format, and the renderer that turns a
+# JSON answer back into the step text the stage parsers read.
+
+re_free = r'[^#`]*'
+re_string = r'"[^"\\\n]*"'
+re_coordinate = r'"\[-?\d+(\.\d+)?, -?\d+(\.\d+)?, 0\]"'
+re_flat_object = r'\{[^{}\[\]]*(\[[^\[\]]*\][^{}\[\]]*)*\}'
+
+# lists of strings are written on one line, as the stages parse them from the rest of the line
+string_item = {"regex": re_string, "schema": {"type": "string"}, "inline": True}
+
+def object_item(fields):
+    # fields: (key, regex of the value, schema of the value)
+    regex = r'\{\s*' + r'\s*,\s*'.join(f'"{re.escape(k)}"' + r'\s*:\s*' + r for k, r, _ in fields) + r'\s*\}'
+    schema = {
+        "type": "object",
+        "properties": {k: s for k, _, s in fields},
+        "required": [k for k, _, _ in fields],
+        "additionalProperties": False,
+    }
+    return {"regex": regex, "schema": schema}
+
+placement_item = object_item([
+    ("name", re_string, {"type": "string"}),
+    ("position", re_coordinate, {"type": "string", "pattern": r'^\[-?\d+(\.\d+)?, -?\d+(\.\d+)?, 0\]$'}),
+    ("orientation", re_string, {"type": "string"}),
+])
+absolute_position_item = object_item([
+    ("name", re_string, {"type": "string"}),
+    ("position", re_string, {"type": "string"}),
+    ("orientation", re_string, {"type": "string"}),
+])
+relation_item = object_item([
+    ("object 1", re_string, {"type": "string"}),
+    ("relation", re_string, {"type": "string"}),
+    ("object 2", re_string, {"type": "string"}),
+])
+# any flat JSON object, for arrangement macros
+macro_item = {"regex": re_flat_object, "schema": {"type": "object"}}
+table_row_item = {
+    "regex": r'[^|\n]+ \| -?\d+ \| -?\d+ \| [^|\n]*',
+    "schema": {
+        "type": "object",
+        "properties": {"name": {"type": "string"}, "x": {"type": "integer"}, "y": {"type": "integer"}, "orientation": {"type": "string"}},
+        "required": ["name", "x", "y", "orientation"],
+        "additionalProperties": False,
+    },
+    "table": True,
+}
+
+def list_regex(item):
+    if item.get("table"):
+        return re.escape(table_header) + r'(\n' + item["regex"] + r')*'
+    if item.get("inline"):
+        return r'\[ *(' + item["regex"] + r'( *, *' + item["regex"] + r')*)? *\]'
+    return r'\[\s*(' + item["regex"] + r'(\s*,\s*' + item["regex"] + r')*)?\s*\]'
+
+class StepFormat:
+    def __init__(self, name, parts, strict=True):
+        self.name = name
+        self.parts = parts
+        # whether the JSON schema fits OpenAI's strict mode
+        self.strict = strict
+
+    def regex(self):
+        regex = ''
+        for part in self.parts:
+            if part[0] == 'text':
+                regex += re.escape(part[1])
+            elif part[0] == 'free':
+                regex += re_free
+            elif part[0] == 'choice':
+                regex += '(' + '|'.join(re.escape(c) for c in part[2]) + ')'
+            else:
+                regex += list_regex(part[2])
+        return regex
+
+    def json_schema(self, patterns=True):
+        properties = {}
+        for part in self.parts:
+            if part[0] == 'free':
+                properties[part[1]] = {"type": "string"}
+            elif part[0] == 'choice':
+                properties[part[1]] = {"type": "string", "enum": part[2]}
+            elif part[0] == 'list':
+                properties[part[1]] = {"type": "array", "items": part[2]["schema"]}
+        schema = {
+            "type": "object",
+            "properties": properties,
+            "required": list(properties),
+            "additionalProperties": False,
+        }
+        if not patterns:
+            # OpenAI's strict mode does not take regex patterns
+            schema = json.loads(re.sub(r',\s*"pattern":\s*"(?:[^"\\]|\\.)*"', '', json.dumps(schema)))
+        return schema
+
+    def render(self, answer):
+        # the step text of a JSON answer
+        text = ''
+        for part in self.parts:
+            if part[0] == 'text':
+                text += part[1]
+            elif part[0] in ['free', 'choice']:
+                text += str(answer[part[1]]).replace('#', '').replace('`', '').strip()
+            elif part[2].get("table"):
+                text += format_placement([{"name": r["name"], "position": f"[{r['x']}, {r['y']}, 0]", "orientation": r["orientation"]} for r in answer[part[1]]], 'table')
+            elif part[2].get("inline"):
+                text += json.dumps(answer[part[1]], ensure_ascii=False)
+            else:
+                text += json.dumps(answer[part[1]], indent=4, ensure_ascii=False)
+        return text
+
+list_objects_format = StepFormat('list_objects', [
+    ('text', '#Step 1: Find all objects#\nAnalysis: '), ('free', 'step_1_analysis'),
+    ('text', '\nObjects: '), ('list', 'step_1_objects', string_item),
+    ('text', '\n\n#Step 2: Fix object names#\nAnalysis: '), ('free', 'step_2_analysis'),
+    ('text', '\nObjects: '), ('list', 'step_2_objects', string_item),
+    ('text', '\n\n#Step 3: Rewrite description#\nAnalysis: '), ('free', 'step_3_analysis'),
+    ('text', '\nNew Description: '), ('free', 'new_description'),
+])
+
+extract_layout_format = StepFormat('extract_layout', [
+    ('text', '#Step 1: Identify Objects#\nAnalysis: '), ('free', 'step_1_analysis'),
+    ('text', '\nObjects:\n'), ('list', 'objects', string_item),
+    ('text', '\n\n#Step 2: Absolute Positions#\nAnalysis: '), ('free', 'step_2_analysis'),
+    ('text', '\nPositions:\n'), ('list', 'positions', absolute_position_item),
+    ('text', '\n\n#Step 3: Relative Positions#\nAnalysis: '), ('free', 'step_3_analysis'),
+    ('text', '\nRelative Positions:\n'), ('list', 'relative_positions', relation_item),
+])
+
+positional_error_format = StepFormat('check_positional_error', [
+    ('text', 'Relations: '), ('free', 'relations'),
+    ('text', '\nAnalysis: '), ('free', 'analysis'),
+    ('text', '\nError: '), ('choice', 'error', ['Yes', 'No']),
+])
+
+def assign_placement_format(fmt='json', use_macros=False):
+    if fmt == 'table':
+        item = table_row_item
+    elif use_macros:
+        item = {"regex": '(' + placement_item["regex"] + '|' + macro_item["regex"] + ')', "schema": {"anyOf": [placement_item["schema"], macro_item["schema"]]}}
+    else:
+        item = placement_item
+    return StepFormat('assign_placement', [
+        ('text', '#Step 1: Rewrite Relative Position#\nAnalysis: '), ('free', 'step_1_analysis'),
+        ('text', '\nNew Relative Positions:\n'), ('list', 'new_relative_positions', relation_item),
+        ('text', '\n\n#Step 2: Calculate Coordinates#\nAnalysis: '), ('free', 'step_2_analysis'),
+        ('text', '\nPositions:\n'), ('list', 'step_2_positions', item),
+        ('text', '\n\n#Step 3: Assign Positions#\nAnalysis: '), ('free', 'step_3_analysis'),
+        ('text', '\nPositions:\n'), ('list', 'step_3_positions', item),
+    ], strict=fmt == 'table' or not use_macros)
+
+guided_decoding_modes = ['guided_regex', 'guided_json', 'response_format']
+
+# Adds the format to a chat completion request. Returns the request and the
+# format to render the answer with, or None if the answer is already text.
+def constrain_request(request, step_format, mode):
+    if step_format is None or mode is None:
+        return request, None
+    request = dict(request)
+    if mode == 'guided_regex':
+        request['extra_body'] = {**request.get('extra_body', {}), 'guided_regex': step_format.regex()}
+        return request, None
+    if mode == 'guided_json':
+        request['extra_body'] = {**request.get('extra_body', {}), 'guided_json': step_format.json_schema()}
+        return request, step_format
+    if mode == 'response_format':
+        request['response_format'] = {
+            "type": "json_schema",
+            "json_schema": {"name": step_format.name, "schema": step_format.json_schema(patterns=False), "strict": step_format.strict},
+        }
+        return request, step_format
+    raise ValueError(f"unknown guided decoding mode: {mode}")
+
+def render_answer(text, step_format):
+    if step_format is None:
+        return text
+    try:
+        return step_format.render(json.loads(text))
+    except (ValueError, KeyError, TypeError):
+        # left unrendered, the stage fails to parse it and samples again
+        return text
@@ -0,0 +1,171 @@
+import re
+import json
+import math
+import numpy as np
+from scene import parse_position
+from placement_format import format_number
+
+re_distance = r'(-?\d+(?:\.\d+)?)\s*-?\s*(millimeters?|millimetres?|mm|centimeters?|centimetres?|cm|meters?|metres?|m)\b'
+re_increment = r'\[\s*([+-]?\d+(?:\.\d+)?)\s*,\s*([+-]?\d+(?:\.\d+)?)\s*(?:,\s*[+-]?\d+(?:\.\d+)?\s*)?\]'
+re_angle = r'(-?\d+(?:\.\d+)?)\s*(?:degrees?|°)'
+directions = [
+    (r'\bin front\b|\bfront\b|\bahead\b|\bforward\b', (1, 0)),
+    (r'\bbehind\b|\bback\b|\bbackward\b|\brear\b', (-1, 0)),
+    (r'\bleft\b', (0, 1)),
+    (r'\bright\b', (0, -1)),
+]
+# relations that need more than a displacement between two points
+re_unsupported = r'\bbetween\b|\bopposite\b|\bdiagonal|\baround\b|\bboth\b|\beach\b|\beither\b|\bsymmetr|\bcorner\b|\bcenter\b|\bcentre\b|\bmiddle\b|\bparallel\b|\balong\b|\bsame\b|\balign|\babove\b|\bbelow\b|\bon top\b|\bunder\b|\bwithin\b|\bat least\b|\bat most\b|\bmore than\b|\bless than\b'
+re_row = r'\binterval|\bapart\b|\bspacing\b|\bspaced\b|\brow\b|\bline\b|\bdistance\b|\baway\b'
+re_facing = r'\bfac(?:e|es|ing)\b|\btowards?\b|\boriented\b|\borientation\b|\brotated?\b|\bpoint(?:s|ing)? at\b'
+re_surround = r'\bsurround|\benclos|\bencircl|\bfenc'
+
+def to_millimeters(value, unit):
+    value = float(value)
+    if unit.startswith('m') and unit not in ['m', 'meter', 'meters', 'metre', 'metres']:
+        return value
+    if unit.startswith('c'):
+        return value * 10
+    return value * 1000
+
+# Returns the (x, y) displacement of object 1 relative to object 2 (or None)
+# and its orientation ("facing", a number of degrees or None). Raises
+# ValueError when the relation is too vague to be solved.
+def parse_relation(relation):
+    text = relation.lower()
+    increment = re.findall(re_increment, text)
+    if len(increment) == 1:
+        return (float(increment[0][0]), float(increment[0][1])), None
+    if len(increment) > 1:
+        raise ValueError(relation)
+    if re.search(re_unsupported, text):
+        raise ValueError(relation)
+    orientation = None
+    if re.search(re_facing, text):
+        angle = re.findall(re_angle, text)
+        orientation = float(angle[0]) if len(angle) == 1 else "facing"
+        text = re.sub(re_angle, '', text)
+    distances = [(m.start(), to_millimeters(m.group(1), m.group(2))) for m in re.finditer(re_distance, text)]
+    found = sorted((m.start(), vector) for pattern, vector in directions for m in re.finditer(pattern, text))
+    if len(distances) == 0:
+        if orientation is not None and len(found) == 0:
+            return None, orientation
+        raise ValueError(relation)
+    if len(found) == 0:
+        # "in a row at 1.5 m intervals" without a direction: line objects up along y
+        if len(distances) == 1 and re.search(re_row, text):
+            return (0.0, distances[0][1]), orientation
+        raise ValueError(relation)
+    if len(found) != len(distances):
+        raise ValueError(relation)
+    displacement = np.zeros(2)
+    for (_, vector), (_, distance) in zip(found, distances):
+        displacement += np.asarray(vector) * distance
+    return (float(displacement[0]), float(displacement[1])), orientation
+
+# Solves the coordinates of all objects from the absolute and relative
+# positions extracted by extract_layout. Every relation becomes the linear
+# constraint p1 - p2 = d on the x and y axes, explicit coordinates are fixed,
+# and the system is solved by least squares. Returns None when a relation is
+# too vague, an object is not tied to any coordinate, or the relations
+# contradict each other or the coordinates, so that the LLM stage can take
+# over.
+def solve_placement(objects, coordinates, relations):
+    try:
+        objects = json.loads(objects) if isinstance(objects, str) else objects
+        coordinates = json.loads(coordinates) if isinstance(coordinates, str) else coordinates
+        relations = json.loads(relations) if isinstance(relations, str) else relations
+    except ValueError:
+        return None
+    if not objects or not isinstance(objects, list):
+        return None
+    names = {}
+    def canonical(name):
+        return names.setdefault(str(name).strip().lower(), str(name).strip())
+
+    for o in objects:
+        canonical(o)
+    fixed, orientations = {}, {}
+    for c in coordinates or []:
+        if not isinstance(c, dict) or 'name' not in c:
+            continue
+        position = parse_position(c.get('position'))
+        if position is None:
+            return None
+        fixed[canonical(c['name'])] = np.asarray(position[:2], dtype=np.float64)
+        if c.get('orientation'):
+            orientations[canonical(c['name'])] = c['orientation']
+
+    constraints, facing, surrounding = [], [], []
+    for r in relations or []:
+        try:
+            name_1, name_2, relation = canonical(r['object 1']), canonical(r['object 2']), r['relation']
+        except (KeyError, TypeError):
+            return None
+        if 'guarding' in name_1.lower() and re.search(re_surround, relation.lower()):
+            surrounding.append(name_1)
+            continue
+        try:
+            displacement, orientation = parse_relation(relation)
+        except ValueError:
+            return None
+        if displacement is not None:
+            constraints.append((name_1, name_2, np.asarray(displacement, dtype=np.float64)))
+        if orientation == "facing":
+            facing.append((name_1, name_2))
+        elif orientation is not None:
+            orientations[name_1] = f"{format_number(orientation)} degrees"
+
+    unknowns = [n for n in names.values() if n not in fixed and n not in surrounding]
+    if len(fixed) == 0 and len(unknowns) > 0:
+        # without any coordinate, the first object is the origin
+        fixed[unknowns[0]] = np.zeros(2)
+        unknowns = unknowns[1:]
+    index = {n: i for i, n in enumerate(unknowns)}
+    positions = dict(fixed)
+    if len(unknowns) > 0:
+        A = np.zeros((len(constraints), len(unknowns)))
+        b = np.zeros((len(constraints), 2))
+        for row, (name_1, name_2, displacement) in enumerate(constraints):
+            b[row] = displacement
+            for name, sign in [(name_1, 1.0), (name_2, -1.0)]:
+                if name in index:
+                    A[row, index[name]] += sign
+                elif name in fixed:
+                    b[row] -= sign * fixed[name]
+                else:
+                    return None
+        if len(constraints) == 0 or np.linalg.matrix_rank(A) < len(unknowns):
+            return None
+        solution = np.linalg.lstsq(A, b, rcond=None)[0]
+        if np.abs(A @ solution - b).max() > 1:
+            return None
+        for name, i in index.items():
+            positions[name] = solution[i]
+    # relations between objects with given coordinates are not part of the system
+    for name_1, name_2, displacement in constraints:
+        if name_1 not in positions or name_2 not in positions or np.abs(positions[name_1] - positions[name_2] - displacement).max() > 1:
+            return None
+    for name in surrounding:
+        others = [p for n, p in positions.items() if n != name]
+        if len(others) == 0:
+            return None
+        positions[name] = np.mean(others, axis=0)
+    for name_1, name_2 in facing:
+        if name_1 not in positions or name_2 not in positions:
+            return None
+        dx, dy = positions[name_2] - positions[name_1]
+        orientations[name_1] = f"{format_number(math.degrees(math.atan2(dy, dx)) % 360)} degrees"
+
+    placement = []
+    for o in objects:
+        name = canonical(o)
+        if name not in positions:
+            return None
+        x, y = positions[name]
+        placement.append({
+            "name": name,
+            "position": f"[{format_number(x)}, {format_number(y)}, 0]",
+            "orientation": orientations.get(name, "0 degrees"),
+        })
+    return placement
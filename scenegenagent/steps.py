@@ -0,0 +1,132 @@
+import re
+
+# Sections of the "#Step N" outputs of the layout stages. Each line is read
+# once: a "#Step N" line opens a step, a "<Label>:" line opens a field of the
+# current step, and other lines continue the open field. A backtick closes the
+# field, as the model ends its answer with the code fence. Text can be fed in
+# streamed chunks; complete lines are parsed as they arrive, and the last,
+# incomplete line is only taken into account when the sections are read.
+
+step_labels = ['Analysis', 'Objects', 'Positions', 'New Relative Positions', 'Relative Positions', 'New Description']
+
+# the number after "#Step ", read by step_events
+re_step_number = re.compile(r'\d+')
+
+def find_all(text, sub):
+    found = []
+    pos = text.find(sub)
+    while pos != -1:
+        found.append(pos)
+        pos = text.find(sub, pos + 1)
+    return found
+
+# the lines that change the state start with a newline and a header or a
+# label; each is found with str.find, which is several times faster than a
+# regex search over the whole output
+def step_events(text):
+    # (start, end, header number or label or None for a backtick) in order
+    events = []
+    for start in find_all(text, '\n#Step '):
+        number = re_step_number.match(text, start + 7)
+        if number is not None:
+            events.append((start, number.end(), int(number.group())))
+    for label in step_labels:
+        events += [(start, start + len(label) + 2, label) for start in find_all(text, '\n' + label + ':')]
+    events += [(start, start + 1, None) for start in find_all(text, '`')]
+    events.sort(key=lambda e: e[0])
+    return events
+
+def add_block(block, steps, field):
+    # adds complete lines to the steps, which are (number, {label: [lines]})
+    # pairs, and returns the label of the field left open. Only the headers,
+    # labels and backticks are visited, and the lines between them are split
+    # off in one piece
+    text = '\n' + block
+    pos = 1
+    for start, end, event in step_events(text):
+        if event is None:
+            if start < pos:
+                continue
+            if field is not None:
+                steps[-1][1][field].extend(text[pos:start].split('\n'))
+                field = None
+            pos = text.find('\n', start) + 1 or len(text) + 1
+            continue
+        # headers and labels start with the newline before their line
+        if start < pos - 1:
+            continue
+        if field is not None and start >= pos:
+            steps[-1][1][field].extend(text[pos:start].split('\n'))
+        if isinstance(event, int):
+            steps.append((event, {}))
+            field = None
+            pos = text.find('\n', start + 1) + 1 or len(text) + 1
+        elif len(steps) > 0:
+            field = event
+            steps[-1][1][field] = []
+            pos = end
+        else:
+            pos = text.find('\n', start + 1) + 1 or len(text) + 1
+    if field is not None and pos <= len(text):
+        steps[-1][1][field].extend(text[pos:].split('\n'))
+    return field
+
+def add_line(line, steps, field):
+    return add_block(line, steps, field)
+
+class StepParser:
+    def __init__(self, text=''):
+        self.text = ''
+        self.parsed = 0
+        self.steps = []
+        self.field = None
+        self.view = None
+        self.feed(text)
+
+    def feed(self, chunk):
+        self.text += chunk
+        end = self.text.rfind('\n', self.parsed) + 1
+        if end > self.parsed:
+            self.field = add_block(self.text[self.parsed:end - 1], self.steps, self.field)
+            self.parsed = end
+        self.view = None
+        return self
+
+    def update(self, text):
+        # the whole text received so far, as streaming checks are called with;
+        # the final answer may have lost the trailing whitespace of the stream
+        if self.text.startswith(text) and self.text[len(text):].strip() == '':
+            return self
+        if not text.startswith(self.text):
+            self.__init__()
+        return self.feed(text[len(self.text):])
+
+    def sections(self):
+        if self.view is None:
+            steps = self.steps
+            if self.parsed < len(self.text):
+                # the incomplete last line goes into copies of the last step and of the open field
+                steps = steps[:-1] + [(steps[-1][0], dict(steps[-1][1]))] if len(steps) > 0 else []
+                if self.field is not None:
+                    steps[-1][1][self.field] = list(steps[-1][1][self.field])
+                add_line(self.text[self.parsed:], steps, self.field)
+            self.view = steps
+        return self.view
+
+    def numbers(self):
+        return [number for number, _ in self.sections()]
+
+    def get(self, number, label):
+        # the field of the first step with the number, or None
+        for n, fields in self.sections():
+            if n == number:
+                return '\n'.join(fields[label]).strip() if label in fields else None
+        return None
+
+    def values(self, label):
+        # the field in every step that has it
+        return ['\n'.join(fields[label]).strip() for _, fields in self.sections() if label in fields]
+
+def parse_steps(text):
+    # a StepParser over the text, or the parser itself, so stage parsers take either
+    return text if isinstance(text, StepParser) else StepParser(text)
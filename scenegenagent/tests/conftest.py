@@ -0,0 +1,22 @@
+import os
+import sys
+import pytest
+
+# the modules of scenegenagent are imported by their plain names
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from standin import StandIn
+
+@pytest.fixture
+def standin():
+    # starts a stand-in server answering with respond(request)
+    servers = []
+
+    def start(respond):
+        server = StandIn(respond)
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.close()
@@ -0,0 +1,130 @@
+import re
+import json
+import time
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# A local stand-in for an OpenAI-compatible server such as vLLM. Each chat
+# completion is answered by respond(request), which returns the text of the
+# answer, or the JSON answer when the request asks for guided_json or a
+# response_format. Like the real servers, the stand-in honors the constraints:
+# an answer that does not match the guided_regex or the JSON schema of the
+# request is refused with an error instead of being returned.
+
+class Refusal(Exception):
+    # raised by respond(request) to answer with an HTTP error instead
+    def __init__(self, status=400, message="refused"):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+def conforms(value, schema):
+    if "anyOf" in schema:
+        return any(conforms(value, s) for s in schema["anyOf"])
+    if "enum" in schema and value not in schema["enum"]:
+        return False
+    t = schema.get("type")
+    if t == "object":
+        if not isinstance(value, dict):
+            return False
+        properties = schema.get("properties", {})
+        if any(k not in value for k in schema.get("required", [])):
+            return False
+        if schema.get("additionalProperties") is False and any(k not in properties for k in value):
+            return False
+        return all(conforms(value[k], s) for k, s in properties.items() if k in value)
+    if t == "array":
+        return isinstance(value, list) and all(conforms(v, schema.get("items", {})) for v in value)
+    if t == "string":
+        return isinstance(value, str) and ("pattern" not in schema or re.search(schema["pattern"], value) is not None)
+    if t == "integer":
+        return isinstance(value, int) and not isinstance(value, bool)
+    return True
+
+def constrained_content(request, answer):
+    # the content of the answer, or an error message if it breaks the constraints
+    if "guided_regex" in request:
+        if not isinstance(answer, str) or re.fullmatch(request["guided_regex"], answer) is None:
+            return None, f"answer does not match guided_regex: {answer!r}"
+        return answer, None
+    schema = request.get("guided_json")
+    if schema is None and "response_format" in request:
+        schema = request["response_format"]["json_schema"]["schema"]
+    if schema is not None:
+        if not conforms(answer, schema):
+            return None, f"answer does not match the JSON schema: {answer!r}"
+        return json.dumps(answer, ensure_ascii=False), None
+    return answer, None
+
+def completion(request, content):
+    return {
+        "id": "standin",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": request["model"],
+        "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+    }
+
+def chunk(request, content, finish_reason=None):
+    return {
+        "id": "standin",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": request["model"],
+        "choices": [{"index": 0, "finish_reason": finish_reason, "delta": {"content": content}}],
+    }
+
+class StandIn:
+    def __init__(self, respond):
+        self.respond = respond
+        self.requests = []
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def send_json(self, status, body):
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                if self.path.endswith("/models"):
+                    return self.send_json(200, {"object": "list", "data": [{"id": "standin", "object": "model", "created": 0, "owned_by": "standin"}]})
+                self.send_json(404, {"error": {"message": "not found"}})
+
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                standin.requests.append(request)
+                try:
+                    answer = standin.respond(request)
+                except Refusal as e:
+                    return self.send_json(e.status, {"error": {"message": e.message, "type": "invalid_request_error"}})
+                content, error = constrained_content(request, answer)
+                if error is not None:
+                    return self.send_json(400, {"error": {"message": error, "type": "invalid_request_error"}})
+                if not request.get("stream"):
+                    return self.send_json(200, completion(request, content))
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.end_headers()
+                pieces = [content[i:i + 8] for i in range(0, len(content), 8)]
+                for event in [chunk(request, p) for p in pieces] + [chunk(request, None, "stop")]:
+                    self.wfile.write(f"data: {json.dumps(event)}\n\n".encode('utf-8'))
+                self.wfile.write(b"data: [DONE]\n\n")
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}/v1"
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
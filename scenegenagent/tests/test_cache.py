@@ -0,0 +1,36 @@
+import asyncio
+import pytest
+from cache import ResponseCache, replay_scope, CacheMiss
+from model import LocalModel
+
+def ask(model, sample, text):
+    replay_scope.set(sample)
+    return model.invoke([{"role": "user", "content": text}])
+
+async def ask_async(model, sample, texts, delay):
+    replay_scope.set(sample)
+    answers = []
+    for text in texts:
+        await asyncio.sleep(delay)
+        answers.append(await model.invoke_async([{"role": "user", "content": text}]))
+    return answers
+
+def test_replay_is_keyed_by_sample(standin, tmp_path):
+    # the k-th occurrence of a request in a sample is served by the k-th stored response,
+    # so samples asking the same question share them
+    count = iter(range(100))
+    server = standin(lambda request: f"answer {next(count)}")
+    path = str(tmp_path / "cache.sqlite")
+    model = LocalModel('standin', base_url=server.base_url, cache=ResponseCache(path))
+    recorded = [ask(model, sample, "question") for sample in [1, 1, 2, 2, 2]]
+    assert recorded == ["answer 0", "answer 1", "answer 0", "answer 1", "answer 2"]
+
+    # replayed concurrently, in another order, each sample gets the answers it got before
+    model = LocalModel('standin', base_url=server.base_url, cache=ResponseCache(path, readonly=True))
+
+    async def replay():
+        return await asyncio.gather(ask_async(model, 2, ["question"] * 3, 0), ask_async(model, 1, ["question"] * 2, 0.01))
+    assert asyncio.run(replay()) == [["answer 0", "answer 1", "answer 2"], ["answer 0", "answer 1"]]
+    assert len(server.requests) == 3
+    with pytest.raises(CacheMiss):
+        ask(model, 1, "another question")
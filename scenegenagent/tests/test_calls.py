@@ -0,0 +1,113 @@
+import json
+import asyncio
+import pytest
+from budget import Budget
+from model import LocalModel
+from scene import Scene
+from emitter import emit_code
+from catalog import guidance_index
+from layout_analysis import process_prompt, process_prompt_async
+from code_gen import gen_code, gen_code_async
+from standin import Refusal
+
+objects = ["Cabinet", "Conveyor"]
+relations = [{"object 1": "Cabinet", "relation": "2 meters in front of", "object 2": "Conveyor"}]
+close = [
+    {"name": "Cabinet", "position": "[500, 0, 0]", "orientation": "0 degrees"},
+    {"name": "Conveyor", "position": "[0, 0, 0]", "orientation": "0 degrees"},
+]
+placement = [
+    {"name": "Cabinet", "position": "[2000, 0, 0]", "orientation": "0 degrees"},
+    {"name": "Conveyor", "position": "[0, 0, 0]", "orientation": "0 degrees"},
+]
+
+def respond(request):
+    # a valid answer for each stage; the first placement overlaps and is repaired
+    messages = request["messages"]
+    prompt = messages[0]["content"]
+    if "#Step 1: Find all objects#" in prompt:
+        return '\n'.join([
+            '#Step 1: Find all objects#', 'Analysis: a', 'Objects: ["cabinet", "conveyor"]', '',
+            '#Step 2: Fix object names#', 'Analysis: b', f'Objects: {json.dumps(objects)}', '',
+            '#Step 3: Rewrite description#', 'Analysis: c', 'New Description: The Cabinet is 2 meters in front of the Conveyor.',
+        ])
+    if "#Step 1: Identify Objects#" in prompt:
+        return '\n'.join([
+            '#Step 1: Identify Objects#', 'Analysis: a', 'Objects:', json.dumps(objects), '',
+            '#Step 2: Absolute Positions#', 'Analysis: b', 'Positions:', '[]', '',
+            '#Step 3: Relative Positions#', 'Analysis: c', 'Relative Positions:', json.dumps(relations),
+        ])
+    if "#Step 1: Rewrite Relative Position#" in prompt:
+        positions = json.dumps(close if len(messages) == 1 else placement)
+        return '\n'.join([
+            '#Step 1: Rewrite Relative Position#', 'Analysis: a', 'New Relative Positions:', json.dumps(relations), '',
+            '#Step 2: Calculate Coordinates#', 'Analysis: b', 'Positions:', positions, '',
+            '#Step 3: Assign Positions#', 'Analysis: c', 'Positions:', positions,
+        ])
+    if "allocated positions" in prompt:
+        return 'Relations: The Cabinet is 2000 mm in front of the Conveyor.\nAnalysis: It is.\nError: No'
+    return emit_code(Scene.from_placement(placement), guidance_index.objects())
+
+def run(model, num_candidates, use_async):
+    budget = Budget(max_attempts=4)
+    args = ("Place a cabinet 2 meters in front of a conveyor.", model, model, model, model, model, budget)
+    if use_async:
+        objects, coords, prompt, _, failed_rounds = asyncio.run(process_prompt_async(*args, num_candidates=num_candidates))
+        code, _ = asyncio.run(gen_code_async(prompt, objects, coords, model, budget=budget, num_candidates=num_candidates))
+    else:
+        objects, coords, prompt, _, failed_rounds = process_prompt(*args, num_candidates=num_candidates)
+        code, _ = gen_code(prompt, objects, coords, model, budget=budget, num_candidates=num_candidates)
+    return objects, coords, failed_rounds, code, budget.attempts, budget.failure
+
+@pytest.mark.parametrize("num_candidates", [1, 2])
+def test_sync_and_async_stages_agree(standin, num_candidates):
+    model = LocalModel('standin', base_url=standin(respond).base_url)
+    result = run(model, num_candidates, False)
+    assert result == run(model, num_candidates, True)
+    objects, coords, failed_rounds, code, attempts, failure = result
+    assert coords == placement and failed_rounds == 1 and code is not None and failure is None
+    assert attempts["assign_placement"] == 1 + num_candidates
+
+def test_results_are_json_records(standin):
+    # the records eval.py writes, with the placement returned by process_prompt
+    model = LocalModel('standin', base_url=standin(respond).base_url)
+    budget = Budget(max_attempts=4)
+    objects, coords, prompt, analysis, _ = process_prompt("Place a cabinet 2 meters in front of a conveyor.", model, model, model, model, model, budget)
+    record = {"objects": objects, "placement": coords, "description": prompt, "analysis": analysis, "prompt_tokens": budget.prompt_report()}
+    assert json.loads(json.dumps(record, ensure_ascii=False))["placement"] == placement
+
+def test_failing_requests_end_the_stage(standin):
+    # the server refuses every placement and code request; without limits the stages still give up
+    def refuse(request):
+        prompt = request["messages"][0]["content"]
+        if "#Step 1: Rewrite Relative Position#" in prompt or "#Step" not in prompt:
+            raise Refusal(400, "bad request")
+        return respond(request)
+
+    server = standin(refuse)
+    model = LocalModel('standin', base_url=server.base_url)
+    budget = Budget()
+    objects, coords, prompt, _, _ = process_prompt("Place a cabinet 2 meters in front of a conveyor.", model, model, model, model, model, budget)
+    assert coords is None and budget.failure["stage"] == "assign_placement"
+    assert budget.errors == {"assign_placement": 5}
+    budget = Budget()
+    code, _ = gen_code(prompt, objects, placement, model, budget=budget)
+    assert code is None and budget.failure["stage"] == "generate_code"
+    assert budget.errors == {"generate_code": 5}
+
+def test_prompt_token_limit_keeps_partial_results(standin):
+    # a description no other test memoizes, so that every stage is sampled
+    model = LocalModel('standin', base_url=standin(respond).base_url)
+    budget = Budget(max_prompt_tokens={"assign_placement": 10})
+    found, coords, prompt, _, _ = process_prompt("Put a cabinet 2 meters in front of a conveyor.", model, model, model, model, model, budget)
+    assert json.loads(found) == objects and coords is None
+    assert budget.failure["stage"] == "assign_placement" and "exceeds the limit of 10" in budget.failure["reason"]
+    assert budget.failure["partial"] == {"placement": None, "failed_rounds": 0}
+    assert "assign_placement" not in budget.prompt_tokens
+    budget = Budget(max_prompt_tokens={"generate_code": 10})
+    code, failed_rounds = gen_code(prompt, objects, placement, model, budget=budget)
+    assert code is None and failed_rounds == 0
+    assert budget.failure["stage"] == "generate_code" and budget.failure["partial"] == {"code": None, "failed_rounds": 0}
+    # the sections are recorded before the limit is checked
+    sections = budget.prompt_sections["generate_code"]
+    assert {"prompt", "objects", "positions", "guidance_obj", "place_guidance", "template"} <= set(sections)
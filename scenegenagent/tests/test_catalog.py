@@ -0,0 +1,44 @@
+import os
+from catalog import GuidanceIndex, standardize_names, re_permitted, match_object
+
+def write(path, text, mtime_ns):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+def test_longest_names_match_first():
+    assert standardize_names("a kuka robot kr125 next to a kuka robot") == "a Kuka Robot KR125 next to a Kuka Robot"
+    assert standardize_names("a welding table and a table") == "a Welding Table and a Table"
+    assert re_permitted.search("Kuka Robot KR350 2").group() == "Kuka Robot KR350"
+    assert match_object("kuka robot kr125 2")[:2] == ("kuka robot kr125", 2)
+    assert match_object("Welding Table")[:2] == ("welding table", None)
+
+def test_guidance_index_matches_the_longest_file(tmp_path):
+    for i, name in enumerate(["Table", "Welding Table", "Robot", "Kuka Robot KR125"]):
+        write(tmp_path / f"{name}.txt", name, 10 ** 9 * (i + 1))
+    index = GuidanceIndex(str(tmp_path), check_interval=0)
+    assert index.match("Welding Table 3") == ("welding table", 3, "Welding Table")
+    assert index.match("kuka robot kr125") == ("kuka robot kr125", None, "Kuka Robot KR125")
+    assert index.match("Robot 2") == ("robot", 2, "Robot")
+    assert index.match("Cabinet") is None
+
+def test_guidance_index_reloads_changed_files(tmp_path):
+    write(tmp_path / "Cabinet.txt", "old", 10 ** 9)
+    index = GuidanceIndex(str(tmp_path), check_interval=0)
+    assert dict(index.objects()) == {"cabinet": "old"}
+    # unchanged mtimes are not read again
+    assert not index.refresh()
+    write(tmp_path / "Cabinet.txt", "new", 2 * 10 ** 9)
+    write(tmp_path / "Conveyor.txt", "conveyor", 2 * 10 ** 9)
+    assert dict(index.objects()) == {"cabinet": "new", "conveyor": "conveyor"}
+    assert index.match("Conveyor 1") == ("conveyor", 1, "conveyor")
+    os.remove(tmp_path / "Cabinet.txt")
+    assert index.match("Cabinet") is None and dict(index.objects()) == {"conveyor": "conveyor"}
+
+def test_guidance_index_waits_for_the_check_interval(tmp_path):
+    write(tmp_path / "Cabinet.txt", "old", 10 ** 9)
+    index = GuidanceIndex(str(tmp_path), check_interval=3600)
+    assert index.objects()["cabinet"] == "old"
+    write(tmp_path / "Cabinet.txt", "new", 2 * 10 ** 9)
+    assert index.objects()["cabinet"] == "old"
+    assert index.refresh(force=True) and index.objects()["cabinet"] == "new"
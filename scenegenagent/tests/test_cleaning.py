@@ -0,0 +1,70 @@
+from budget import Budget
+from model import LocalModel
+from cleaning import filter_prompt, clean_code, replay_clean_history
+from bench_clean_code import legacy_clean_code, make_response
+
+positions = [
+    {"name": "Cabinet", "position": "[0, 0, 0]", "orientation": "0 degrees"},
+    {"name": "Conveyor", "position": "[-2000, 0, 0]", "orientation": "0 degrees"},
+]
+
+def checker(standin, error):
+    def respond(request):
+        assert '"name": "Conveyor"' in request["messages"][0]["content"]
+        return f'Relations: The Conveyor is 2000 mm behind the Cabinet.\nAnalysis: It should be in front.\nError: {error}'
+    server = standin(respond)
+    return server, LocalModel('standin', base_url=server.base_url)
+
+def test_filter_prompt_asks_the_checker(standin):
+    server, model = checker(standin, "Yes")
+    budget = Budget(max_attempts=2)
+    should_filter, reason = filter_prompt("A Conveyor is 2 meters in front of a Cabinet.", positions, model, budget)
+    assert should_filter and reason.startswith("Relations: The Conveyor")
+    assert budget.attempts == {"check_positional_error": 1}
+    server, model = checker(standin, "No")
+    assert filter_prompt("A Conveyor is 2 meters in front of a Cabinet.", positions, model) == (False, None)
+
+def test_filter_prompt_rules_come_first(standin):
+    server, model = checker(standin, "No")
+    should_filter, reason = filter_prompt("A Conveyor is east of a Cabinet.", positions, model)
+    assert should_filter and "east" in reason
+    assert server.requests == []
+
+script = """string rootDir = TxApplication.SystemRootDirectory;
+
+string weldingLibPath = Path.Combine(rootDir, "Welding");
+string[] weldingModels = Directory.GetDirectories(weldingLibPath, "*.cojt", SearchOption.TopDirectoryOnly);
+TxPhysicalRoot txPhysicalRoot = TxApplication.ActiveDocument.PhysicalRoot;
+if (robotModels.Count >= 1)
+{
+    DirectoryInfo robotModel = robotModels[0];
+    Console.WriteLine(robotModel.Name);
+}
+TxApplication.RefreshDisplay();"""
+
+responses = [
+    None,
+    "",
+    "No code here.",
+    script,
+    "```csharp\n" + script + "\n```",
+    "Here it is:\n```csharp\n" + script + "\n```\nDone.",
+    "```csharp\n" + script,
+    "```csharp\n" + script.replace("\nTxApplication.RefreshDisplay();", "\n\n\n"),
+    "```csharp\n// a comment\n\n" + script + "\nConsole.WriteLine(\"after\");\n```",
+    "```csharp\nint x = 1;\n" + script[script.index("TxPhysicalRoot"):] + "\n```",
+    "```csharp\n" + "\n".join("    " + l for l in script.split("\n")) + "\n  int y = 2;\n    int z = 3;\n```",
+    "```csharp\nRandom rand = new Random();\n" + script + "\n```",
+] + [make_response(n, seed) for n, seed in [(1, 0), (3, 1), (10, 2)]]
+
+def test_clean_code_matches_the_legacy_implementation():
+    for response in responses:
+        assert clean_code(response) == legacy_clean_code(response), response
+        code, history = clean_code(response, return_history=True)
+        legacy_code, legacy_history = legacy_clean_code(response, return_history=True)
+        assert code == legacy_code
+        if history is None:
+            assert legacy_history is None
+            continue
+        assert [h[0] for h in history] == [h[0] for h in legacy_history]
+        assert replay_clean_history(history) == [h[1] for h in legacy_history]
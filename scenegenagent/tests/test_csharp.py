@@ -0,0 +1,42 @@
+from csharp import tokenize, check_declarations, check_placement_values
+
+head = '''string rootDir = TxApplication.SystemRootDirectory;
+string weldingLibPath = Path.Combine(rootDir, "Welding");
+string[] weldingModels = Directory.GetDirectories(weldingLibPath, "*.cojt", SearchOption.TopDirectoryOnly);
+List<DirectoryInfo> robotModels = new List<DirectoryInfo>();
+'''
+
+def declaration_errors(code):
+    diagnostics, _ = check_declarations(tokenize(head + code))
+    return diagnostics
+
+def test_accepts_queries_and_lambdas():
+    for code in [
+        'var names = from d in robotModels select d.Name;',
+        'var names = from DirectoryInfo d in robotModels where d.Name.Length > 3 orderby d.Name descending select d.Name;',
+        'var groups = from d in robotModels let n = d.Name group d by n into g select g.Key;',
+        'var pairs = from a in robotModels join b in robotModels on a.Name equals b.Name select new { a, b };',
+        'var names = robotModels.Where(d => d.Exists).Select((d, i) => d.Name + i).ToList();',
+        'foreach (var d in robotModels) { output.WriteLine(d.Name); }',
+        'var value = 1; double x = value * 2;',
+    ]:
+        assert declaration_errors(code) == [], code
+
+def test_rejects_undeclared_and_redeclared_variables():
+    assert declaration_errors('var names = from d in robotModels select e.Name;') == ["Line 5: `e` is used but not declared."]
+    assert declaration_errors('double x = y;') == ["Line 5: `y` is used but not declared."]
+    assert declaration_errors('double x = 1;\n{ double x = 2; }') == ["Line 6: the variable `x` is declared more than once."]
+
+def test_compact_rows_are_checked_by_name():
+    placement = [
+        {"name": "Cabinet", "position": "[0, 0, 0]", "orientation": "0 degrees"},
+        {"name": "Conveyor", "position": "[2000, 0, 0]", "orientation": "90 degrees"},
+    ]
+    rows = '''new { Models = cabinetModels, Name = "Cabinet", X = 0.0, Y = 0.0, Rot = 0.0 },
+new { Models = conveyorModels, Name = "Conveyor", X = 2000.0, Y = 0.0, Rot = 90.0 },'''
+    assert check_placement_values(rows, placement) == []
+    swapped = rows.replace('"Cabinet"', '"X"').replace('"Conveyor"', '"Cabinet"').replace('"X"', '"Conveyor"')
+    assert check_placement_values(swapped, placement) == [
+        "Line 1: Conveyor is placed at [0, 0, 0] rotated 0 degrees, but the placement puts it at [2000, 0, 0] rotated 90 degrees.",
+        "Line 2: Cabinet is placed at [2000, 0, 0] rotated 90 degrees, but the placement puts it at [0, 0, 0] rotated 0 degrees.",
+    ]
@@ -0,0 +1,26 @@
+from emitter import emit_code
+from cleaning import filter_code
+from catalog import guidance_index
+
+placement = [
+    {"name": "Kuka Robot KR125 1", "position": "[0, 0, 0]", "orientation": "0 degrees"},
+    {"name": "Kuka Robot KR125 2", "position": "[2000, -1500.5, 0]", "orientation": "90 degrees"},
+    {"name": "Welding Table", "position": "[1000, 2000, 0]", "orientation": "180 degrees"},
+    {"name": "Cabinet", "position": "[-3000, 0, 0]", "orientation": "45 degrees"},
+]
+
+def test_emitted_code_passes_filter_code():
+    for compact in [False, True]:
+        code = emit_code(placement, guidance_index.objects(), compact)
+        assert filter_code(code, return_reason=True, placement=placement) == (False, None), compact
+    compact_code = emit_code(placement, guidance_index.objects(), compact=True)
+    assert 'Name = "Kuka Robot KR125 2", X = 2000.0, Y = -1500.5, Rot = 90.0' in compact_code
+    # each model list is declared and filled once, however many objects use it
+    assert compact_code.count('List<DirectoryInfo> ') == 3
+
+def test_left_to_the_model():
+    guidance = guidance_index.objects()
+    assert emit_code(placement + [{"name": "Forklift", "position": "[0, 5000, 0]", "orientation": "0 degrees"}], guidance) is None
+    assert emit_code([dict(placement[0], orientation="towards the Cabinet")] + placement[1:], guidance) is None
+    assert emit_code([dict(placement[0], position="next to the table")], guidance) is None
+    assert emit_code([], guidance) is None
@@ -0,0 +1,12 @@
+import json
+from layout_analysis import parse_explicit_layout
+
+def test_coordinates_only():
+    objects, placement, text = parse_explicit_layout("A Cabinet is at [0, 0, 0]. A Conveyor is at [2000, 0, 0].")
+    assert json.loads(objects) == ["Cabinet", "Conveyor"]
+    assert [p["position"] for p in placement.to_placement()] == ["[0, 0, 0]", "[2000, 0, 0]"]
+
+def test_stated_distances_are_left_to_the_model():
+    for relation in ["0.5 m from", "500mm from", "50 cm away from", "2 meters from", "1500 millimeters from"]:
+        prompt = f"A Cabinet is at [0, 0, 0] which is {relation} the Conveyor at [2000, 0, 0]."
+        assert parse_explicit_layout(prompt) is None, prompt
@@ -0,0 +1,79 @@
+import json
+from budget import Budget
+from model import LocalModel
+from geometry import check_placement, covers_description
+from layout_analysis import assign_placement
+
+placement = [
+    {"name": "Cabinet", "position": "[0, 0, 0]", "orientation": "0 degrees"},
+    {"name": "Conveyor", "position": "[500, 0, 0]", "orientation": "0 degrees"},
+]
+
+def relation(text):
+    return json.dumps([{"object 1": "Cabinet", "relation": text, "object 2": "Conveyor"}])
+
+def placement_answer(positions, relations):
+    return '\n'.join([
+        '#Step 1: Rewrite Relative Position#', 'Analysis: a', 'New Relative Positions:', relations, '',
+        '#Step 2: Calculate Coordinates#', 'Analysis: b', 'Positions:', json.dumps(positions), '',
+        '#Step 3: Assign Positions#', 'Analysis: c', 'Positions:', json.dumps(positions),
+    ])
+
+def test_close_objects_overlap():
+    errors = check_placement(placement)
+    assert len(errors) == 1 and "is 500, which is not greater than 1000" in errors[0]
+
+def test_stated_short_distance_is_left_to_the_checker():
+    assert check_placement(placement, None, relation("0.5 m from")) == []
+    assert check_placement(placement, None, relation("500 mm in front of")) == []
+    assert len(check_placement(placement, None, relation("2 meters from"))) == 1
+
+def test_every_object_is_placed():
+    apart = [dict(placement[0]), dict(placement[1], position="[2000, 0, 0]")]
+    assert check_placement(apart, objects='["Cabinet", "Conveyor"]') == []
+    assert check_placement(apart, objects='["Cabinet", "Conveyor", "Turntable"]') == ["Turntable is in the object list, but it is not placed."]
+
+def test_only_coordinates_are_covered():
+    apart = [dict(placement[0]), dict(placement[1], position="[2000, 0, 0]")]
+    assert covers_description(apart, json.dumps(apart), '[]')
+    assert not covers_description(apart, json.dumps(apart), relation("2 meters from"))
+    assert not covers_description(apart, json.dumps(apart[:1]), '[]')
+    assert not covers_description(apart, json.dumps([apart[0], dict(apart[1], orientation="towards the Cabinet")]), '[]')
+
+def test_constraints_without_relations_are_checked(standin):
+    # "against the wall" is no relation between objects, but the checker still judges it
+    apart = [dict(placement[0]), dict(placement[1], position="[2000, 0, 0]")]
+
+    def respond(request):
+        if 'allocated positions' in request["messages"][0]["content"]:
+            return 'Relations: The Cabinet is against the wall.\nAnalysis: It is.\nError: No'
+        return placement_answer(apart, '[]')
+
+    model = LocalModel('standin', base_url=standin(respond).base_url)
+    budget = Budget(max_attempts=3)
+    prompt = "Keep the Cabinet against the wall, with a Conveyor next to it."
+    coords, _, _, _ = assign_placement(prompt, '["Cabinet", "Conveyor"]', '[]', '[]', model, model, model, budget)
+    assert coords.to_placement() == apart
+    assert budget.attempts == {"assign_placement": 1, "check_positional_error": 1}
+    # with every coordinate given, the local check covers the description
+    budget = Budget(max_attempts=3)
+    prompt = "The Cabinet is at [0, 0, 0] and the Conveyor is at [2000, 0, 0]."
+    coords, _, _, _ = assign_placement(prompt, '["Cabinet", "Conveyor"]', json.dumps(apart), '[]', model, model, model, budget)
+    assert coords.to_placement() == apart
+    assert budget.attempts == {"assign_placement": 1}
+
+def test_assign_placement_with_a_stated_short_distance(standin):
+    prompt = "The Cabinet is 0.5 m from the Conveyor."
+    answer = placement_answer(placement, relation("0.5 m from"))
+
+    def respond(request):
+        if 'allocated positions' in request["messages"][0]["content"]:
+            return 'Relations: The Cabinet is 0.5 m from the Conveyor.\nAnalysis: They are 500 mm apart.\nError: No'
+        return answer
+
+    model = LocalModel('standin', base_url=standin(respond).base_url)
+    budget = Budget(max_attempts=3)
+    coords, _, _, failed_rounds = assign_placement(prompt, '["Cabinet", "Conveyor"]', '[]', relation("0.5 m from"), model, model, model, budget)
+    assert coords.to_placement() == placement
+    assert failed_rounds == 0
+    assert budget.attempts == {"assign_placement": 1, "check_positional_error": 1}
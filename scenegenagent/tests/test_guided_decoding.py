@@ -0,0 +1,51 @@
+import re
+import json
+import asyncio
+import pytest
+from budget import Budget
+from model import LocalModel
+from schemas import guided_decoding_modes, list_objects_format
+from layout_analysis import list_objects, list_objects_async
+
+answer = {
+    "step_1_analysis": "The description mentions a cabinet and two robots.",
+    "step_1_objects": ["cabinet", "robot", "robot"],
+    "step_2_analysis": "The names are fixed to the catalog.",
+    "step_2_objects": ["Cabinet", "Robot", "Robot"],
+    "step_3_analysis": "The object names are replaced.",
+    "new_description": "Place a Cabinet between two Robots.",
+}
+
+def respond(request):
+    # a JSON answer for the JSON modes, and the step text otherwise
+    if "guided_json" in request or "response_format" in request:
+        return answer
+    return list_objects_format.render(answer)
+
+def standin_model(standin, mode):
+    model = LocalModel('standin', base_url=standin(respond).base_url)
+    model.guided_decoding = mode
+    return model
+
+@pytest.mark.parametrize("mode", [None] + guided_decoding_modes)
+def test_list_objects(standin, mode):
+    budget = Budget(max_attempts=2)
+    objects, description, analysis = list_objects("Place a cabinet between two robots.", standin_model(standin, mode), budget)
+    assert json.loads(objects) == ["Cabinet", "Robot", "Robot"]
+    assert description == "Place a Cabinet between two Robots."
+    assert len(analysis) == 3
+    assert budget.attempts == {"retrieve_objects": 1}
+    assert budget.parse_failures == {}
+
+@pytest.mark.parametrize("mode", guided_decoding_modes)
+def test_list_objects_async(standin, mode):
+    budget = Budget(max_attempts=2)
+    objects, _, _ = asyncio.run(list_objects_async("Place a cabinet between two robots.", standin_model(standin, mode), budget))
+    assert json.loads(objects) == ["Cabinet", "Robot", "Robot"]
+    assert budget.parse_failures == {}
+
+def test_object_lists_stay_on_one_line():
+    text = list_objects_format.render(answer)
+    assert '\nObjects: ["Cabinet", "Robot", "Robot"]\n' in text
+    assert re.fullmatch(list_objects_format.regex(), text) is not None
+    assert re.fullmatch(list_objects_format.regex(), text.replace('["Cabinet", ', '[\n    "Cabinet",\n    ')) is None
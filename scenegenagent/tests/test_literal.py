@@ -0,0 +1,23 @@
+import ast
+from literal import parse_literal
+
+def test_accepts_python_literals_like_eval():
+    for text in [
+        "[{'name': 'Cabinet', 'position': '[0, 0, 0]'}]",
+        "[{'name': 'Cabinet', 'position': [0, 0, 0],},]",
+        '[{"name": "Cabinet", "valid": True, "orientation": None}, ("a", 1.5)]',
+        "{'name': \"it's\", 'size': -2.5e3}",
+    ]:
+        assert parse_literal(text) == ast.literal_eval(text.replace("(", "[").replace(")", "]")), text
+
+def test_accepts_comments_and_trailing_commas():
+    text = """[
+    // the cabinet first
+    {'name': 'Cabinet', 'position': '[0, 0, 0]',},  // at the origin
+    {"name": "Conveyor", "position": "[2000, 0, 0]"},
+]"""
+    assert parse_literal(text) == [
+        {"name": "Cabinet", "position": "[0, 0, 0]"},
+        {"name": "Conveyor", "position": "[2000, 0, 0]"},
+    ]
+    assert parse_literal("{'url': 'http://host//path', # a comment\n 'n': 1,}") == {"url": "http://host//path", "n": 1}
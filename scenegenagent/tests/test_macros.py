@@ -0,0 +1,52 @@
+import json
+import pytest
+from layout_analysis import expand_arrangements, parse_coordinates
+
+def positions(placement):
+    return [(p["name"], p["position"], p.get("orientation")) for p in placement]
+
+def test_rows_and_grids():
+    row = {"name": "Cabinet", "arrangement": "row", "count": 3, "origin": "[0, 0, 0]", "spacing": "1500 mm", "heading": 90}
+    assert positions(expand_arrangements([row])) == [
+        ("Cabinet 1", "[0, 0, 0]", "0 degrees"), ("Cabinet 2", "[0, 1500, 0]", "0 degrees"), ("Cabinet 3", "[0, 3000, 0]", "0 degrees"),
+    ]
+    grid = {"name": "Cabinet", "arrangement": "grid", "rows": 2, "columns": 2, "origin": "[1000, 0, 0]", "spacing": "[2000, 3000, 0]", "orientation": "90 degrees"}
+    assert [p[1] for p in positions(expand_arrangements([grid]))] == ["[1000, 0, 0]", "[3000, 0, 0]", "[1000, 3000, 0]", "[3000, 3000, 0]"]
+
+def test_circles_face_their_center():
+    circle = {"name": "Kuka Robot KR125", "arrangement": "circle", "count": 4, "center": "[0, 0, 0]", "radius": 2000, "orientation": "towards the center"}
+    assert positions(expand_arrangements([circle])) == [
+        ("Kuka Robot KR125 1", "[2000, 0, 0]", "180 degrees"), ("Kuka Robot KR125 2", "[0, 2000, 0]", "270 degrees"),
+        ("Kuka Robot KR125 3", "[-2000, 0, 0]", "0 degrees"), ("Kuka Robot KR125 4", "[0, -2000, 0]", "90 degrees"),
+    ]
+
+def test_mirrors_continue_the_numbering():
+    placement = [
+        {"name": "Welding Table", "position": "[0, 0, 0]", "orientation": "0 degrees"},
+        {"name": "Cabinet 1", "position": "[1000, 2000, 0]", "orientation": "30 degrees"},
+        {"name": "Cabinet", "arrangement": "mirror", "of": "Cabinet", "across": "Welding Table", "axis": "x"},
+    ]
+    assert positions(expand_arrangements(placement))[-1] == ("Cabinet 2", "[1000, -2000, 0]", "330 degrees")
+    with pytest.raises(ValueError, match="Conveyor, which has no coordinate"):
+        expand_arrangements(placement[:2] + [dict(placement[2], across="Conveyor")])
+
+def test_incomplete_macros_are_explained():
+    with pytest.raises(ValueError, match='needs "count"'):
+        expand_arrangements([{"name": "Cabinet", "arrangement": "row", "origin": "[0, 0, 0]", "spacing": 1000}])
+    with pytest.raises(ValueError, match="should be row, grid, circle or mirror"):
+        expand_arrangements([{"name": "Cabinet", "arrangement": "spiral"}])
+
+def test_macros_are_only_expanded_when_enabled():
+    row = [{"name": "Cabinet", "arrangement": "row", "count": 2, "origin": "[0, 0, 0]", "spacing": 2000}]
+    text = '\n'.join([
+        '#Step 1: Rewrite Relative Position#', 'Analysis: a', 'New Relative Positions:', '[]', '',
+        '#Step 2: Calculate Coordinates#', 'Analysis: b', 'Positions:', json.dumps(row), '',
+        '#Step 3: Assign Positions#', 'Analysis: c', 'Positions:', json.dumps(row),
+    ])
+    assert parse_coordinates(text, '[]', use_macros=True).to_placement() == [
+        {"name": "Cabinet 1", "position": "[0, 0, 0]", "orientation": "0 degrees"},
+        {"name": "Cabinet 2", "position": "[2000, 0, 0]", "orientation": "0 degrees"},
+    ]
+    # without macros the entry is an object without a position, which the placement check rejects
+    scene = parse_coordinates(text, '[]')
+    assert scene.names == ["Cabinet"] and not scene.valid().any()
@@ -0,0 +1,21 @@
+from memo import StageMemo, set_stage_memo, memo_stats
+from code_gen import build_code_gen_prompt
+
+positions = [
+    {"name": "Cabinet", "position": "[0, 0, 0]", "orientation": "0 degrees"},
+    {"name": "Conveyor", "position": "[2000, 0, 0]", "orientation": "0 degrees"},
+]
+
+def test_code_gen_prompt_hits_return_their_own_sections():
+    set_stage_memo(StageMemo(16))
+    try:
+        prompt, sections = build_code_gen_prompt("A Cabinet and a Conveyor.", '["Cabinet", "Conveyor"]', positions, return_sections=True)
+        expected = dict(sections)
+        sections["prompt"] = "changed by the caller"
+        for _ in range(2):
+            hit_prompt, hit_sections = build_code_gen_prompt("A  Cabinet and a Conveyor.", '["Cabinet", "Conveyor"]', positions, return_sections=True)
+            assert hit_prompt == prompt and hit_sections == expected
+            hit_sections["prompt"] = "changed by the caller"
+        assert memo_stats()["code_gen_prompt"] == {"hits": 2, "misses": 1, "hit_rate": 2 / 3}
+    finally:
+        set_stage_memo(None)
@@ -0,0 +1,25 @@
+from placement_format import format_number, format_placement, parse_table, parse_placement, convert_placements
+from scene import Scene
+from geometry import format_position
+
+def test_numbers_are_plain_decimals():
+    assert [format_number(v) for v in [0, -0.4, 2000.0, 1e6, -1500]] == ['0', '0', '2000', '1000000', '-1500']
+    assert [format_number(v, 3) for v in [1e6, 45.5, -0.0001, 0.1 + 0.2]] == ['1000000', '45.5', '0', '0.3']
+    assert format_position([1e6, -2500.5, 0]) == '[1000000, -2500.5, 0]'
+
+placement = [
+    {"name": "Kuka Robot KR125 1", "position": "[0, 0, 0]", "orientation": "0 degrees"},
+    {"name": "Welding Table", "position": "[-2500, 1200, 0]", "orientation": "90 degrees"},
+    {"name": "Cabinet", "position": "[1000000, -3000, 0]", "orientation": "22.5 degrees"},
+    {"name": "Conveyor", "position": "[4000, 0, 0]", "orientation": "towards the Cabinet"},
+]
+
+def test_table_round_trip():
+    table = format_placement(placement, 'table')
+    assert table.split('\n')[:2] == ['name | x | y | orientation', 'Kuka Robot KR125 1 | 0 | 0 | 0']
+    assert parse_table(table) == placement
+    assert parse_placement(Scene.from_placement(placement).format('table')) == placement
+    # a response written in json and converted to the table reads back the same
+    response = 'Positions:\n' + format_placement(placement, 'json')
+    converted = convert_placements(response, 'table')
+    assert '|' in converted and parse_placement(converted[len('Positions:\n'):]) == placement
@@ -0,0 +1,23 @@
+from model import ReplicaPool, candidate_index
+from sampling import sample_candidates
+from budget import Budget
+from calls import call, no_calls
+
+request = {"messages": [{"role": "user", "content": "Place a Cabinet."}]}
+
+def test_rounds_stick_to_one_replica():
+    pool = ReplicaPool(["http://a/v1", "http://b/v1"], 'EMPTY', probe_interval=3600)
+    first = pool.acquire(request)
+    assert pool.acquire(request) is first
+
+def test_candidates_spread_over_replicas():
+    pool = ReplicaPool(["http://a/v1", "http://b/v1"], 'EMPTY', probe_interval=3600)
+
+    class Target:
+        def invoke(self, request, abort=None):
+            # holds its replica until the results are compared
+            return pool.acquire(request).base_url
+
+    accepted, rejected = sample_candidates(2, lambda: call(Target(), 'invoke', request), lambda output: no_calls((False, output)), 'assign_placement', Budget())
+    assert accepted is None and sorted(rejected) == ["http://a/v1", "http://b/v1"]
+    assert candidate_index.get() is None
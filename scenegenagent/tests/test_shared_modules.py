@@ -0,0 +1,25 @@
+import os
+import ast
+
+# sceneinstruct runs the layout stages with copies of these modules, which must not drift apart
+shared_modules = ['literal.py', 'steps.py', 'rules.py', 'placement_format.py', 'cache.py']
+root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def read(package, module):
+    with open(os.path.join(root, package, module), encoding='utf-8') as f:
+        return f.read()
+
+def function_source(source, name):
+    for node in ast.walk(ast.parse(source)):
+        if isinstance(node, ast.FunctionDef) and node.name == name:
+            return ast.dump(node)
+    return None
+
+def test_shared_modules_are_identical():
+    for module in shared_modules:
+        assert read('sceneinstruct', module) == read('scenegenagent', module), f"sceneinstruct/{module} differs from scenegenagent/{module}"
+
+def test_check_response_is_identical():
+    # the two model.py files differ, but accept the same responses
+    sources = [function_source(read(package, 'model.py'), 'check_response') for package in ['sceneinstruct', 'scenegenagent']]
+    assert sources[0] is not None and sources[0] == sources[1]
@@ -0,0 +1,43 @@
+from solver import solve_placement
+
+def relation(name_1, text, name_2):
+    return {"object 1": name_1, "relation": text, "object 2": name_2}
+
+def positions(placement):
+    return {p["name"]: p["position"] for p in placement}
+
+def test_solves_distances_and_directions():
+    placement = solve_placement(
+        ["Cabinet", "Conveyor", "Turntable"],
+        [{"name": "Conveyor", "position": "[1000, 0, 0]"}],
+        [relation("Cabinet", "2 meters in front of", "Conveyor"), relation("Turntable", "3 meters to the left of", "Cabinet")],
+    )
+    assert positions(placement) == {"Cabinet": "[3000, 0, 0]", "Conveyor": "[1000, 0, 0]", "Turntable": "[3000, 3000, 0]"}
+    # without coordinates the first object is the origin; consistent extra relations are fine
+    placement = solve_placement(
+        '["Cabinet", "Conveyor", "Turntable"]', '[]',
+        [relation("Cabinet", "2 meters in front of", "Conveyor"), relation("Conveyor", "2 meters in front of", "Turntable"),
+         relation("Cabinet", "4 meters in front of", "Turntable")],
+    )
+    assert positions(placement) == {"Cabinet": "[0, 0, 0]", "Conveyor": "[-2000, 0, 0]", "Turntable": "[-4000, 0, 0]"}
+
+def test_conflicting_relations_are_left_to_the_model():
+    assert solve_placement(["Cabinet", "Conveyor"], [], [
+        relation("Cabinet", "2 meters in front of", "Conveyor"), relation("Cabinet", "3 meters behind", "Conveyor"),
+    ]) is None
+    # a relation that contradicts the given coordinates
+    assert solve_placement(["Cabinet", "Conveyor"], [
+        {"name": "Cabinet", "position": "[0, 0, 0]"}, {"name": "Conveyor", "position": "[0, 2000, 0]"},
+    ], [relation("Cabinet", "2 meters in front of", "Conveyor")]) is None
+    assert solve_placement(["Cabinet", "Conveyor"], [], [relation("Cabinet", "near", "Conveyor")]) is None
+
+def test_without_relations_every_object_needs_a_coordinate():
+    coordinates = [
+        {"name": "Cabinet", "position": "[0, 0, 0]"},
+        {"name": "Conveyor", "position": "[3000, 0, 0]", "orientation": "90 degrees"},
+    ]
+    assert solve_placement(["Cabinet", "Conveyor"], coordinates, []) == [
+        {"name": "Cabinet", "position": "[0, 0, 0]", "orientation": "0 degrees"},
+        {"name": "Conveyor", "position": "[3000, 0, 0]", "orientation": "90 degrees"},
+    ]
+    assert solve_placement(["Cabinet", "Conveyor"], coordinates[:1], []) is None
@@ -0,0 +1,45 @@
+import random
+from steps import StepParser, add_line, add_block
+
+lines = [
+    '#Step 1: Find all objects#', '#Step 2', '#Step 3: x `y', '#Step x', '`#Step 4', '#Step 12 Positions: x',
+    'Analysis: foo', 'Analysis:', 'Analysis: `', 'Positions:', 'Positions: [1]', '``Positions:', ' Positions: no',
+    'Objects: ["a"]', 'New Relative Positions:', 'Relative Positions: q', 'New Description: d`e',
+    'text line', '', '```', 'a ` b', '`',
+]
+
+def sections_by_line(text):
+    # the sections as add_line builds them one line at a time; a final
+    # newline ends the last line rather than starting an empty one
+    steps, field = [], None
+    for line in text[:-1].split('\n') if text.endswith('\n') else text.split('\n'):
+        field = add_line(line, steps, field)
+    return steps
+
+def test_blocks_parse_like_lines():
+    rand = random.Random(0)
+    for _ in range(3000):
+        text = '\n'.join(rand.choice(lines) for _ in range(rand.randint(0, 12)))
+        assert StepParser(text).sections() == sections_by_line(text), text
+        # streamed in chunks, with the last line incomplete until the end
+        parser, end = StepParser(), 0
+        while end < len(text):
+            end += rand.randint(1, 10)
+            assert parser.update(text[:end]).sections() == sections_by_line(text[:end]), text[:end]
+
+def test_lines_and_block_agree():
+    text = '\n'.join([
+        '#Step 1: Rewrite Relative Position#', 'Analysis: The Cabinet is', 'in front.', 'New Relative Positions:', '[]', '',
+        '#Step 2: Calculate Coordinates#', 'Analysis: b', 'Positions:', '[{"name": "Cabinet",', ' "position": "[0, 0, 0]"}]', '',
+        '#Step 3: Assign Positions#', 'Positions:', '```json', '[]', '```', 'Analysis: after the fence',
+    ])
+    block = []
+    field = add_block(text, block, None)
+    assert block == sections_by_line(text) and field == 'Analysis'
+    assert block[0] == (1, {'Analysis': [' The Cabinet is', 'in front.'], 'New Relative Positions': ['', '[]', '']})
+    assert block[2] == (3, {'Positions': ['', ''], 'Analysis': [' after the fence']})
+
+def test_update_keeps_the_stream_parser():
+    parser = StepParser('#Step 3: Assign Positions#\nPositions:\n[]\n\n')
+    assert parser.update('#Step 3: Assign Positions#\nPositions:\n[]') is parser
+    assert parser.get(3, 'Positions') == '[]'
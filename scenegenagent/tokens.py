@@ -0,0 +1,31 @@
+import re
+
+# roughly one token per word or punctuation mark, for when no tokenizer is set
+re_piece = re.compile(r'\w+|[^\w\s]')
+
+def approximate_tokens(text):
+    return len(re_piece.findall(text))
+
+count_tokens = approximate_tokens
+
+def set_tokenizer(name=None):
+    # name of a Hugging Face tokenizer, e.g. the local model the prompts are sent to
+    global count_tokens
+    if name is None:
+        count_tokens = approximate_tokens
+        return
+    from transformers import AutoTokenizer
+    tokenizer = AutoTokenizer.from_pretrained(name)
+    count_tokens = lambda text: len(tokenizer.encode(text, add_special_tokens=False))
+
+def prompt_text(prompt):
+    # a prompt is either a string or a list of chat messages
+    if isinstance(prompt, str):
+        return prompt
+    return '\n'.join(m['content'] for m in prompt)
+
+def prompt_tokens(prompt):
+    return count_tokens(prompt_text(prompt))
+
+def section_tokens(sections):
+    return {name: count_tokens(text) for name, text in sections.items()}
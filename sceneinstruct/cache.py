@@ -0,0 +1,130 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import contextvars
+from typing import Any, Dict
+from openai.types.chat import ChatCompletion
+
+class CacheMiss(Exception):
+    pass
+
+# the sample a request belongs to, e.g. the id of a description in eval.py
+replay_scope = contextvars.ContextVar('replay_scope', default=None)
+
+# Identical requests may be sent several times on purpose, e.g. when a stage
+# regenerates after a parse failure, so the k-th occurrence of a request is
+# served by the k-th response stored for it. Occurrences are counted per
+# sample (replay_scope) and candidate, and the stage is part of the request,
+# so a replay serves the same responses whatever the order in which samples
+# run, with worker processes or interleaved with --use-async. Entries are
+# evicted least recently used first once max_entries or max_bytes is exceeded,
+# and entries older than max_age seconds are dropped. In readonly (replay) mode
+# nothing is written and a miss raises CacheMiss.
+class ResponseCache:
+    def __init__(self, path, max_entries=None, max_bytes=None, max_age=None, readonly=False):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.readonly = readonly
+        self.hits = 0
+        self.misses = 0
+        self.occurrences = {}
+        self.lock = threading.Lock()
+        self._conn = None
+        self._conn_pid = None
+        if not readonly and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        # sqlite connections must not cross a fork
+        if self._conn is None or self._conn_pid != os.getpid():
+            if self.readonly:
+                conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False, timeout=60)
+            else:
+                conn = sqlite3.connect(self.path, check_same_thread=False, timeout=60)
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("""CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT NOT NULL,
+                    idx INTEGER NOT NULL,
+                    response TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created REAL NOT NULL,
+                    accessed REAL NOT NULL,
+                    PRIMARY KEY (key, idx)
+                )""")
+                conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+                conn.commit()
+            self._conn = conn
+            self._conn_pid = os.getpid()
+        return self._conn
+
+    @staticmethod
+    def request_key(request: Dict[str, Any]) -> str:
+        request = {k: v for k, v in request.items() if k not in ['stream', 'timeout']}
+        return hashlib.sha256(json.dumps(request, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+    def get(self, request: Dict[str, Any], candidate=None):
+        key = self.request_key(request)
+        occurrence = (replay_scope.get(), candidate, key)
+        with self.lock:
+            idx = self.occurrences.get(occurrence, 0)
+            self.occurrences[occurrence] = idx + 1
+            row = self.conn.execute("SELECT response, created FROM responses WHERE key = ? AND idx = ?", (key, idx)).fetchone()
+            now = time.time()
+            if row is not None and self.max_age is not None and now - row[1] > self.max_age:
+                if not self.readonly:
+                    self.conn.execute("DELETE FROM responses WHERE key = ? AND idx = ?", (key, idx))
+                    self.conn.commit()
+                row = None
+            if row is None:
+                self.misses += 1
+                if self.readonly:
+                    raise CacheMiss(f"No cached response for request {key} (occurrence {idx})")
+                return (key, idx), None
+            self.hits += 1
+            if not self.readonly:
+                self.conn.execute("UPDATE responses SET accessed = ? WHERE key = ? AND idx = ?", (now, key, idx))
+                self.conn.commit()
+        return (key, idx), ChatCompletion.model_validate_json(row[0])
+
+    def put(self, cache_key, response: Any):
+        if self.readonly:
+            return
+        key, idx = cache_key
+        value = response.model_dump_json()
+        now = time.time()
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)", (key, idx, value, len(value), now, now))
+            self.evict()
+            self.conn.commit()
+
+    def evict(self):
+        if self.max_age is not None:
+            self.conn.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.max_age,))
+        if self.max_entries is not None:
+            self.conn.execute("""DELETE FROM responses WHERE rowid IN (
+                SELECT rowid FROM responses ORDER BY accessed DESC LIMIT -1 OFFSET ?
+            )""", (self.max_entries,))
+        if self.max_bytes is not None:
+            self.conn.execute("""DELETE FROM responses WHERE rowid IN (
+                SELECT rowid FROM (
+                    SELECT rowid, SUM(size) OVER (ORDER BY accessed DESC, rowid DESC) AS total FROM responses
+                ) WHERE total > ?
+            )""", (self.max_bytes,))
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            entries, size = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total > 0 else 0.0,
+            "entries": entries,
+            "bytes": size,
+        }
@@ -0,0 +1,25 @@
+import re
+
+item_list = ["Robot",
+             "Kuka Robot", "Kuka Robot KR125", "Kuka Robot KR350",
+             "ABB Robot", "ABB Robot IRB6600",
+             "YASKAWA Robot", "YASKAWA Robot ma01800",
+             "Table", "Welding Table", "Turntable", "Turntable",
+             "Guarding", "Cabinet", "ValveStand", "Conveyor"]
+
+permission_list = ["Kuka Robot KR125", "Kuka Robot KR350", "ABB Robot IRB6600", "YASKAWA Robot ma01800", "Welding Table", "Turntable", "Cabinet", "ValveStand", "Conveyor", "Guarding"]
+
+def compile_names(names, flags=0):
+    # one alternation for all names, longest first so that "Kuka Robot KR125" wins over "Kuka Robot"
+    names = sorted(set(names), key=len, reverse=True)
+    return re.compile('|'.join(re.escape(n) for n in names), flags)
+
+canonical_names = {i.lower(): i for i in item_list}
+re_item_names = compile_names(item_list, re.IGNORECASE)
+re_permitted = compile_names(permission_list)
+
+def standardize_names(text):
+    return re_item_names.sub(lambda m: canonical_names[m.group().lower()], text)
+
+def object_permitted(object):
+    return re_permitted.search(object) is not None
@@ -1,5 +1,7 @@
 import re
 import json
+from catalog import item_list, standardize_names
+from rules import normalize_units, filter_descriptions
 
 ##########
 # Prompt #
@@ -18,33 +20,6 @@ def contain_numbers(text):
     re_scalar = r'(?:^|\s)(\d+(\.\d+)?\s*m)'
     return bool(re.findall(re_coord, text)) or bool(re.findall(re_scalar, text))
 
-def base_filter(text):
-    if len(re.findall(r'[\u4e00-\u9fff]+', text)) > 0 or text == text.upper():
-        return True, "The description should only contain English in proper upper and lower cases."
-    return False, None
-
-def vertical_nonzero(text):
-    matches = re.findall(r'(\[[-\d\s.m]+\s*,\s*[-\d\s.m]+\s*,\s*([-\d\s.m]+)\])', text)
-    for match in matches:
-        if match[-1] not in ['0', '0.0', '0m', '0.0m', '0mm', '0.0mm']:
-            return True, "The z-coordinates should be 0."
-    return False, None
-
-def contain_invalid_coordinate(text):
-    matches = re.findall(r'(\[[^\[]+\s*,\s*[^\[]+\s*(,\s*[^\[]+)?\])', text)
-    re_coord = r'^\[-?\d+(\.\d+)?\s*(m|mm)?\s*,\s*-?\d+(\.\d+)?\s*(m|mm)?\s*(,\s*-?\d+(\.\d+)?\s*(m|mm)?)?\]$'
-    for match in matches:
-        if not re.match(re_coord, match[0]):
-            return True, "The coordinates should contain three values in millimeters in the form of [x, y, 0] with x and y being specific numbers."
-    return False, None
-
-def contain_ban_words(text):
-    text = text.lower()
-    ban_words = [re.findall(w, text)[0] for w in ['\n', 'without', 'instead', r'(?:\s|^)[nN]ot(?:\s|$|\.|,)', r'(?:\s|^)[nN]ow(?:\s|$|\.|,)', r'(?:\s|^)[nN]o(?:\s|$|\.|,)', 'east', 'west', 'north', 'south', 'workbench', 'euclid'] if len(re.findall(w, text)) > 0]
-    if len(ban_words) > 0:
-        return True, f"The description should not contain these words: {ban_words}"
-    return False, None
-
 check_relative_position_prompt = """You are given a description of a workstation, which is used to build a scene in Process Simulate (PS).
 The description includes several objects and their positions. The description is as follows:
 ```
@@ -139,87 +114,22 @@ def prompt_contain_positional_error(text, model):
 
 def filter_prompt(text, model):
     assert text
-    filter_reasons = []
-    for func in [
-        base_filter,
-        vertical_nonzero,
-        contain_invalid_coordinate,
-        contain_ban_words,
-    ]:
-        should_filter, filter_reason = func(text)
-        if should_filter:
-            filter_reasons.append(filter_reason)
-    if len(filter_reasons) > 0:
-        return True, '\n'.join(filter_reasons)
+    should_filter, filter_reason = filter_descriptions([text])[0]
+    if should_filter:
+        return True, filter_reason
     should_filter, filter_reason = prompt_contain_positional_error(text, model)
     if should_filter:
         return True, filter_reason
     return False, None
 
-def change_units(text):
-    text = text.replace('(', '[').replace(')', ']')
-    # remove mm unit outside coord
-    matches = re.findall(r'(\[-?\d+(\.\d+)?,\s*-?\d+(\.\d+)?(,\s*-?\d+(\.\d+)?)?\]\s*(mm| millimeters))', text)
-    for match in matches:
-        value = match[0]
-        value = re.sub(r'\s*mm', '', value).strip()
-        value = re.sub(r'\s*millimeters', '', value).strip()
-        text = text.replace(match[0], value)
-    # convert [x m, y m] to [x * 1000, y * 1000]
-    matches = re.findall(r'(\[(-?\d+(?:\.\d+)?)\s*m,\s*(-?\d+(?:\.\d+)?)\s*m\])', text)
-    for match in matches:
-        value = f"[{int(float(match[1]) * 1000)}, {int(float(match[2]) * 1000)}]"
-        text = text.replace(match[0], value)
-    # convert [x m, y m, z m] to [x * 1000, y * 1000, z * 1000]
-    matches = re.findall(r'(\[(-?\d+(?:\.\d+)?)\s*m,\s*(-?\d+(?:\.\d+)?)\s*m,\s*(-?\d+(?:\.\d+)?)\s*m?\])', text)
-    for match in matches:
-        value = f"[{int(float(match[1]) * 1000)}, {int(float(match[2]) * 1000)}, {int(float(match[3]) * 1000)}]"
-        text = text.replace(match[0], value)
-    # remove mm unit inside coord
-    matches = re.findall(r'(\[(-?\d+(?:\.\d+)?)\s*mm,\s*(-?\d+(?:\.\d+)?)\s*mm(,\s*(-?\d+(?:\.\d+)?)\s*mm)?\])', text)
-    for match in matches:
-        value = re.sub(r'\s*mm', '', match[0]).strip()
-        text = text.replace(match[0], value)
-    # replace cm with m in plain text
-    matches = re.findall(r'(\d+(\.\d+)?\s*(?:cm|centimeters))', text)
-    for match in matches:
-        value = match[0]
-        value = re.sub(r'cm|centimeters', '', value).strip()
-        value = float(value) / 100
-        text = text.replace(match[0], str(value) + ' meters')
-    # add zero to z-axis
-    matches = re.findall(r'(\[(-?\d+(?:\.\d+)?)\s*,\s*(-?\d+(?:\.\d+)?)\s*\])', text)
-    for match in matches:
-        value = match[0][:-1].rstrip() + ', 0]'
-        text = text.replace(match[0], value)
-    # change z-axis to zero
-    matches = re.findall(r'(\[-?\d+(?:\.\d+)?\s*,\s*-?\d+(?:\.\d+)?\s*,\s*(-?\d+(?:\.\d+)?\s*\]))', text)
-    for match in matches:
-        value = re.sub(match[1], '0]', match[0]).strip()
-        text = text.replace(match[0], value)
-    # reformat coords
-    matches = re.findall(r'(\[\s*(-?\d+(?:\.\d+)?)\s*,\s*(-?\d+(?:\.\d+)?)\s*,\s*(-?\d+(?:\.\d+)?)\s*\])', text)
-    for match in matches:
-        value = f"[{match[1]}, {match[2]}, {match[3]}]"
-        text = text.replace(match[0], value)
-    return text
-
 def rule_clean(text):
-    text = change_units(text)
+    text = normalize_units(text)
     text = text.lstrip(".\"' ").rstrip("\"' ")
     text = text.replace('"', '').replace("'", "")
     return text.strip()
 
-item_list = ["Robot", 
-             "Kuka Robot", "Kuka Robot KR125", "Kuka Robot KR350", 
-             "ABB Robot", "ABB Robot IRB6600", 
-             "YASKAWA Robot", "YASKAWA Robot ma01800", 
-             "Table", "Welding Table", "Turntable", "Turntable", 
-             "Guarding", "Cabinet", "ValveStand", "Conveyor"]
-
 def standardize_name(text):
-    for item in item_list:
-        text = re.sub(item, item, text, flags=re.IGNORECASE)
+    text = standardize_names(text)
     return text.strip()
 
 def clean_prompt(text):
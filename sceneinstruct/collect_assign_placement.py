@@ -5,9 +5,11 @@ from tqdm import tqdm
 from argparse import ArgumentParser
 from layout_analysis import assign_placement
 from model import ChatGPT
+from cache import ResponseCache
+from placement_format import convert_placements, placement_formats
 
-def worker(id, data, input_path, max_id_assign_placement, max_id_check_positional_error, max_id_fix_positional_error):
-    model = ChatGPT()
+def worker(id, data, input_path, max_id_assign_placement, max_id_check_positional_error, max_id_fix_positional_error, cache_path=None, cache_replay=False, placement_format='json'):
+    model = ChatGPT(cache=ResponseCache(cache_path, readonly=cache_replay) if cache_path else None)
     output_path_assign_placement = input_path.replace('.jsonl', '_assign_placement.jsonl')
     output_path_check_positional_error = input_path.replace('.jsonl', '_check_positional_error.jsonl')
     output_path_fix_positional_error = input_path.replace('.jsonl', '_fix_positional_error.jsonl')
@@ -16,6 +18,14 @@ def worker(id, data, input_path, max_id_assign_placement, max_id_check_positiona
          open(output_path_fix_positional_error.replace('.json', f'_{id}.json'), 'w', encoding='utf-8') as f_fix_positional_error:
         for d in tqdm(data):
             coords_final, model_output_assign_placement, analysis, failed_rounds, model_input_assign_placement, positional_error_list, fix_error_list = assign_placement(d['prompt'], d['objects'], d['coordinates'], d['relations'], model)
+            # store the samples in the placement format the model will be trained on
+            model_input_assign_placement = convert_placements(model_input_assign_placement, placement_format)
+            model_output_assign_placement = convert_placements(model_output_assign_placement, placement_format)
+            for positional_error in positional_error_list:
+                positional_error['model_input'] = convert_placements(positional_error['model_input'], placement_format)
+            for fix_error in fix_error_list:
+                fix_error['model_input'] = [{**m, 'content': convert_placements(m['content'], placement_format)} for m in fix_error['model_input']]
+                fix_error['model_output'] = convert_placements(fix_error['model_output'], placement_format)
             with max_id_assign_placement.get_lock():
                 max_id_assign_placement.value += 1
                 d_assign_placement = {
@@ -54,6 +64,9 @@ if __name__ == '__main__':
     parser = ArgumentParser()
     parser.add_argument("--input-path", type=str, default="data_prompt_extract_layout.jsonl")
     parser.add_argument("--save-prefix", type=str, default="data_prompt")
+    parser.add_argument("--cache-path", type=str, default=None, help="SQLite file to cache model responses in")
+    parser.add_argument("--cache-replay", action="store_true", help="Only serve responses from the cache and fail on misses")
+    parser.add_argument("--placement-format", type=str, default="json", choices=placement_formats, help="Format of the placements in the saved prompts and responses")
 
     args = parser.parse_args()
     data = list(map(json.loads, open(args.input_path, encoding='utf-8').readlines()))
@@ -69,7 +82,7 @@ if __name__ == '__main__':
     max_id_fix_positional_error = Value('i', 0)
     processes = []
     for i in range(num_workers):
-        p = Process(target=worker, args=(i, data_workers[i], output_path, max_id_assign_placement, max_id_check_positional_error, max_id_fix_positional_error))
+        p = Process(target=worker, args=(i, data_workers[i], output_path, max_id_assign_placement, max_id_check_positional_error, max_id_fix_positional_error, args.cache_path, args.cache_replay, args.placement_format))
         p.start()
         processes.append(p)
 
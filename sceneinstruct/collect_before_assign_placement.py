@@ -6,9 +6,10 @@ from tqdm import tqdm
 from argparse import ArgumentParser
 from layout_analysis import retrieve_objects, extract_layout
 from model import LocalModel
+from cache import ResponseCache
 
-def worker(id, data, input_path):
-    model_local = LocalModel('<model-checkpoint-path>')
+def worker(id, data, input_path, cache_path=None, cache_replay=False):
+    model_local = LocalModel('<model-checkpoint-path>', cache=ResponseCache(cache_path, readonly=cache_replay) if cache_path else None)
     output_path_retrieve_objects = input_path.replace('.jsonl', '_retrieve_objects.jsonl')
     output_path_extract_layout = input_path.replace('.jsonl', '_extract_layout.jsonl')
     with open(output_path_retrieve_objects.replace('.json', f'_{id}.json'), 'w', encoding='utf-8') as f_retrieve_objects, \
@@ -42,6 +43,8 @@ def worker(id, data, input_path):
 if __name__ == '__main__':
     parser = ArgumentParser()
     parser.add_argument("--input-path", type=str, default="data_prompt.jsonl")
+    parser.add_argument("--cache-path", type=str, default=None, help="SQLite file to cache model responses in")
+    parser.add_argument("--cache-replay", action="store_true", help="Only serve responses from the cache and fail on misses")
 
     args = parser.parse_args()
     data = list(map(json.loads, open(args.input_path, encoding='utf-8').readlines()))
@@ -53,7 +56,7 @@ if __name__ == '__main__':
 
     processes = []
     for i in range(num_workers):
-        p = Process(target=worker, args=(i, data_workers[i], args.input_path))
+        p = Process(target=worker, args=(i, data_workers[i], args.input_path, args.cache_path, args.cache_replay))
         p.start()
         processes.append(p)
 
@@ -1,11 +1,20 @@
 import re
 import json
 import traceback
-from typing import List
+from catalog import permission_list, object_permitted
 from cleaning import clean_prompt, contain_positional_error
+from placement_format import parse_placement_list
+from steps import parse_steps
 
-def re_find(regex, text):
-    return targets[0] if len(targets := re.findall(regex, text)) > 0 else None
+def parse_analysis(text, step_names):
+    # the analysis of step i + 1 for each name
+    steps = parse_steps(text)
+    analysis = []
+    for i, step_name in enumerate(step_names):
+        as1 = steps.get(i + 1, 'Analysis')
+        if as1:
+            analysis.append((step_name, as1))
+    return analysis
 
 ### retrieve objects
 prompt_fix_objects = """You are given a description of a workstation, which is used to build a scene in Process Simulate (PS).
@@ -48,29 +57,16 @@ New Description: <new description>
 Do not say anything else."""
 
 def list_objects(text, model_retrieve_objects):
-    def parse_analysis(text):
-        analysis = []
-        re_steps = [
-            r'#Step 1:[\s\S]+?\nAnalysis:\s*([\s\S]*?)\s*\nObjects:',
-            r'#Step 2:[\s\S]+?\nAnalysis:\s*([\s\S]*?)\s*\nObjects:',
-            r'#Step 3:[\s\S]+?\nAnalysis:\s*([\s\S]*?)\s*\nNew Description:',
-        ]
-        step_names = ['Find all objects', 'Fix object names', 'Rewrite description']
-        for re_step, step_name in zip(re_steps, step_names):
-            as1 = re_find(re_step, text)
-            if as1:
-                analysis.append((step_name, as1))
-        return analysis
-
     model_input = prompt_fix_objects.format(prompt=text)
     while True:
         text = model_retrieve_objects.generate(model_input)
-        obj_lists = re.findall(r"Objects:\s*(\[.*?\])", text)
-        descriptions = [l for l in re.findall(r'New Description:\s*([\s\S]*?)(?:$|`)', text)]
+        steps = parse_steps(text)
+        obj_lists = [m.group() for objects in steps.values('Objects') for m in [re.match(r'\[.*?\]', objects, re.DOTALL)] if m is not None]
+        descriptions = steps.values('New Description')
         if len(obj_lists) > 0 and len(descriptions) > 0:
             print("Objects:", text)
             print()
-            analysis = parse_analysis(text)
+            analysis = parse_analysis(steps, ['Find all objects', 'Fix object names', 'Rewrite description'])
             return obj_lists[-1], descriptions[-1], analysis, model_input, text
 
 standard_item_name = """The objects in the description must be from the list: {item_list}.
@@ -159,17 +155,11 @@ Relative Positions:
 Do not say anything else."""
 
 def parse_placement(text):
+    steps = parse_steps(text)
     ocr = []
-    for re_ocr in [
-        r"#Step 1:[\s\S]+?\nObjects:\s*([\s\S]*?)\s*#Step 2",
-        r"#Step 2:[\s\S]+?\nPositions:\s*([\s\S]*?)\s*#Step 3",
-        r"#Step 3:[\s\S]+?\nRelative Positions:\s*([\s\S]*?)\s*(?:`|$)",
-    ]:
-        o = re.findall(re_ocr, text)
-        if len(o) == 0:
-            o = None
-        else:
-            o = o[0]
+    for step, label in [(1, 'Objects'), (2, 'Positions'), (3, 'Relative Positions')]:
+        o = steps.get(step, label)
+        if o is not None:
             startpos, endpos = o.find('['), o.rfind(']')
             o = None if startpos == -1 or endpos == -1 or startpos >= endpos else o[startpos:endpos + 1]
             if o:
@@ -182,28 +172,15 @@ def parse_placement(text):
     return o, c, r
 
 def extract_layout(text, objects, model_extract_layout):
-    def parse_analysis(text):
-        analysis = []
-        re_steps = [
-            r'#Step 1:[\s\S]+?\nAnalysis:\s*([\s\S]*?)\s*\nObjects:',
-            r'#Step 2:[\s\S]+?\nAnalysis:\s*([\s\S]*?)\s*\nPositions:',
-            r'#Step 3:[\s\S]+?\nAnalysis:\s*([\s\S]*?)\s*\nRelative Positions:',
-        ]
-        step_names = ['Identify Objects', 'Absolute Positions', 'Relative Positions']
-        for re_step, step_name in zip(re_steps, step_names):
-            as1 = re_find(re_step, text)
-            if as1:
-                analysis.append((step_name, as1))
-        return analysis
-
     model_input = prompt_extract_layout.format(prompt=text, objects=objects)
     while True:
         model_output = model_extract_layout.generate(model_input)
-        o, c, r = parse_placement(model_output)
+        steps = parse_steps(model_output)
+        o, c, r = parse_placement(steps)
         if o and c and r:
             print("Positions:", model_output)
             print()
-            analysis = parse_analysis(model_output)
+            analysis = parse_analysis(steps, ['Identify Objects', 'Absolute Positions', 'Relative Positions'])
             return model_output, o, c, r, analysis, model_input
 
 ### assign placement
@@ -279,36 +256,22 @@ Positions:
 Do not say anything else.
 """
 
-permission_list = ["Kuka Robot KR125", "Kuka Robot KR350", "ABB Robot IRB6600", "YASKAWA Robot ma01800", "Welding Table", "Turntable", "Cabinet", "ValveStand", "Conveyor", "Guarding"]
-def object_permitted(object):
-    for p in permission_list:
-        if p in object:
-            return True
-    return False
-
 def parse_coordinates(text, coordinates):
+    steps = parse_steps(text)
     coords = []
-    for re_coord in [
-        r"#Step 2:[\s\S]+?\nPositions:\s*([\s\S]*?)\s*(?:`|#Step 3)",
-        r"#Step 3:[\s\S]+?\nPositions:\s*([\s\S]*?)\s*(?:`|$)",
-    ]:
-        coord = re.findall(re_coord, text)
-        if len(coord) == 0:
-            coord = None
-        else:
-            coord = coord[0]
-            startpos, endpos = coord.find('['), coord.rfind(']')
-            coord = None if startpos == -1 or endpos == -1 or startpos >= endpos else coord[startpos:endpos + 1]
+    for step in [2, 3]:
+        coord = steps.get(step, 'Positions')
+        if coord is not None:
+            coord = parse_placement_list(coord)
         coords.append(coord)
     coord_1, coord_2 = coords[0], coords[1]
     if coord_1 is None or coord_2 is None:
         return None
     try:
-        coord_1, coord_2 = eval(coord_1.strip().replace('//', '#')), eval(coord_2.strip().replace('//', '#'))
-        assert isinstance(coord_1, List) and isinstance(coord_2, List)
         coords = {}
-        for cs in [json.loads(coordinates), coord_1, coord_2]:
+        for cs in [json.loads(coordinates) if isinstance(coordinates, str) else coordinates, coord_1, coord_2]:
             for c in cs:
+                c = dict(c)
                 name = c.pop('name')
                 if object_permitted(name):
                     coords[ name ] = c
@@ -326,25 +289,12 @@ Please write the response again, fixing the errors.
 Only generate the response. Do not say anything else."""
 
 def assign_placement(prompt, objects, coordinates, relations, model):
-    def parse_analysis(text):
-        analysis = []
-        re_steps = [
-            r'#Step 1:[\s\S]+?\nAnalysis:\s*([\s\S]*?)\s*\nNew Relative Positions:',
-            r'#Step 2:[\s\S]+?\nAnalysis:\s*([\s\S]*?)\s*\nPositions:',
-            r'#Step 3:[\s\S]+?\nAnalysis:\s*([\s\S]*?)\s*\nPositions:',
-        ]
-        step_names = ['Rewrite Relative Position', 'Calculate Coordinates', 'Assign Coordinates']
-        for re_step, step_name in zip(re_steps, step_names):
-            as1 = re_find(re_step, text)
-            if as1:
-                analysis.append((step_name, as1))
-        return analysis
-    
     model_input_assign_placement = prompt_assign_placement.format(prompt=prompt, objects=objects, coordinates=coordinates, relations=relations)
     messages = [{
         "role": "user",
         "content": model_input_assign_placement
     }]
+    known = json.loads(coordinates)
     coords_final = None
     failed_rounds = 0
     positional_error_list = []
@@ -354,10 +304,11 @@ def assign_placement(prompt, objects, coordinates, relations, model):
             # generate until valid coordinates appear
             while True:
                 model_output_assign_placement = model.invoke(messages)
-                coords = parse_coordinates(model_output_assign_placement, coordinates)
+                steps = parse_steps(model_output_assign_placement)
+                coords = parse_coordinates(steps, known)
                 if coords is not None:
                     print("Coordinates:", model_output_assign_placement)
-                    analysis = parse_analysis(model_output_assign_placement)
+                    analysis = parse_analysis(steps, ['Rewrite Relative Position', 'Calculate Coordinates', 'Assign Coordinates'])
                     break
             should_filter, filter_reason, model_input_check_positional_error, model_output_check_positional_error = contain_positional_error(prompt, coords, model)
             positional_error_list.append({
@@ -0,0 +1,114 @@
+import re
+import ast
+import json
+
+# A tolerant parser for the lists and objects the models write: JSON, Python
+# literals (single quotes, True/None, tuples) and the usual slips of both,
+# i.e. // # and /* */ comments, trailing commas, missing commas between items
+# and bare keys. Unlike eval it never runs the text, and the parsing itself is
+# always done by json.loads. Strict JSON goes straight to it. Otherwise the
+# common slips are cut out at the few places they occur, and only text that
+# still fails is rewritten token by token.
+
+re_comment = r'//[^\n]*|\#[^\n]*|/\*[\s\S]*?\*/'
+re_json_string = r'"[^"\\\n]*(?:\\.[^"\\\n]*)*"'
+re_python_string = r"'[^'\\\n]*(?:\\.[^'\\\n]*)*'"
+re_strings = re.compile(re_json_string + '|' + re_python_string)
+# after the end of a value, the start of the next one without a comma between
+re_gap = r'''(?=(?:\s|''' + re_comment + r''')*[{\[("'])'''
+re_number = r'(?<![\w.])-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?'
+
+re_repair = re.compile(r'''
+    (?P<plain>[\s\[{:]+)
+  | (?P<json_string>''' + re_json_string + r'''(?P<json_string_gap>''' + re_gap + r''')?)
+  | (?P<python_string>''' + re_python_string + r'''(?P<python_string_gap>''' + re_gap + r''')?)
+  | (?P<comment>''' + re_comment + r''')
+  | (?P<trailing_comma>,(?=(?:\s|''' + re_comment + r''')*[\]})]))
+  | (?P<key>\b[A-Za-z_]\w*\b)(?=\s*:)
+  | (?P<word>\b(?:True|False|None)\b(?P<word_gap>''' + re_gap + r''')?)
+  | (?P<number>''' + re_number + r'''(?P<number_gap>''' + re_gap + r''')?)
+  | (?P<open>\()
+  | (?P<close>[)}\]](?P<close_gap>''' + re_gap + r''')?)
+''', re.VERBOSE)
+
+words = {'True': 'true', 'False': 'false', 'None': 'null'}
+parens = {'(': '[', ')': ']'}
+gap_groups = [g for g in re_repair.groupindex if g.endswith('_gap')]
+# the slips that are cut out directly, with the text that signals them; each
+# is searched on its own, as one alternation of them all is several times slower
+slips = [
+    ('comment', ['//', '#', '/*'], re.compile(re_comment)),
+    ('trailing_comma', [','], re.compile(r',(?=(?:\s|' + re_comment + r')*[\]}])')),
+    ('word', list(words), re.compile(r'(?:True|False|None)\b')),
+    ('paren', list(parens), re.compile(r'[()]')),
+]
+
+class LiteralError(ValueError):
+    pass
+
+def in_string(text, pos):
+    # strings do not span lines, so an unmatched quote before pos on its line means pos is inside one
+    line = text[text.rfind('\n', 0, pos) + 1:pos]
+    if '"' not in line and "'" not in line:
+        return False
+    line = re_strings.sub('', line)
+    return '"' in line or "'" in line
+
+def cut_slips(text):
+    if "'" in text and '"' not in text and '\\' not in text:
+        # python strings without escapes or double quotes inside
+        text = text.replace("'", '"')
+    matches = []
+    for kind, markers, pattern in slips:
+        if any(marker in text for marker in markers):
+            matches.extend((m.start(), m.end(), kind, m.group()) for m in pattern.finditer(text))
+    parts, last = [], 0
+    for start, end, kind, slip in sorted(matches):
+        if start < last or kind == 'word' and start > 0 and (text[start - 1].isalnum() or text[start - 1] == '_') or in_string(text, start):
+            continue
+        parts.append(text[last:start])
+        if kind == 'word':
+            parts.append(words[slip])
+        elif kind == 'paren':
+            parts.append(parens[slip])
+        last = end
+    parts.append(text[last:])
+    return ''.join(parts)
+
+def repair(m):
+    kind = m.lastgroup
+    text = m.group()
+    if kind == 'python_string':
+        try:
+            text = json.dumps(ast.literal_eval(text), ensure_ascii=False)
+        except (ValueError, SyntaxError):
+            raise LiteralError(f"invalid string at {m.start()}")
+    elif kind == 'key':
+        text = '"' + text + '"'
+    elif kind == 'word':
+        text = words[text]
+    elif kind in ['open', 'close']:
+        text = parens.get(text, text)
+    elif kind in ['comment', 'trailing_comma']:
+        text = ''
+    if kind + '_gap' in gap_groups and m.group(kind + '_gap') is not None:
+        # the missing comma goes after the value
+        text += ','
+    return text
+
+def to_json(text):
+    return re_repair.sub(repair, text)
+
+def parse_literal(text):
+    try:
+        return json.loads(text)
+    except ValueError:
+        pass
+    try:
+        return json.loads(cut_slips(text))
+    except ValueError:
+        pass
+    try:
+        return json.loads(to_json(text))
+    except ValueError as e:
+        raise LiteralError(str(e))
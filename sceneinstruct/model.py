@@ -1,8 +1,45 @@
+import os
+import threading
 from typing import (
     Any,
     Dict,
 )
-from openai import OpenAI
+import httpx
+from openai import OpenAI, DefaultHttpxClient
+from cache import ResponseCache
+
+# Clients are shared by every Model pointing at the same endpoint, so that
+# connections are pooled and kept alive across Model instances.
+pool_limits = {
+    "max_connections": 256,
+    "max_keepalive_connections": 64,
+    "keepalive_expiry": 60.0,
+}
+_clients = {}
+_clients_lock = threading.Lock()
+
+def set_pool_limits(**kwargs):
+    with _clients_lock:
+        pool_limits.update(kwargs)
+
+def get_client(base_url, api_key):
+    key = (base_url, api_key)
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = OpenAI(
+                api_key=api_key,
+                base_url=base_url,
+                http_client=DefaultHttpxClient(limits=httpx.Limits(**pool_limits)),
+            )
+        return _clients[key]
+
+def _reset_clients():
+    global _clients_lock
+    _clients_lock = threading.Lock()
+    _clients.clear()
+
+# connections must not be shared with forked worker processes
+os.register_at_fork(after_in_child=_reset_clients)
 
 class Model:
     @property
@@ -16,27 +53,42 @@ class Model:
             params["temperature"] = self.temperature
         return params
 
-    def __init__(self, model_name, base_url, api_key):
+    def __init__(self, model_name, base_url, api_key, cache: ResponseCache = None):
         self.model: str = model_name
         self.max_tokens: int = 4096
-        self.client = OpenAI(
-            api_key=api_key,
-            base_url=base_url,
-        )
+        self.base_url: str = base_url
+        self.api_key: str = api_key
+        self.cache = cache
+
+    @property
+    def client(self) -> OpenAI:
+        return get_client(self.base_url, self.api_key)
 
     def post(self, request: Any) -> Any:
+        if self.cache is not None:
+            cache_key, response = self.cache.get(request)
+            if response is not None:
+                return response
         retries = 5
         for _ in range(retries):
             response = self.client.chat.completions.create(**request)
-            try:
-                choice = response.choices[0]
-                if choice.finish_reason != 'stop':
-                    print(f"Finish reason: {choice.finish_reason}")
-                    raise NotImplementedError
+            if self.check_response(response):
+                if self.cache is not None:
+                    self.cache.put(cache_key, response)
                 return response
-            except:
-                print(f"Response content: {response}")
         raise NotImplementedError
+
+    def check_response(self, response: Any) -> bool:
+        try:
+            choice = response.choices[0]
+        except (AttributeError, IndexError, TypeError):
+            print(f"Response content: {response}")
+            return False
+        if choice.finish_reason != 'stop':
+            print(f"Finish reason: {choice.finish_reason}")
+            print(f"Response content: {response}")
+            return False
+        return True
     
     def generate(self, prompt: str, model: str=None):
         request = {
@@ -70,10 +122,10 @@ class Model:
         return response.choices[0].message.content.rstrip()
 
 class LocalModel(Model):
-    def __init__(self, model_name, base_url="http://localhost:8000/v1"):
-        super().__init__(model_name, base_url, api_key='EMPTY')
+    def __init__(self, model_name, base_url="http://localhost:8000/v1", cache: ResponseCache = None):
+        super().__init__(model_name, base_url, api_key='EMPTY', cache=cache)
 
 class ChatGPT(Model):
-    def __init__(self, model_name="gpt-4-0125-preview", base_url="https://api.openai.com/v1"):
+    def __init__(self, model_name="gpt-4-0125-preview", base_url="https://api.openai.com/v1", cache: ResponseCache = None):
         api_key=open('openai_key').read()
-        super().__init__(model_name, base_url, api_key=api_key)
+        super().__init__(model_name, base_url, api_key=api_key, cache=cache)
@@ -0,0 +1,123 @@
+import re
+from placement_format import re_number
+
+# The rule-based cleaning and filtering of scene descriptions, compiled once.
+# A description is scanned once for its bracketed values and its quantities in
+# centimeters, and every rule is applied to each of them where it is found,
+# instead of searching the whole text once per rule and replacing each match
+# everywhere in it. Each ban word is searched for once.
+
+
+# unit normalization, applied in this order to each bracket
+# (the lookahead lets the scan skip to the next "[" or digit)
+re_unit_token = re.compile(r'(?=[\[\d])(?:(?P<bracket>\[[^\[\]]*\])(?P<unit>\s*(?:mm| millimeters))?|(?P<cm>\d+(?:\.\d+)?)\s*(?:cm|centimeters))')
+re_unit_bracket = re.compile(r'(?P<bracket>\[[^\[\]]*\])(?P<unit>\s*(?:mm| millimeters))?')
+re_unit_mm_after = re.compile(rf'\[{re_number},\s*{re_number}(?:,\s*{re_number})?\]')
+re_unit_meters_2d = re.compile(rf'\[({re_number})\s*m,\s*({re_number})\s*m\]')
+re_unit_meters_3d = re.compile(rf'\[({re_number})\s*m,\s*({re_number})\s*m,\s*({re_number})\s*m?\]')
+re_unit_mm_inside = re.compile(rf'\[{re_number}\s*mm,\s*{re_number}\s*mm(?:,\s*{re_number}\s*mm)?\]')
+re_unit_mm = re.compile(r'\s*mm')
+re_unit_cm = re.compile(r'(\d+(?:\.\d+)?)\s*(?:cm|centimeters)')
+# [x, y] and [x, y, z] of plain numbers; the space after "[" decides whether z is set to 0
+re_coord = re.compile(rf'\[(\s*)({re_number})\s*,\s*({re_number})\s*(?:,\s*({re_number})\s*)?\]')
+
+# filters, applied to each bracket up to the last "]" before the next "["
+re_filter_token = re.compile(r'\[[^\[]*\]')
+re_cjk = re.compile(r'[\u4e00-\u9fff]')
+re_vertical = re.compile(r'\[[-\d\s.m]+\s*,\s*[-\d\s.m]+\s*,\s*([-\d\s.m]+)\]')
+vertical_zeros = ['0', '0.0', '0m', '0.0m', '0mm', '0.0mm']
+re_bracketed = re.compile(r'\[[^\[]+\s*,\s*[^\[]+\s*(?:,\s*[^\[]+)?\]')
+re_valid_coord = re.compile(r'\[-?\d+(\.\d+)?\s*(m|mm)?\s*,\s*-?\d+(\.\d+)?\s*(m|mm)?\s*(,\s*-?\d+(\.\d+)?\s*(m|mm)?)?\]$')
+ban_words = ['\n', 'without', 'instead', 'not', 'now', 'no', 'east', 'west', 'north', 'south', 'workbench', 'euclid']
+ban_whole_words = ['not', 'now', 'no']
+# "not", "now" and "no" are whole words: after a space or at the start, and
+# before a space, ".", "," or the end; they are found together by one search
+re_ban_no = re.compile(r'no[tw]?(?=\s|$|\.|,)')
+
+filter_messages = {
+    'language': "The description should only contain English in proper upper and lower cases.",
+    'vertical': "The z-coordinates should be 0.",
+    'coordinate': "The coordinates should contain three values in millimeters in the form of [x, y, 0] with x and y being specific numbers.",
+    'ban_words': "The description should not contain these words: {}",
+}
+
+def cm_to_meters(value):
+    return str(float(value) / 100) + ' meters'
+
+def normalize_token(m):
+    if m.lastgroup == 'cm':
+        return cm_to_meters(m.group('cm'))
+    coord, unit = m.group('bracket'), m.group('unit') or ''
+    # mm after the coordinate
+    if unit and re_unit_mm_after.fullmatch(coord):
+        unit = ''
+    if 'm' in coord:
+        # [x m, y m] and [x m, y m, z m] to millimeters
+        match = re_unit_meters_2d.fullmatch(coord) or re_unit_meters_3d.fullmatch(coord)
+        if match is not None:
+            coord = '[' + ', '.join(str(int(float(v) * 1000)) for v in match.groups()) + ']'
+        # mm inside the coordinate
+        elif re_unit_mm_inside.fullmatch(coord):
+            coord = re_unit_mm.sub('', coord)
+    if 'c' in coord:
+        coord = re_unit_cm.sub(lambda c: cm_to_meters(c.group(1)), coord)
+    # z = 0, added to 2D coordinates, then [x, y, z] spaced the same way
+    match = re_coord.fullmatch(coord)
+    if match is not None:
+        space, x, y, z = match.groups()
+        if z is None:
+            coord = coord if space else f"[{x}, {y}, 0]"
+        else:
+            coord = f"[{x}, {y}, {z if space else 0}]"
+    return coord + unit
+
+def normalize_units(text):
+    text = text.replace('(', '[').replace(')', ']')
+    if 'cm' in text or 'centimeters' in text:
+        return re_unit_token.sub(normalize_token, text)
+    if '[' in text:
+        return re_unit_bracket.sub(normalize_token, text)
+    return text
+
+def find_ban_words(text):
+    # the first match of each ban word in the lowercase text, with the spaces
+    # and punctuation around the whole words
+    text = text.lower()
+    found = {}
+    if 'no' in text:
+        for m in re_ban_no.finditer(text):
+            start, end = m.span()
+            if m.group() not in found and (start == 0 or text[start - 1].isspace()):
+                found[m.group()] = text[max(start - 1, 0):end + 1]
+    return [found.get(w, w) for w in ban_words if w in found or w not in ban_whole_words and w in text]
+
+def filter_reasons(text):
+    reasons = []
+    if re_cjk.search(text) is not None or text == text.upper():
+        reasons.append(filter_messages['language'])
+    vertical, coordinate = False, False
+    if '[' in text:
+        for m in re_filter_token.finditer(text):
+            token = m.group()
+            if not vertical:
+                z = re_vertical.fullmatch(token, 0, token.find(']') + 1)
+                vertical = z is not None and z.group(1) not in vertical_zeros
+            if not coordinate:
+                bracketed = re_bracketed.match(token)
+                coordinate = bracketed is not None and re_valid_coord.match(bracketed.group()) is None
+    if vertical:
+        reasons.append(filter_messages['vertical'])
+    if coordinate:
+        reasons.append(filter_messages['coordinate'])
+    words = find_ban_words(text)
+    if len(words) > 0:
+        reasons.append(filter_messages['ban_words'].format(words))
+    return reasons
+
+def filter_descriptions(texts):
+    # (should_filter, reason) for each description, by the rules alone
+    results = []
+    for text in texts:
+        reasons = filter_reasons(text)
+        results.append((True, '\n'.join(reasons)) if len(reasons) > 0 else (False, None))
+    return results